@@ -1,7 +1,8 @@
 # app.py - Enhanced Multi-Agent Kinh Dich Application
+import atexit
 import gradio as gr
 import asyncio
-from orchestrator import answer_with_agents
+from orchestrator import stream_with_agents, startup, shutdown
 from hexagram_caster import HexagramCaster
 
 class MultiAgentKinhDichApp:
@@ -134,9 +135,18 @@ class MultiAgentKinhDichApp:
                 yield history, "", display_info, {}, [] # Cập nhật UI ngay lập tức
 
                 try:
-                    result = await answer_with_agents(message, user_name, hexagram_info=hexagram_info_dict)
+                    result = {}
+                    streamed = ""
+                    async for event in stream_with_agents(message, user_name, hexagram_info=hexagram_info_dict):
+                        if event["type"] == "token":
+                            # Token đầu tiên thay tin nhắn progress, các token sau nối tiếp
+                            streamed += event["text"]
+                            history[-1] = gr.ChatMessage(role="assistant", content=streamed)
+                            yield history, "", display_info, {}, []
+                        else:
+                            result = event["result"]
                     
-                    # Xóa tin nhắn progress và thay bằng kết quả
+                    # Thay bản đang stream bằng kết quả cuối (citation đã xử lý)
                     history.pop()
                     
                     # Enhanced response với metadata
@@ -180,9 +190,17 @@ class MultiAgentKinhDichApp:
 
                 try:
                     # Pure Q&A: Không có hexagram context
-                    result = await answer_with_agents(message, user_name, hexagram_info=None)
+                    result = {}
+                    streamed = ""
+                    async for event in stream_with_agents(message, user_name, hexagram_info=None):
+                        if event["type"] == "token":
+                            streamed += event["text"]
+                            history[-1] = gr.ChatMessage(role="assistant", content=streamed)
+                            yield history, "", {}, []
+                        else:
+                            result = event["result"]
                     
-                    # Replace progress với actual response
+                    # Replace progress / streamed text với actual response
                     history.pop()
                     
                     # Enhanced response với mode indicator
@@ -266,6 +284,11 @@ class MultiAgentKinhDichApp:
         return interface
 
 def main():
+    # Warm-up agents một lần cho toàn process, đóng tài nguyên khi thoát
+    orchestrator = startup()
+    atexit.register(shutdown)
+    print(f"🩺 Orchestrator status: {orchestrator.status}")
+
     app = MultiAgentKinhDichApp()
     interface = app.create_interface()
     
@@ -2,11 +2,13 @@ import asyncio
 import logging
 import time
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional
 from dataclasses import dataclass, field
 from enum import Enum
 from tqdm import tqdm
 
+from records import ChunkRecord
+
 logger = logging.getLogger(__name__)
 
 class AgentType(Enum):
@@ -23,8 +25,12 @@ class ProcessingState:
     query_type: str = ""
     entities: Dict[str, List[str]] = field(default_factory=dict)
     expanded_query: str = ""
-    retrieved_docs: List[Dict] = field(default_factory=list)
-    reranked_docs: List[Dict] = field(default_factory=list)
+    # Records bất biến (có thể dùng chung với cache); score của request nằm ở mảng song song
+    retrieved_docs: List[ChunkRecord] = field(default_factory=list)
+    retrieval_scores: List[float] = field(default_factory=list)
+    reranked_docs: List[ChunkRecord] = field(default_factory=list)
+    rerank_scores: List[float] = field(default_factory=list)
+    query_embedding: Optional[Any] = None  # np.ndarray nếu retrieval đã encode query
     final_response: str = ""
     confidence: float = 0.0
     reasoning_chain: List[str] = field(default_factory=list)
@@ -46,6 +52,21 @@ class BaseAgent(ABC):
     async def process(self, state: ProcessingState) -> ProcessingState:
         """Main processing method - must be implemented by subclasses"""
         pass
+
+    async def stream(self, state: ProcessingState) -> AsyncIterator[str]:
+        """Optional hook: như ``process`` nhưng trả từng phần câu trả lời khi có.
+        Mặc định chạy ``process`` và không trả phần nào."""
+        await self.process(state)
+        return
+        yield  # async generator
+    
+    async def warm_up(self) -> None:
+        """Optional hook: preload models/connections trước khi nhận request"""
+        return None
+
+    def close(self) -> None:
+        """Optional hook: giải phóng tài nguyên khi shutdown"""
+        return None
     
     async def execute_with_monitoring(self, state: ProcessingState) -> ProcessingState:
         """Execute với performance monitoring"""
@@ -69,6 +90,26 @@ class BaseAgent(ABC):
             logger.error(f"{self.name} failed: {e}")
             raise
     
+    async def stream_with_monitoring(self, state: ProcessingState) -> AsyncIterator[str]:
+        """``stream`` với cùng performance monitoring như ``execute_with_monitoring``"""
+        start_time = time.time()
+        
+        try:
+            logger.info(f"{self.name} streaming...")
+            async for chunk in self.stream(state):
+                yield chunk
+            
+            processing_time = time.time() - start_time
+            state.processing_time[self.name] = processing_time
+            self._update_performance_stats(processing_time, True)
+            logger.info(f"{self.name} completed in {processing_time:.3f}s")
+            
+        except Exception as e:
+            processing_time = time.time() - start_time
+            self._update_performance_stats(processing_time, False)
+            logger.error(f"{self.name} failed: {e}")
+            raise
+    
     def _update_performance_stats(self, processing_time: float, success: bool):
         """Update agent performance statistics"""
         self.performance_stats["total_requests"] += 1
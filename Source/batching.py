@@ -0,0 +1,121 @@
+"""
+Module batching.py - Micro-batching cho các model dùng chung giữa nhiều request
+"""
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """Gom các lời gọi đồng thời thành một batch và chạy trên một worker thread.
+
+    Chỉ worker thread gọi ``fn`` nên model bên dưới không cần thread-safe.
+    ``fn`` nhận list items và trả về list kết quả cùng độ dài.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "batcher",
+    ) -> None:
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "items": 0, "max_batch": 0}
+
+    # ------------------------------------------------------------------
+    def submit(self, items: List[Any]) -> Future:
+        """Đưa items vào hàng đợi, trả về Future chứa list kết quả"""
+        future: Future = Future()
+        if not items:
+            future.set_result([])
+            return future
+        self._ensure_worker()
+        self._queue.put((list(items), future))
+        return future
+
+    def run(self, items: List[Any]) -> List[Any]:
+        """Blocking helper: submit và chờ kết quả"""
+        return self.submit(items).result()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(_STOP)
+                self._thread.join(timeout=5)
+                self._thread = None
+
+    # ------------------------------------------------------------------
+    def _ensure_worker(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self, first: Tuple[List[Any], Future]) -> Tuple[List[Tuple[List[Any], Future]], bool]:
+        jobs = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return jobs, True
+            jobs.append(job)
+            size += len(job[0])
+        return jobs, False
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            jobs, stop = self._collect(first)
+            jobs = [job for job in jobs if job[1].set_running_or_notify_cancel()]
+            if jobs:
+                self._run_batch(jobs)
+            if stop:
+                return
+
+    def _run_batch(self, jobs: List[Tuple[List[Any], Future]]) -> None:
+        flat: List[Any] = [item for items, _ in jobs for item in items]
+        try:
+            results = list(self.fn(flat))
+            if len(results) != len(flat):
+                raise RuntimeError(f"{self.name}: expected {len(flat)} results, got {len(results)}")
+        except Exception as exc:
+            logger.error("%s batch failed: %s", self.name, exc)
+            for _, future in jobs:
+                future.set_exception(exc)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["items"] += len(flat)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(flat))
+
+        offset = 0
+        for items, future in jobs:
+            future.set_result(results[offset:offset + len(items)])
+            offset += len(items)
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: mapping.detect_hexagram (automaton một lượt quét) so với bản cũ
+(sort keywords mỗi lần gọi + vòng lặp lồng trên HEXAGRAM_MAP).
+
+    python Source/bench_mapping.py [--repeat 2000]
+"""
+import argparse
+import re
+import time
+from typing import Callable, List, Optional
+
+from mapping import HEXAGRAM_MAP, detect_hexagram, detect_hexagrams
+
+QUERIES = [
+    "Quẻ Cách nói gì về sự thay đổi trong công việc?",
+    "Ý nghĩa của quẻ Kiền và quẻ Khôn",
+    "Tôi muốn biết về tình yêu và hôn nhân",
+    "Hào 3 quẻ Thủy Hỏa Ký Tế",
+    "Giải thích quẻ Địa Thiên Thái",
+    "Nên làm gì khi gặp khó khăn trong kinh doanh?",
+    "great taming và small taming khác nhau thế nào",
+    "Quẻ Vị Tế có phải là quẻ cuối cùng không",
+    "Làm sao để giữ bình tĩnh trước thử thách",
+    "Trung Phu là gì",
+]
+
+
+def legacy_detect_hexagram(text: str) -> Optional[str]:
+    """Bản cũ của mapping.detect_hexagram (giữ lại để so sánh)"""
+    if not text:
+        return None
+    text_clean = re.sub(r'[^\w\s]', ' ', text.lower().strip())
+    for code, keywords in HEXAGRAM_MAP.items():
+        for keyword in sorted(keywords, key=len, reverse=True):
+            if keyword in text_clean:
+                return code
+    return None
+
+
+def _bench(fn: Callable[[str], object], queries: List[str], repeat: int) -> float:
+    """Thời gian trung bình mỗi lời gọi (µs)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            fn(query)
+    return (time.perf_counter() - start) / (repeat * len(queries)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    detect_hexagram(QUERIES[0])  # load lexicon trước khi đo
+
+    agree = sum(legacy_detect_hexagram(q) == detect_hexagram(q) for q in QUERIES)
+    print(f"Kết quả trùng bản cũ: {agree}/{len(QUERIES)}")
+    for query in QUERIES:
+        found = ", ".join(f"{m.code}:{m.keyword}@{m.start}-{m.end}({m.confidence:.1f})" for m in detect_hexagrams(query))
+        print(f"  {query!r} → {legacy_detect_hexagram(query)} | {detect_hexagram(query)} | {found or '-'}")
+
+    legacy = _bench(legacy_detect_hexagram, QUERIES, args.repeat)
+    fast = _bench(detect_hexagram, QUERIES, args.repeat)
+    every = _bench(detect_hexagrams, QUERIES, args.repeat)
+    print(f"legacy detect_hexagram : {legacy:8.1f} µs/query")
+    print(f"detect_hexagram        : {fast:8.1f} µs/query  (x{legacy / fast:.1f})")
+    print(f"detect_hexagrams (all) : {every:8.1f} µs/query  (x{legacy / every:.1f})")
+
+
+if __name__ == "__main__":
+    main()
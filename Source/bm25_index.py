@@ -0,0 +1,224 @@
+"""
+Module bm25_index.py - BM25 inverted index in-process trên ``tokenized_text``
+
+Thay cho Mongo ``$text``: dùng đúng phân đoạn từ của ``underthesea.word_tokenize``
+(từ ghép nối bằng "_") mà data_loader đã tạo. Postings lưu dạng CSR:
+  - term_offsets[t] : postings của term t nằm trong [term_offsets[t], term_offsets[t+1])
+  - post_docs       : doc row (int32), sắp tăng dần trong mỗi term
+  - post_tf         : term frequency (uint16)
+vocab.json ghi kèm doc_ids, count và fingerprint text corpus (như vector_index): corpus
+đổi thì index được build lại thay vì trả doc_id / score cũ.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import STOP_WORDS
+from passage_index import corpus_fingerprint
+from records import ChunkRecord
+
+logger = logging.getLogger(__name__)
+
+_PUNCT_RE = re.compile(r"^[^\w]+|[^\w]+$")
+
+
+def tokenize(tokenized_text: str, stop_words: Iterable[str] = STOP_WORDS) -> List[str]:
+    """Tách output word_tokenize(format="text") thành terms: lowercase, bỏ dấu câu và stop words"""
+    stop = stop_words if isinstance(stop_words, (set, frozenset)) else set(stop_words)
+    terms = []
+    for raw in tokenized_text.lower().split():
+        term = _PUNCT_RE.sub("", raw)
+        if term and term not in stop and term.replace("_", " ") not in stop:
+            terms.append(term)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 với postings nén dạng mảng numpy."""
+
+    def __init__(
+        self,
+        terms: List[str],
+        term_offsets: np.ndarray,
+        post_docs: np.ndarray,
+        post_tf: np.ndarray,
+        doc_lengths: np.ndarray,
+        doc_ids: List[str],
+        k1: float = 1.5,
+        b: float = 0.75,
+        fingerprint: str = "",
+    ) -> None:
+        self.terms = terms
+        self.vocab: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.post_docs = post_docs
+        self.post_tf = post_tf
+        self.doc_lengths = doc_lengths
+        self.doc_ids = doc_ids
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = fingerprint
+
+        n_docs = len(doc_ids)
+        df = np.diff(term_offsets).astype(np.float32)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_lengths.mean()) if n_docs else 1.0
+        # Phần mẫu số phụ thuộc độ dài doc: k1 * (1 - b + b * dl / avgdl)
+        self._doc_norm = (k1 * (1.0 - b + b * doc_lengths / max(avgdl, 1e-6))).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    # ------------------------------------------------------------------
+    @classmethod
+    def build(
+        cls,
+        doc_ids: Sequence[str],
+        tokenized_texts: Sequence[str],
+        stop_words: Iterable[str] = STOP_WORDS,
+        k1: float = 1.5,
+        b: float = 0.75,
+        fingerprint: str = "",
+    ) -> "BM25Index":
+        """``fingerprint``: ``corpus_fingerprint`` của các record nguồn, để ``load`` so với corpus hiện tại"""
+        stop = set(stop_words)
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(doc_ids), dtype=np.int32)
+        for row, text in enumerate(tokenized_texts):
+            counts = Counter(tokenize(text or "", stop))
+            doc_lengths[row] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((row, tf))
+
+        terms = sorted(postings)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            term_offsets[i + 1] = term_offsets[i] + len(postings[term])
+        post_docs = np.empty(int(term_offsets[-1]), dtype=np.int32)
+        post_tf = np.empty(int(term_offsets[-1]), dtype=np.uint16)
+        for i, term in enumerate(terms):
+            start, end = term_offsets[i], term_offsets[i + 1]
+            rows, tfs = zip(*postings[term])
+            post_docs[start:end] = rows
+            post_tf[start:end] = np.minimum(tfs, np.iinfo(np.uint16).max)
+        return cls(terms, term_offsets, post_docs, post_tf, doc_lengths, list(doc_ids), k1, b, fingerprint)
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        tmp = path / "postings.tmp.npz"
+        np.savez(
+            tmp,
+            term_offsets=self.term_offsets,
+            post_docs=self.post_docs,
+            post_tf=self.post_tf,
+            doc_lengths=self.doc_lengths,
+        )
+        os.replace(tmp, path / "postings.npz")
+        meta = {
+            "terms": self.terms,
+            "doc_ids": self.doc_ids,
+            "count": len(self.doc_ids),
+            "fingerprint": self.fingerprint,
+            "k1": self.k1,
+            "b": self.b,
+        }
+        tmp_meta = path / "vocab.tmp.json"
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_meta, path / "vocab.json")
+
+    @classmethod
+    def load(cls, path: Path, corpus: Optional[Iterable[ChunkRecord]] = None) -> "BM25Index":
+        """Load postings + vocab; có ``corpus`` thì kiểm tra index được build từ đúng corpus đó.
+
+        ValueError nếu artifact không nhất quán, hoặc lệch corpus (thiếu / thừa id, text đã đổi).
+        """
+        path = Path(path)
+        meta = json.loads((path / "vocab.json").read_text(encoding="utf-8"))
+        doc_ids = meta["doc_ids"]
+        with np.load(path / "postings.npz") as arrays:
+            index = cls(
+                meta["terms"],
+                arrays["term_offsets"],
+                arrays["post_docs"],
+                arrays["post_tf"],
+                arrays["doc_lengths"],
+                doc_ids,
+                meta.get("k1", 1.5),
+                meta.get("b", 0.75),
+                meta.get("fingerprint", ""),
+            )
+        if not len(doc_ids) == len(index.doc_lengths) == meta.get("count", len(doc_ids)):
+            raise ValueError(
+                f"BM25 index {path} không nhất quán: {len(index.doc_lengths)} rows, "
+                f"{len(doc_ids)} ids, meta {meta.get('count')}"
+            )
+        if corpus is not None:
+            by_id = {record._id: record for record in corpus}
+            missing = [doc_id for doc_id in doc_ids if doc_id not in by_id]
+            if missing:
+                raise ValueError(f"BM25 index {path}: {len(missing)} id không có trong corpus (vd. {missing[0]!r})")
+            if len(by_id) != len(doc_ids):
+                raise ValueError(f"BM25 index {path}: {len(doc_ids)} docs, corpus có {len(by_id)}")
+            if index.fingerprint != corpus_fingerprint([by_id[doc_id] for doc_id in doc_ids]):
+                raise ValueError(f"BM25 index {path}: text corpus đã thay đổi")
+        return index
+
+    # ------------------------------------------------------------------
+    def search(self, tokenized_query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-k (doc_id, bm25 score) cho query đã qua word_tokenize(format="text")"""
+        term_ids = [self.vocab[t] for t in set(tokenize(tokenized_query)) if t in self.vocab]
+        if not term_ids or k <= 0:
+            return []
+
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            rows = self.post_docs[start:end]
+            tf = self.post_tf[start:end].astype(np.float32)
+            scores[rows] += self.idf[term_id] * tf * (self.k1 + 1.0) / (tf + self._doc_norm[rows])
+
+        candidates = np.flatnonzero(scores)
+        k = min(k, len(candidates))
+        if not k:
+            return []
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.doc_ids[row], float(scores[row])) for row in top]
+
+
+def load_or_build_bm25_index(path: Path) -> BM25Index:
+    """Load index đã serialize; nếu chưa có (hoặc lệch corpus) thì tokenize corpus từ CHUNKS_DATA_DIR (không embed)"""
+    path = Path(path)
+    if (path / "vocab.json").exists():
+        from corpus_store import get_corpus_store
+
+        try:
+            index = BM25Index.load(path, get_corpus_store().docs)
+            logger.info("Loaded BM25 index: %d docs, %d terms from %s", len(index), len(index.terms), path)
+            return index
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Failed to load BM25 index %s: %s", path, exc)
+
+    from data_loader import KinhDichDataLoader
+
+    docs = KinhDichDataLoader().build_documents(with_embeddings=False)
+    index = BM25Index.build(
+        [doc["_id"] for doc in docs],
+        [doc["tokenized_text"] for doc in docs],
+        fingerprint=corpus_fingerprint([ChunkRecord.from_document(doc) for doc in docs]),
+    )
+    try:
+        index.save(path)
+    except OSError as exc:
+        logger.warning("Failed to persist BM25 index %s: %s", path, exc)
+    logger.info("Built BM25 index: %d docs, %d terms", len(index), len(index.terms))
+    return index
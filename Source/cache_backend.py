@@ -0,0 +1,282 @@
+"""
+Module cache_backend.py - Backend cache dùng chung cho retrieval và LLM
+
+- ``MemoryBackend``: LRU + TTL trong process (cachetools.TTLCache) - mặc định.
+- ``SQLiteBackend``: một file SQLite (WAL) cho mọi worker trên cùng máy; value
+  serialize bằng pickle (protocol cao nhất), nén zlib khi lớn.
+- ``TieredBackend``: L1 trong process phía trước L2 dùng chung, hit L1 không cần unpickle.
+
+``make_cache_backend`` chọn backend theo CACHE_BACKEND (memory | sqlite). Mỗi cache
+là một namespace riêng trong cùng file, có maxsize/TTL riêng.
+Cache không bao giờ làm hỏng request: lỗi SQLite chỉ log và coi như miss.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from config import CACHE_BACKEND, CACHE_DB_PATH, CACHE_L1_MAXSIZE
+
+logger = logging.getLogger(__name__)
+
+_COMPRESS_MIN_BYTES = 512
+_EVICT_EVERY = 64  # số lần set (tối đa) giữa hai lượt dọn entry hết hạn / vượt maxsize
+_TOUCH_INTERVAL = 1.0  # giây: cập nhật ``accessed`` khi đọc không quá một lần mỗi khoảng này
+
+
+def dumps(value: Any) -> bytes:
+    """pickle + zlib (chỉ khi đáng nén); byte đầu đánh dấu định dạng"""
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) >= _COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(data, 6)
+    return b"p" + data
+
+
+def loads(blob: bytes) -> Any:
+    data = bytes(blob)
+    if data[:1] == b"z":
+        return pickle.loads(zlib.decompress(data[1:]))
+    return pickle.loads(data[1:])
+
+
+class CacheBackend(ABC):
+    """Key (str) → value, có maxsize và TTL theo namespace."""
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float) -> None:
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Value còn hạn hoặc None"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """LRU + TTL trong process."""
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float) -> None:
+        super().__init__(namespace, maxsize, ttl)
+        self._entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._entries.expire()
+            return len(self._entries)
+
+
+class SQLiteBackend(CacheBackend):
+    """Bảng ``cache(namespace, key, value, expires, accessed)`` trong một file WAL dùng chung.
+
+    Mỗi thread một connection (autocommit). LRU theo ``accessed``; entry hết hạn và
+    phần vượt maxsize được dọn định kỳ khi ghi.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed);
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float, path: Path = CACHE_DB_PATH) -> None:
+        super().__init__(namespace, maxsize, ttl)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        self._evict_every = max(1, min(_EVICT_EVERY, maxsize // 8))
+        self._conn().executescript(self._SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires, accessed FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires, accessed = row
+            if expires <= now:
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                return None
+            if now - accessed > _TOUCH_INTERVAL:
+                # Ghi là phần đắt của một lần đọc: chỉ làm mới thứ tự LRU khi đã cũ
+                conn.execute(
+                    "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key)
+                )
+            return loads(value)
+        except (sqlite3.Error, pickle.PickleError, zlib.error, EOFError) as exc:
+            logger.warning("cache %s: get failed: %s", self.namespace, exc)
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        try:
+            blob = dumps(value)
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, sqlite3.Binary(blob), now + self.ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self._evict_every == 0:
+                self.evict()
+        except (sqlite3.Error, pickle.PickleError, TypeError, AttributeError) as exc:
+            logger.warning("cache %s: set failed: %s", self.namespace, exc)
+
+    def evict(self) -> None:
+        """Xóa entry hết hạn rồi giữ lại ``maxsize`` entry dùng gần nhất"""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE namespace = ? AND expires <= ?", (self.namespace, time.time()))
+        conn.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key IN ("
+            " SELECT key FROM cache WHERE namespace = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.maxsize),
+        )
+
+    def delete(self, key: str) -> None:
+        try:
+            self._conn().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+        except sqlite3.Error as exc:
+            logger.warning("cache %s: delete failed: %s", self.namespace, exc)
+
+    def clear(self) -> None:
+        try:
+            self._conn().execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        except sqlite3.Error as exc:
+            logger.warning("cache %s: clear failed: %s", self.namespace, exc)
+
+    def __len__(self) -> int:
+        try:
+            row = self._conn().execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ? AND expires > ?", (self.namespace, time.time())
+            ).fetchone()
+            return int(row[0])
+        except sqlite3.Error:
+            return 0
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class TieredBackend(CacheBackend):
+    """L1 (trong process) trước L2 (dùng chung): miss L1 thì đọc L2 rồi nạp lại L1."""
+
+    def __init__(self, l1: CacheBackend, l2: CacheBackend) -> None:
+        super().__init__(l2.namespace, l2.maxsize, l2.ttl)
+        self.l1 = l1
+        self.l2 = l2
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.l1.get(key)
+        if value is None:
+            value = self.l2.get(key)
+            if value is not None:
+                self.l1.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.l1.set(key, value)
+        self.l2.set(key, value)
+
+    def delete(self, key: str) -> None:
+        self.l1.delete(key)
+        self.l2.delete(key)
+
+    def clear(self) -> None:
+        self.l1.clear()
+        self.l2.clear()
+
+    def __len__(self) -> int:
+        return len(self.l2)
+
+    def close(self) -> None:
+        self.l2.close()
+
+
+_BACKENDS: Dict[str, CacheBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def make_cache_backend(namespace: str, maxsize: int, ttl: float, backend: str = CACHE_BACKEND) -> CacheBackend:
+    """Backend theo CACHE_BACKEND; cùng namespace trong một process dùng chung một instance"""
+    with _backends_lock:
+        cache = _BACKENDS.get(namespace)
+        if cache is None:
+            if backend == "sqlite":
+                l1 = MemoryBackend(namespace, min(maxsize, CACHE_L1_MAXSIZE), ttl)
+                cache = TieredBackend(l1, SQLiteBackend(namespace, maxsize, ttl))
+            else:
+                cache = MemoryBackend(namespace, maxsize, ttl)
+            _BACKENDS[namespace] = cache
+            logger.debug("cache %s: %s backend (pid %d)", namespace, backend, os.getpid())
+        return cache
@@ -0,0 +1,80 @@
+"""
+Kiểm tra bộ lọc bigram (``NGramIndex.candidates``) của fuzzy concept matching: với mọi
+query thử, ``extractOne`` trên tập ứng viên đã lọc phải trùng kết quả quét toàn bộ key.
+
+Query thử sinh từ chính các concept key: nguyên key, từng từ của key, mọi đoạn con,
+key đặt trong câu, và biến thể một lỗi gõ (thay / xóa / chèn ký tự, seed cố định).
+
+    python Source/check_concept_fuzzy.py [--threshold 80] [--variants 5]
+
+Exit code 1 nếu có query nào lệch.
+"""
+import argparse
+import random
+import sys
+import time
+from typing import List, Set
+
+from rapidfuzz import fuzz, process as rf_process
+
+from lexicon import get_lexicon
+
+_ALPHABET = "aăâbcdđeêghiklmnoôơpqrstuưvxyàáảãạằắẳẵặầấẩẫậèéẻẽẹềếểễệìíỉĩịòóỏõọồốổỗộờớởỡợùúủũụừứửữựỳýỷỹỵ "
+
+
+def _queries(keys: List[str], variants: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    queries: Set[str] = set()
+    for key in keys:
+        queries.add(key)
+        queries.update(key.split())
+        queries.update(key[i:j] for i in range(len(key)) for j in range(i + 1, len(key) + 1))
+        queries.add(f"tôi muốn biết về {key} trong công việc")
+        for _ in range(variants):
+            chars = list(key)
+            pos = rng.randrange(len(chars))
+            op = rng.randrange(3)
+            if op == 0:
+                chars[pos] = rng.choice(_ALPHABET)
+            elif op == 1:
+                del chars[pos]
+            else:
+                chars.insert(pos, rng.choice(_ALPHABET))
+            typo = "".join(chars)
+            queries.update((typo, f"tôi muốn biết về {typo} trong công việc"))
+    queries.discard("")
+    return sorted(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threshold", type=float, default=80)
+    parser.add_argument("--variants", type=int, default=5, help="số biến thể lỗi gõ mỗi key")
+    args = parser.parse_args()
+
+    index = get_lexicon().fuzzy_index("concepts")
+    queries = _queries(index.keys, args.variants)
+    mismatches = []
+    scanned = 0
+    start = time.perf_counter()
+    for query in queries:
+        candidates = index.candidates(query, args.threshold)
+        scanned += len(candidates)
+        full = rf_process.extractOne(query, index.keys, scorer=fuzz.partial_ratio, score_cutoff=args.threshold)
+        filtered = rf_process.extractOne(
+            query, candidates, scorer=fuzz.partial_ratio, score_cutoff=args.threshold
+        ) if candidates else None
+        if (full and full[0]) != (filtered and filtered[0]):
+            mismatches.append((query, full, filtered))
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(index.keys)} concept keys, {len(queries)} queries, threshold {args.threshold:g}")
+    print(f"ứng viên trung bình: {scanned / len(queries):.1f} / {len(index.keys)} key ({elapsed:.1f}s)")
+    for query, full, filtered in mismatches[:20]:
+        print(f"  {query!r}: full scan {full} | prefilter {filtered}")
+    print(f"lệch: {len(mismatches)}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Kiểm tra parity của INFERENCE_BACKEND (int8 / onnx) so với PyTorch fp32 trên bộ query cố định.
+
+- Embedding: cosine giữa vector fp32 và vector backend; overlap top-k chunk khi xếp hạng
+  một mẫu corpus cố định theo cosine.
+- Cross-encoder: top-1 trùng và tỉ lệ cặp cùng thứ tự (pairwise agreement) trên top ứng viên.
+- Tổng latency của từng backend trên cùng bộ query/cặp.
+
+    python Source/check_inference_parity.py [--backend int8] [--sample 200] [--top-k 10]
+
+Exit code 1 nếu dưới ngưỡng (--min-overlap, --min-agreement).
+"""
+import argparse
+import sys
+import time
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+from config import CE_MODEL, EMBED_MODEL, INFERENCE_BACKEND
+from inference_backend import load_cross_encoder, load_embedding_model
+
+QUERIES = [
+    "Quẻ Cách nói gì về sự thay đổi trong công việc?",
+    "Ý nghĩa của quẻ Kiền và quẻ Khôn",
+    "Tôi muốn biết về tình yêu và hôn nhân",
+    "Hào 3 quẻ Thủy Hỏa Ký Tế",
+    "Giải thích quẻ Địa Thiên Thái",
+    "Nên làm gì khi gặp khó khăn trong kinh doanh?",
+    "Quẻ Vị Tế có phải là quẻ cuối cùng không",
+    "Làm sao để giữ bình tĩnh trước thử thách",
+    "Trung Phu là gì",
+    "Âm dương và ngũ hành trong Kinh Dịch",
+]
+
+
+def _timed(fn: Callable[[], np.ndarray]) -> Tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def _pairwise_agreement(a: Sequence[float], b: Sequence[float]) -> float:
+    """Tỉ lệ cặp (i, j) mà hai dãy score xếp cùng thứ tự"""
+    a, b = np.asarray(a), np.asarray(b)
+    i, j = np.triu_indices(len(a), k=1)
+    if not len(i):
+        return 1.0
+    return float(np.mean(np.sign(a[i] - a[j]) == np.sign(b[i] - b[j])))
+
+
+def _corpus_sample(size: int) -> List[str]:
+    from corpus_store import get_corpus_store
+
+    docs = get_corpus_store().docs
+    step = max(1, len(docs) // size)
+    return [doc.text[:512] for doc in docs[::step][:size]]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=INFERENCE_BACKEND if INFERENCE_BACKEND != "torch" else "int8")
+    parser.add_argument("--sample", type=int, default=200, help="số chunk cố định để xếp hạng")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--min-overlap", type=float, default=0.9)
+    parser.add_argument("--min-agreement", type=float, default=0.9)
+    args = parser.parse_args()
+
+    passages = _corpus_sample(args.sample)
+    ok = True
+
+    # Embedding ----------------------------------------------------------------
+    reference = load_embedding_model(EMBED_MODEL, backend="torch")
+    candidate = load_embedding_model(EMBED_MODEL, backend=args.backend, fallback=False)
+    ref_docs = _normalize(reference.encode(passages, convert_to_numpy=True))
+    cand_docs = _normalize(candidate.encode(passages, convert_to_numpy=True))
+    ref_q, ref_ms = _timed(lambda: _normalize(reference.encode(QUERIES, convert_to_numpy=True)))
+    cand_q, cand_ms = _timed(lambda: _normalize(candidate.encode(QUERIES, convert_to_numpy=True)))
+
+    cosines = np.sum(ref_q * cand_q, axis=1)
+    overlaps = []
+    for ref_vec, cand_vec in zip(ref_q, cand_q):
+        ref_top = set(np.argsort(-(ref_docs @ ref_vec))[:args.top_k])
+        cand_top = set(np.argsort(-(cand_docs @ cand_vec))[:args.top_k])
+        overlaps.append(len(ref_top & cand_top) / args.top_k)
+    overlap = float(np.mean(overlaps))
+    print(f"[embedding] {EMBED_MODEL} torch → {args.backend}")
+    print(f"  cosine(fp32, {args.backend}) min/mean: {cosines.min():.4f} / {cosines.mean():.4f}")
+    print(f"  overlap@{args.top_k} trên {len(passages)} chunks: {overlap:.3f}")
+    print(f"  latency {len(QUERIES)} queries: torch {ref_ms:.1f}ms, {args.backend} {cand_ms:.1f}ms")
+    ok &= overlap >= args.min_overlap
+
+    # Cross-encoder --------------------------------------------------------------
+    reference_ce = load_cross_encoder(CE_MODEL, backend="torch")
+    candidate_ce = load_cross_encoder(CE_MODEL, backend=args.backend, fallback=False)
+    agreements, top1 = [], []
+    ref_total = cand_total = 0.0
+    for query, ref_vec in zip(QUERIES, ref_q):
+        pool = [passages[i] for i in np.argsort(-(ref_docs @ ref_vec))[:args.top_k * 2]]
+        pairs = [[query, passage] for passage in pool]
+        ref_scores, ms = _timed(lambda: np.asarray(reference_ce.predict(pairs)).ravel())
+        ref_total += ms
+        cand_scores, ms = _timed(lambda: np.asarray(candidate_ce.predict(pairs)).ravel())
+        cand_total += ms
+        agreements.append(_pairwise_agreement(ref_scores, cand_scores))
+        top1.append(int(np.argmax(ref_scores) == np.argmax(cand_scores)))
+    agreement = float(np.mean(agreements))
+    print(f"[cross-encoder] {CE_MODEL} torch → {args.backend}")
+    print(f"  pairwise agreement: {agreement:.3f}, top-1 trùng: {sum(top1)}/{len(top1)}")
+    print(f"  latency {len(QUERIES)} × {args.top_k * 2} cặp: torch {ref_total:.1f}ms, {args.backend} {cand_total:.1f}ms")
+    ok &= agreement >= args.min_agreement
+
+    print("PARITY OK" if ok else "PARITY FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
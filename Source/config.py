@@ -20,6 +20,14 @@ CHUNKS_DATA_DIR = os.getenv(
 # Kích thước batch khi insert MongoDB
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))
 
+# Mongo I/O chạy trên thread pool giới hạn, có timeout (client + server side)
+MONGO_MAX_WORKERS = int(os.getenv("MONGO_MAX_WORKERS", "8"))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+
+# Tạo/kiểm tra index (text, hexagram, content_type, vector) một lần lúc startup
+MONGO_PROVISION_INDEXES = os.getenv("MONGO_PROVISION_INDEXES", "1").strip().lower() in {"1", "true", "yes"}
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS", "768"))
+
 # ═══════════════════════════════════════════════════════════════
 # EMBEDDING / RERANK MODELS
 # ═══════════════════════════════════════════════════════════════
@@ -27,11 +35,33 @@ BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))
 EMBED_MODEL = os.getenv("EMBED_MODEL", "keepitreal/vietnamese-sbert")
 CE_MODEL = os.getenv("CE_MODEL", "intfloat/multilingual-e5-base")
 
+# Inference backend cho embedding + cross-encoder trên CPU: "torch" (fp32), "int8" (dynamic
+# quantization) hoặc "onnx" (ONNX Runtime, cần optimum[onnxruntime]); kiểm tra thứ hạng
+# so với fp32 bằng Source/check_inference_parity.py trước khi bật
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").strip().lower()
+if INFERENCE_BACKEND not in {"torch", "int8", "onnx"}:
+    INFERENCE_BACKEND = "torch"
+
+# Shared embedder: micro-batching các lời gọi encode đồng thời
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+# Rerank service: gom batch các cặp (query, chunk) giữa các request + cache score theo
+# (query đã chuẩn hóa, chunk_id)
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_MAX_LATENCY_MS = float(os.getenv("RERANK_MAX_LATENCY_MS", "10"))
+RERANK_CACHE_MAXSIZE = int(os.getenv("RERANK_CACHE_MAXSIZE", "20000"))
+RERANK_CACHE_TTL = float(os.getenv("RERANK_CACHE_TTL", "86400"))
+# Cascade: lọc cosine (embedding query × embedding chunk) rồi chỉ top-N qua cross-encoder;
+# bỏ bước cross-encoder nếu ước lượng thời gian vượt ngân sách của bước rerank
+RERANK_PREFILTER_TOP_N = int(os.getenv("RERANK_PREFILTER_TOP_N", "12"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "400"))
+
 # ═══════════════════════════════════════════════════════════════
 # LLM PROVIDER CONFIGURATION
 # ═══════════════════════════════════════════════════════════════
 
-SUPPORTED_LLM_PROVIDERS = {"gemini", "openai", "local"}
+SUPPORTED_LLM_PROVIDERS = {"gemini", "openai", "local", "fake"}
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").strip().lower()
 if LLM_PROVIDER not in SUPPORTED_LLM_PROVIDERS:
     LLM_PROVIDER = "gemini"
@@ -58,6 +88,24 @@ LOCAL_MODEL_TYPE = os.getenv("LOCAL_MODEL_TYPE", "auto")
 LOCAL_DEVICE = os.getenv("LOCAL_DEVICE", "auto")
 LOCAL_MAX_NEW_TOKENS = int(os.getenv("LOCAL_MAX_NEW_TOKENS", "512"))
 
+# Fake backend (LLM_PROVIDER=fake): không cần network, để thử tải / lớp resilience
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "200"))
+FAKE_LLM_TOKEN_DELAY_MS = float(os.getenv("FAKE_LLM_TOKEN_DELAY_MS", "20"))
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))
+
+# Resilience layer quanh backend (theo provider): giới hạn request đồng thời, token bucket,
+# retry có jitter cho lỗi tạm thời, timeout mỗi request, circuit breaker fail fast
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+LLM_RATE_LIMIT_RPS = float(os.getenv("LLM_RATE_LIMIT_RPS", "0"))  # 0 = không giới hạn
+LLM_RATE_LIMIT_BURST = float(os.getenv("LLM_RATE_LIMIT_BURST", "5"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+
 # ═══════════════════════════════════════════════════════════════
 # CACHE & PERFORMANCE OPTIMIZATION
 # ═══════════════════════════════════════════════════════════════
@@ -65,6 +113,8 @@ LOCAL_MAX_NEW_TOKENS = int(os.getenv("LOCAL_MAX_NEW_TOKENS", "512"))
 CACHE_DIR = Path("./models_cache").resolve()
 CACHE_DIR.mkdir(exist_ok=True)
 
+INFERENCE_EXPORT_DIR = Path(os.getenv("INFERENCE_EXPORT_DIR", str(CACHE_DIR / "onnx")))
+
 # Set environment variables for model caching
 for env in ("TRANSFORMERS_CACHE", "HF_HOME", "HUGGINGFACE_HUB_CACHE", "SENTENCE_TRANSFORMERS_HOME"):
     os.environ[env] = str(CACHE_DIR)
@@ -78,6 +128,79 @@ TOP_K_RETRIEVE = 20      # Reduced for better precision
 TOP_K_RERANK = 12         # Optimal for context window
 SIMILARITY_THRESHOLD = 0.25  # Lowered to avoid empty results
 
+# Retrieval mode: "cascade" (lần lượt, lấy kết quả đầu tiên) hoặc "hybrid"
+# (chạy song song concept/hexagram/semantic/text rồi gộp bằng reciprocal-rank fusion)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "cascade").strip().lower()
+if RETRIEVAL_MODE not in {"cascade", "hybrid"}:
+    RETRIEVAL_MODE = "cascade"
+HYBRID_DEADLINE_MS = int(os.getenv("HYBRID_DEADLINE_MS", "2500"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Vector search backend: "atlas" ($vectorSearch) hoặc "local" (index in-process, không cần network)
+SUPPORTED_VECTOR_BACKENDS = {"atlas", "local"}
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "atlas").strip().lower()
+if VECTOR_BACKEND not in SUPPORTED_VECTOR_BACKENDS:
+    VECTOR_BACKEND = "atlas"
+LOCAL_INDEX_DIR = Path(os.getenv("LOCAL_INDEX_DIR", str(CACHE_DIR / "local_vector_index")))
+# Text search backend: "bm25" (inverted index in-process trên tokenized_text) hoặc "mongo" ($text)
+TEXT_BACKEND = os.getenv("TEXT_BACKEND", "bm25").strip().lower()
+if TEXT_BACKEND not in {"bm25", "mongo"}:
+    TEXT_BACKEND = "bm25"
+BM25_INDEX_DIR = Path(os.getenv("BM25_INDEX_DIR", str(CACHE_DIR / "bm25_index")))
+# Query cache của retrieval: LRU + TTL trên key đã chuẩn hóa, tier semantic theo cosine embedding
+QUERY_CACHE_MAXSIZE = int(os.getenv("QUERY_CACHE_MAXSIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+QUERY_CACHE_SEMANTIC = os.getenv("QUERY_CACHE_SEMANTIC", "1").strip().lower() in {"1", "true", "yes"}
+QUERY_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("QUERY_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+QUERY_CACHE_SEMANTIC_MAXSIZE = int(os.getenv("QUERY_CACHE_SEMANTIC_MAXSIZE", "256"))
+# Backend của mọi cache (retrieval + LLM): "memory" (riêng từng process) hoặc "sqlite"
+# (một file WAL dùng chung cho mọi worker trên máy, phía trước có L1 nhỏ trong process)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").strip().lower()
+if CACHE_BACKEND not in {"memory", "sqlite"}:
+    CACHE_BACKEND = "memory"
+CACHE_DB_PATH = Path(os.getenv("CACHE_DB_PATH", str(CACHE_DIR / "cache.sqlite3")))
+CACHE_L1_MAXSIZE = int(os.getenv("CACHE_L1_MAXSIZE", "256"))
+# LLM response cache: exact (hash provider/model/tham số/prompt) + semantic (embedding query trên
+# cùng tập chunk_id đã retrieve); backend riêng, mặc định sqlite để giữ câu trả lời qua restart
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1").strip().lower() in {"1", "true", "yes"}
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "sqlite").strip().lower()
+if LLM_CACHE_BACKEND not in {"memory", "sqlite"}:
+    LLM_CACHE_BACKEND = "sqlite"
+LLM_CACHE_MAXSIZE = int(os.getenv("LLM_CACHE_MAXSIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_SEMANTIC = os.getenv("LLM_CACHE_SEMANTIC", "1").strip().lower() in {"1", "true", "yes"}
+LLM_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("LLM_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+LLM_CACHE_SEMANTIC_PER_CONTEXT = int(os.getenv("LLM_CACHE_SEMANTIC_PER_CONTEXT", "8"))
+# Lịch sử hội thoại: chỉ giữ bản rút gọn mỗi lượt, giới hạn theo byte / số session (LRU) và
+# thời gian idle; SESSION_STORE_PERSIST ghi thêm vào CACHE_DB_PATH để giữ qua restart
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "10"))
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "3"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_STORE_MAX_MB = float(os.getenv("SESSION_STORE_MAX_MB", "32"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "7200"))
+SESSION_PROMPT_PREVIEW_CHARS = int(os.getenv("SESSION_PROMPT_PREVIEW_CHARS", "100"))
+SESSION_RESPONSE_PREVIEW_CHARS = int(os.getenv("SESSION_RESPONSE_PREVIEW_CHARS", "150"))
+SESSION_STORE_PERSIST = os.getenv("SESSION_STORE_PERSIST", "0").strip().lower() in {"1", "true", "yes"}
+# Corpus: "memory" (load toàn bộ chunks từ CHUNKS_DATA_DIR vào RAM) hoặc "mongo" (query collection)
+CORPUS_MODE = os.getenv("CORPUS_MODE", "memory").strip().lower()
+if CORPUS_MODE not in {"memory", "mongo"}:
+    CORPUS_MODE = "memory"
+# Lexicon concept/tên quẻ: nguồn JSON trong repo, artifact đã compile (mmap) trong cache
+LEXICON_SOURCE_DIR = Path(__file__).resolve().parent.parent
+LEXICON_DIR = Path(os.getenv("LEXICON_DIR", str(CACHE_DIR / "lexicon")))
+# Passage selection: chunk tách thành sentence window (embed một lần, artifact trong cache);
+# rerank / prompt chỉ giữ các window gần query nhất trong budget token thay vì cắt cứng theo ký tự
+PASSAGE_SELECTION = os.getenv("PASSAGE_SELECTION", "1").strip().lower() in {"1", "true", "yes"}
+PASSAGE_INDEX_DIR = Path(os.getenv("PASSAGE_INDEX_DIR", str(CACHE_DIR / "passage_index")))
+PASSAGE_WINDOW_TOKENS = int(os.getenv("PASSAGE_WINDOW_TOKENS", "60"))
+RERANK_PASSAGE_TOKENS = int(os.getenv("RERANK_PASSAGE_TOKENS", "128"))
+PROMPT_PASSAGE_TOKENS = int(os.getenv("PROMPT_PASSAGE_TOKENS", "100"))
+
+# dtype của embedding artifact (mmap): float32 nhanh nhất, float16 nhỏ bằng nửa (upcast mỗi query)
+EMBEDDING_ARTIFACT_DTYPE = os.getenv("EMBEDDING_ARTIFACT_DTYPE", "float32")
+if EMBEDDING_ARTIFACT_DTYPE not in {"float32", "float16"}:
+    EMBEDDING_ARTIFACT_DTYPE = "float32"
+
 # Vietnamese stop words for better search
 STOP_WORDS = {
     "và", "là", "của", "cho", "trong", "một", "các", "đã", "với", "không",
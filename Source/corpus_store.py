@@ -0,0 +1,116 @@
+"""
+Module corpus_store.py - Toàn bộ corpus Kinh Dịch trong RAM (CORPUS_MODE=memory)
+
+Corpus chỉ ~1.2k chunks: load một lần lúc startup từ CHUNKS_DATA_DIR (không embed,
+không tokenize), index theo hexagram / content_type / chunk_id. Đường hexagram-specific
+trở thành tra dict, không cần Mongo. Mỗi chunk là một ``ChunkRecord`` bất biến, dùng
+chung cho mọi request.
+"""
+from __future__ import annotations
+
+import logging
+import random
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from records import ChunkRecord
+
+logger = logging.getLogger(__name__)
+
+
+class CorpusStore:
+    """Records (cùng field với projection DOC_FIELDS) + các index theo field."""
+
+    def __init__(self, docs: Iterable[Dict[str, Any]]) -> None:
+        self.docs: Tuple[ChunkRecord, ...] = tuple(ChunkRecord.from_document(doc) for doc in docs)
+        self._by_id: Dict[str, int] = {}
+        self._by_hexagram: Dict[str, List[int]] = {}
+        self._by_content_type: Dict[str, List[int]] = {}
+        for row, doc in enumerate(self.docs):
+            self._by_id[doc._id] = row
+            if doc.hexagram:
+                self._by_hexagram.setdefault(doc.hexagram, []).append(row)
+            if doc.content_type:
+                self._by_content_type.setdefault(doc.content_type, []).append(row)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._by_id
+
+    @property
+    def hexagrams(self) -> List[str]:
+        return list(self._by_hexagram)
+
+    @property
+    def content_types(self) -> List[str]:
+        return list(self._by_content_type)
+
+    @classmethod
+    def from_directory(cls) -> "CorpusStore":
+        """Đọc mọi chunks.json trong CHUNKS_DATA_DIR (thứ tự giống lúc insert vào Mongo)"""
+        from data_loader import KinhDichDataLoader
+
+        return cls(KinhDichDataLoader().build_documents(with_embeddings=False, tokenize=False))
+
+    # ------------------------------------------------------------------
+    # Records bất biến: trả thẳng object dùng chung, không copy
+    def _rows(self, rows: Iterable[int], limit: Optional[int] = None) -> List[ChunkRecord]:
+        rows = list(rows)
+        if limit is not None:
+            rows = rows[:limit]
+        return [self.docs[row] for row in rows]
+
+    def get(self, chunk_id: str) -> Optional[ChunkRecord]:
+        row = self._by_id.get(chunk_id)
+        return self.docs[row] if row is not None else None
+
+    def by_ids(self, chunk_ids: Iterable[str]) -> List[ChunkRecord]:
+        """Documents theo đúng thứ tự ids, bỏ qua id không tồn tại"""
+        return self._rows(self._by_id[cid] for cid in chunk_ids if cid in self._by_id)
+
+    def by_hexagram(self, code: str, limit: Optional[int] = None) -> List[ChunkRecord]:
+        return self._rows(self._by_hexagram.get(code, ()), limit)
+
+    def by_content_type(self, content_type: str, limit: Optional[int] = None) -> List[ChunkRecord]:
+        return self._rows(self._by_content_type.get(content_type, ()), limit)
+
+    def filter(
+        self,
+        hexagram: Optional[str] = None,
+        content_type: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[ChunkRecord]:
+        rows: Iterable[int] = range(len(self.docs))
+        if hexagram is not None:
+            rows = self._by_hexagram.get(hexagram, ())
+        if content_type is not None:
+            wanted = set(self._by_content_type.get(content_type, ()))
+            rows = [row for row in rows if row in wanted]
+        return self._rows(rows, limit)
+
+    def sample(self, size: int, rng: Optional[random.Random] = None) -> List[ChunkRecord]:
+        """Tương đương $sample của Mongo"""
+        rng = rng or random
+        return self._rows(rng.sample(range(len(self.docs)), min(size, len(self.docs))))
+
+
+# Singleton helpers -------------------------------------------------------------
+
+_store: Optional[CorpusStore] = None
+_store_lock = threading.Lock()
+
+
+def get_corpus_store() -> CorpusStore:
+    """Load corpus một lần cho toàn process"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CorpusStore.from_directory()
+                logger.info(
+                    "Loaded in-memory corpus: %d chunks, %d hexagrams",
+                    len(_store), len(_store.hexagrams),
+                )
+    return _store
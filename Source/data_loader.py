@@ -3,23 +3,44 @@ import os
 from pathlib import Path
 from typing import Dict, Any, List, Tuple
 from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
 from underthesea import word_tokenize
 from tqdm import tqdm
 
 from config import (
     MONGO_URI, DB_NAME, COLLECTION,
-    EMBED_MODEL, CACHE_DIR,
-    CHUNKS_DATA_DIR, BATCH_SIZE
+    EMBED_MODEL,
+    CHUNKS_DATA_DIR, BATCH_SIZE,
+    LOCAL_INDEX_DIR, EMBEDDING_ARTIFACT_DTYPE, BM25_INDEX_DIR,
+    PASSAGE_INDEX_DIR, PASSAGE_WINDOW_TOKENS
 )
+from bm25_index import BM25Index
+from embedder import get_embedder
+from index_provisioning import provision_indexes, format_report
+from passage_index import corpus_fingerprint, load_or_build_passage_index
+from records import ChunkRecord
+from vector_index import LocalVectorIndex
 
 class KinhDichDataLoader:
     """Pipeline ETL cho dữ liệu Kinh Dịch vào MongoDB"""
 
     def __init__(self):
-        self.client = MongoClient(MONGO_URI)
-        self.collection = self.client[DB_NAME][COLLECTION]
-        self.embedder = SentenceTransformer(EMBED_MODEL, cache_folder=CACHE_DIR)
+        self._client = None
+
+    @property
+    def embedder(self):
+        """Shared embedder, chỉ load khi thực sự cần embed"""
+        return get_embedder(EMBED_MODEL)
+
+    @property
+    def client(self) -> MongoClient:
+        """Mongo client tạo lazy để pipeline offline (local index) không cần network"""
+        if self._client is None:
+            self._client = MongoClient(MONGO_URI)
+        return self._client
+
+    @property
+    def collection(self):
+        return self.client[DB_NAME][COLLECTION]
 
     def extract_text_from_chunk(self, chunk: Dict[str, Any]) -> str:
         """
@@ -62,55 +83,98 @@ class KinhDichDataLoader:
 
         return "\n\n".join(parts)
 
-    def process_chunks_file(self, file_path: Path) -> List[Dict[str, Any]]:
-        """Đọc file chunks.json, trích text, tokenize, embedding và build document dict"""
+    def process_chunks_file(
+        self, file_path: Path, with_embeddings: bool = True, tokenize: bool = True
+    ) -> List[Dict[str, Any]]:
+        """Đọc file chunks.json, trích text, tokenize, embedding và build document dict
+
+        ``tokenize=False`` (và không embed) bỏ qua word_tokenize - dùng khi chỉ cần text/metadata
+        """
         raw = json.loads(file_path.read_text(encoding='utf-8'))
         docs: List[Dict[str, Any]] = []
         for item in raw:
             text = self.extract_text_from_chunk(item)
             if not text.strip():
                 continue
-            # Tokenize
-            tokenized = word_tokenize(text, format="text")
-            # Embed
-            emb = self.embedder.encode([tokenized])[0].tolist()
+            # Tokenize (embedding cần tokenized_text)
+            tokenized = word_tokenize(text, format="text") if tokenize or with_embeddings else None
             docs.append({
                 "_id": item["chunk_id"],
                 "text": text,
                 "tokenized_text": tokenized,
-                "embedding": emb,
                 "hexagram": item.get("hexagram"),
                 "que": item.get("que"),
                 "content_type": item.get("content_type"),
                 "original_chunk": item
             })
-        return docs
 
-    def load_all_data(self) -> None:
-        """Load toàn bộ dữ liệu từ directory vào MongoDB và in danh sách quẻ đã xử lý cùng mã tương ứng"""
-        # Drop old collection
-        self.collection.drop()
+        if not with_embeddings or not docs:
+            return docs
 
-        # Read and process all chunk files
+        # Embed cả file trong một lần encode (batch) thay vì từng chunk
+        embeddings = self.embedder.encode([doc["tokenized_text"] for doc in docs])
+        for doc, emb in zip(docs, embeddings):
+            doc["embedding"] = emb.tolist()
+        return docs
+
+    def build_documents(self, with_embeddings: bool = True, tokenize: bool = True) -> List[Dict[str, Any]]:
+        """Đọc và xử lý toàn bộ file chunks trong CHUNKS_DATA_DIR (không cần Mongo)"""
         all_docs: List[Dict[str, Any]] = []
         for root, _, files in os.walk(CHUNKS_DATA_DIR):
-            for fname in files:
+            for fname in sorted(files):
                 if fname.endswith('.json') and 'chunks' in fname:
                     fp = Path(root) / fname
-                    all_docs.extend(self.process_chunks_file(fp))
+                    all_docs.extend(self.process_chunks_file(fp, with_embeddings, tokenize))
 
         # Deduplicate by _id to avoid duplicate key errors
         unique_docs = {doc["_id"]: doc for doc in all_docs}.values()
-        docs_list = list(unique_docs)
+        return list(unique_docs)
+
+    def export_embedding_artifact(self, docs_list: List[Dict[str, Any]], path: Path = LOCAL_INDEX_DIR) -> None:
+        """Ghi embeddings ra artifact nhị phân (mmap được) + bảng id/offset cho local index"""
+        index = LocalVectorIndex.from_documents(docs_list, EMBED_MODEL)
+        index.save(path, EMBEDDING_ARTIFACT_DTYPE)
+        print(f"Đã ghi embedding artifact ({len(index)} x {index.dimension}, "
+              f"{EMBEDDING_ARTIFACT_DTYPE}) vào {path}")
+
+    def export_bm25_index(self, docs_list: List[Dict[str, Any]], path: Path = BM25_INDEX_DIR) -> None:
+        """Build BM25 inverted index từ tokenized_text và serialize ra disk"""
+        index = BM25Index.build(
+            [doc["_id"] for doc in docs_list],
+            [doc["tokenized_text"] for doc in docs_list],
+            fingerprint=corpus_fingerprint([ChunkRecord.from_document(doc) for doc in docs_list]),
+        )
+        index.save(path)
+        print(f"Đã ghi BM25 index ({len(index)} docs, {len(index.terms)} terms) vào {path}")
+
+    def export_passage_index(self, docs_list: List[Dict[str, Any]], path: Path = PASSAGE_INDEX_DIR) -> None:
+        """Tách chunk thành sentence window + embed một lần (bỏ qua nếu artifact còn khớp corpus)"""
+        records = [ChunkRecord.from_document(doc) for doc in docs_list]
+        index = load_or_build_passage_index(path, records, EMBED_MODEL, PASSAGE_WINDOW_TOKENS)
+        print(f"Passage index: {len(index)} windows cho {len(records)} chunks tại {path}")
+
+    def load_all_data(self) -> None:
+        """Load toàn bộ dữ liệu từ directory vào MongoDB và in danh sách quẻ đã xử lý cùng mã tương ứng"""
+        # Drop old collection
+        self.collection.drop()
+
+        # Read and process all chunk files
+        docs_list = self.build_documents()
 
         # Insert in batches
         for i in tqdm(range(0, len(docs_list), BATCH_SIZE), desc="Inserting docs"):
             batch = docs_list[i : i + BATCH_SIZE]
             self.collection.insert_many(batch)
 
-        # Create indexes
-        self.collection.create_index("hexagram")
-        self.collection.create_index("content_type")
+        # Create indexes (text, hexagram, content_type, vector) và báo drift
+        reports = provision_indexes(self.collection)
+        print("Index provisioning:")
+        print(format_report(reports))
+
+        # Binary artifact cho local vector index (cold start không cần decode BSON)
+        self.export_embedding_artifact(docs_list)
+        self.export_bm25_index(docs_list)
+        self.export_passage_index(docs_list)
 
         # Print processed que - hexagram pairs
         processed_pairs: List[Tuple[str, str]] = sorted({
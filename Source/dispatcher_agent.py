@@ -1,17 +1,28 @@
 # dispatcher_agent.py - Query classification và workflow routing
+import asyncio
+import hashlib
+import json
+import logging
 import re
-from typing import Dict, List
-from sentence_transformers import SentenceTransformer
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
 import numpy as np
 
 from base_agent import BaseAgent, AgentType, ProcessingState
+from config import CACHE_DIR, EMBED_MODEL
+from embedder import get_embedder
+
+logger = logging.getLogger(__name__)
+
+CENTROID_DIR = CACHE_DIR / "dispatcher_centroids"
 
 class DispatcherAgent(BaseAgent):
     """Agent phân loại query và điều phối workflow"""
     
     def __init__(self):
         super().__init__("DispatcherAgent", AgentType.DISPATCHER)
-        self.classifier_model = SentenceTransformer('keepitreal/vietnamese-sbert')
+        self.classifier_model = get_embedder(EMBED_MODEL)
         
         # Query type templates cho classification
         self.query_templates = {
@@ -30,7 +41,18 @@ class DispatcherAgent(BaseAgent):
                 "kinh dịch", "dịch học", "văn hóa đông phương"
             ]
         }
+
+        # Category centroids (normalized, shape [n_categories, dim]) - build lazily
+        self._centroid_categories: List[str] = [
+            category for category in self.query_templates if category != "hexagram_specific"
+        ]
+        self._centroids: Optional[np.ndarray] = None
+        self._centroid_lock = threading.Lock()
     
+    async def warm_up(self) -> None:
+        """Chạy một lượt encode để model sẵn sàng trước request đầu tiên"""
+        await asyncio.to_thread(self._ensure_centroids)
+
     async def process(self, state: ProcessingState) -> ProcessingState:
         """Classify query và set strategy"""
         
@@ -78,27 +100,61 @@ class DispatcherAgent(BaseAgent):
     async def _embedding_classification(self, query: str) -> str:
         """Embedding-based classification cho ambiguous cases"""
         
-        # Create template embeddings
-        template_embeddings = {}
-        for category, templates in self.query_templates.items():
-            if category != "hexagram_specific":
-                combined_template = " ".join(templates)
-                template_embeddings[category] = self.classifier_model.encode([combined_template])[0]
+        centroids = self._centroids
+        if centroids is None:
+            centroids = await asyncio.to_thread(self._ensure_centroids)
         
-        # Get query embedding
-        query_embedding = self.classifier_model.encode([query])[0]
+        # Một lần encode query + một phép nhân matrix-vector (cosine vì đã normalize)
+        query_embedding = await self.classifier_model.aencode(query, normalize=True)
+        similarities = centroids @ query_embedding
         
-        # Find best match
-        best_category = "general"
-        best_similarity = 0.0
+        best_index = int(np.argmax(similarities))
+        best_similarity = float(similarities[best_index])
         
-        for category, template_emb in template_embeddings.items():
-            similarity = np.dot(query_embedding, template_emb) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(template_emb)
-            )
-            
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_category = category
+        return self._centroid_categories[best_index] if best_similarity > 0.3 else "general"
+
+    # ------------------------------------------------------------------
+    # Category centroids -------------------------------------------------
+    def _centroid_path(self) -> Path:
+        """File cache keyed theo model name + hash của templates"""
+        payload = json.dumps(
+            {c: self.query_templates[c] for c in self._centroid_categories},
+            ensure_ascii=False, sort_keys=True
+        )
+        digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+        model_slug = re.sub(r"[^\w.-]+", "_", self.classifier_model.model_name)
+        return CENTROID_DIR / f"{model_slug}-{digest}.npy"
+
+    def _ensure_centroids(self) -> np.ndarray:
+        """Load centroids từ disk hoặc encode templates một lần rồi persist"""
+        if self._centroids is not None:
+            return self._centroids
         
-        return best_category if best_similarity > 0.3 else "general"
+        with self._centroid_lock:
+            if self._centroids is not None:
+                return self._centroids
+            
+            path = self._centroid_path()
+            centroids = None
+            if path.exists():
+                try:
+                    centroids = np.load(path)
+                    if centroids.shape[0] != len(self._centroid_categories):
+                        centroids = None
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Failed to load centroids {path}: {e}")
+                    centroids = None
+            
+            if centroids is None:
+                combined_templates = [
+                    " ".join(self.query_templates[c]) for c in self._centroid_categories
+                ]
+                centroids = self.classifier_model.encode(combined_templates, normalize=True)
+                try:
+                    CENTROID_DIR.mkdir(parents=True, exist_ok=True)
+                    np.save(path, centroids)
+                except OSError as e:
+                    logger.warning(f"Failed to persist centroids {path}: {e}")
+            
+            self._centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+            return self._centroids
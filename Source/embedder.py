@@ -0,0 +1,81 @@
+"""
+Module embedder.py - Embedding model dùng chung cho toàn process
+
+Dispatcher, Retrieval và DataLoader cùng dùng một bản weights duy nhất cho mỗi
+model; các lời gọi encode đồng thời được gom batch qua ``MicroBatcher``.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Dict, List, Union
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from batching import MicroBatcher
+from config import EMBED_BATCH_SIZE, EMBED_MAX_WAIT_MS, EMBED_MODEL
+from inference_backend import load_embedding_model
+
+
+class SharedEmbedder:
+    """Thread-safe wrapper quanh SentenceTransformer với micro-batching."""
+
+    def __init__(self, model_name: str = EMBED_MODEL) -> None:
+        self.model_name = model_name
+        self.model: SentenceTransformer = load_embedding_model(model_name)  # theo INFERENCE_BACKEND
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self._batcher = MicroBatcher(
+            self._encode_batch,
+            max_batch_size=EMBED_BATCH_SIZE,
+            max_wait_ms=EMBED_MAX_WAIT_MS,
+            name=f"embedder:{model_name}",
+        )
+
+    def _encode_batch(self, texts: List[str]) -> List[np.ndarray]:
+        vectors = self.model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
+        return list(np.asarray(vectors, dtype=np.float32))
+
+    @staticmethod
+    def _stack(texts: Union[str, List[str]], rows: List[np.ndarray], normalize: bool) -> np.ndarray:
+        matrix = np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+        if normalize and matrix.size:
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.maximum(norms, 1e-12)
+        return matrix[0] if isinstance(texts, str) else matrix
+
+    def encode(self, texts: Union[str, List[str]], normalize: bool = False) -> np.ndarray:
+        """Giống ``SentenceTransformer.encode``: str → 1-D, list → 2-D (float32)"""
+        items = [texts] if isinstance(texts, str) else list(texts)
+        return self._stack(texts, self._batcher.run(items), normalize)
+
+    async def aencode(self, texts: Union[str, List[str]], normalize: bool = False) -> np.ndarray:
+        """Bản async: chờ batch mà không block event loop"""
+        items = [texts] if isinstance(texts, str) else list(texts)
+        rows = await asyncio.wrap_future(self._batcher.submit(items))
+        return self._stack(texts, rows, normalize)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return dict(self._batcher.stats)
+
+    def close(self) -> None:
+        self._batcher.close()
+
+
+# Singleton helpers -------------------------------------------------------------
+
+_embedders: Dict[str, SharedEmbedder] = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(model_name: str = EMBED_MODEL) -> SharedEmbedder:
+    """Một instance (một bản weights) cho mỗi model name trong process"""
+    embedder = _embedders.get(model_name)
+    if embedder is None:
+        with _embedders_lock:
+            embedder = _embedders.get(model_name)
+            if embedder is None:
+                embedder = SharedEmbedder(model_name)
+                _embedders[model_name] = embedder
+    return embedder
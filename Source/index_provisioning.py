@@ -0,0 +1,133 @@
+"""
+Module index_provisioning.py - Tạo và kiểm tra index MongoDB một lần (startup / setup.py)
+
+Query trên hot path không bao giờ phải chạy DDL: text, hexagram, content_type và
+Atlas vector index được đảm bảo ở đây, definition lệch so với mong đợi được báo là drift.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+from pymongo import errors as mongo_errors
+from pymongo.operations import SearchIndexModel
+
+from config import VECTOR_DIMENSIONS
+
+logger = logging.getLogger(__name__)
+
+# name → key spec (tên trùng với tên mặc định Mongo tự đặt)
+REGULAR_INDEXES: Dict[str, List[tuple]] = {
+    "text_text": [("text", "text")],
+    "hexagram_1": [("hexagram", 1)],
+    "content_type_1": [("content_type", 1)],
+}
+
+VECTOR_INDEX_NAME = "vector_index"
+VECTOR_INDEX_DEFINITION: Dict[str, Any] = {
+    "fields": [
+        {
+            "type": "vector",
+            "path": "embedding",
+            "numDimensions": VECTOR_DIMENSIONS,
+            "similarity": "cosine",
+        }
+    ]
+}
+
+
+@dataclass
+class IndexReport:
+    name: str
+    status: str  # ok | created | missing | drift | skipped | error
+    detail: str = ""
+
+
+def _text_fields(keys: List[tuple]) -> List[str]:
+    return sorted(field for field, kind in keys if kind == "text")
+
+
+def _check_regular(collection, name: str, keys: List[tuple], info: Dict[str, Any], create: bool) -> IndexReport:
+    existing = info.get(name)
+    if existing is None:
+        if not create:
+            return IndexReport(name, "missing")
+        collection.create_index(keys, name=name)
+        return IndexReport(name, "created")
+
+    text_fields = _text_fields(keys)
+    if text_fields:
+        # Text index lưu key dạng _fts/_ftsx, field thật nằm trong weights
+        actual = sorted(existing.get("weights", {}))
+        if actual != text_fields:
+            return IndexReport(name, "drift", f"text fields {actual} != {text_fields}")
+    else:
+        # So sánh nguyên giá trị: direction có thể là 1 / 1.0 / -1 hoặc "2dsphere", "hashed", ...
+        actual_keys = [(field, direction) for field, direction in existing.get("key", [])]
+        if actual_keys != [(field, direction) for field, direction in keys]:
+            return IndexReport(name, "drift", f"key {actual_keys} != {keys}")
+    return IndexReport(name, "ok")
+
+
+def _check_vector(collection, create: bool) -> IndexReport:
+    try:
+        found = list(collection.list_search_indexes(VECTOR_INDEX_NAME))
+    except mongo_errors.OperationFailure as exc:
+        # Không phải Atlas (hoặc tier không hỗ trợ search index)
+        return IndexReport(VECTOR_INDEX_NAME, "skipped", f"search indexes unavailable: {exc}")
+
+    if not found:
+        if not create:
+            return IndexReport(VECTOR_INDEX_NAME, "missing")
+        collection.create_search_index(SearchIndexModel(
+            definition=VECTOR_INDEX_DEFINITION, name=VECTOR_INDEX_NAME, type="vectorSearch"
+        ))
+        return IndexReport(VECTOR_INDEX_NAME, "created", "building - chờ status READY")
+
+    index = found[0]
+    definition = index.get("latestDefinition", {})
+    vector_fields = [f for f in definition.get("fields", []) if f.get("type") == "vector"]
+    expected = VECTOR_INDEX_DEFINITION["fields"][0]
+    for field in vector_fields:
+        if field.get("path") == expected["path"]:
+            diffs = {
+                key: (field.get(key), value) for key, value in expected.items() if field.get(key) != value
+            }
+            if diffs:
+                return IndexReport(VECTOR_INDEX_NAME, "drift", f"(actual, expected): {diffs}")
+            status = index.get("status", "UNKNOWN")
+            return IndexReport(VECTOR_INDEX_NAME, "ok", "" if status == "READY" else f"status {status}")
+    return IndexReport(VECTOR_INDEX_NAME, "drift", f"không có vector field path '{expected['path']}'")
+
+
+def provision_indexes(collection, create: bool = True, include_vector: bool = True) -> List[IndexReport]:
+    """Đảm bảo các index tồn tại (``create=False`` chỉ kiểm tra) và trả về báo cáo drift"""
+    reports: List[IndexReport] = []
+    try:
+        info = collection.index_information()
+    except mongo_errors.PyMongoError as exc:
+        return [IndexReport("*", "error", str(exc))]
+
+    for name, keys in REGULAR_INDEXES.items():
+        try:
+            reports.append(_check_regular(collection, name, keys, info, create))
+        except mongo_errors.PyMongoError as exc:
+            reports.append(IndexReport(name, "error", str(exc)))
+
+    if include_vector:
+        try:
+            reports.append(_check_vector(collection, create))
+        except mongo_errors.PyMongoError as exc:
+            reports.append(IndexReport(VECTOR_INDEX_NAME, "error", str(exc)))
+
+    for report in reports:
+        level = logging.WARNING if report.status in ("drift", "missing", "error") else logging.INFO
+        logger.log(level, "index %s: %s %s", report.name, report.status, report.detail)
+    return reports
+
+
+def format_report(reports: List[IndexReport]) -> str:
+    return "\n".join(
+        f"  - {r.name}: {r.status}" + (f" ({r.detail})" if r.detail else "") for r in reports
+    )
@@ -0,0 +1,81 @@
+"""
+Module inference_backend.py - Nạp embedding model / cross-encoder theo INFERENCE_BACKEND
+
+- "torch": PyTorch fp32 (mặc định, như trước).
+- "int8" : dynamic quantization int8 cho mọi nn.Linear (torch, CPU) - không cần thêm package.
+- "onnx" : ONNX Runtime qua ``backend="onnx"`` của sentence-transformers (cần
+  ``optimum[onnxruntime]``); model export một lần rồi lưu vào INFERENCE_EXPORT_DIR.
+
+Backend không dùng được (thiếu package, model không export được) thì log và quay về torch.
+Kiểm tra thứ hạng so với fp32 bằng ``python Source/check_inference_parity.py``.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from pathlib import Path
+from typing import Any, Callable
+
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from config import CACHE_DIR, INFERENCE_BACKEND, INFERENCE_EXPORT_DIR
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_INFERENCE_BACKENDS = ("torch", "int8", "onnx")
+
+
+def _export_path(model_name: str) -> Path:
+    return Path(INFERENCE_EXPORT_DIR) / re.sub(r"[^\w.-]+", "__", model_name)
+
+
+def _quantize_int8(module: Any) -> Any:
+    """Dynamic int8 (weights int8, activation quantize lúc chạy) cho các lớp Linear, tại chỗ"""
+    import torch
+
+    torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return module
+
+
+def _load(cls: Callable[..., Any], model_name: str, backend: str) -> Any:
+    if backend == "int8":
+        model = cls(model_name, cache_folder=str(CACHE_DIR), device="cpu")
+        # CrossEncoder giữ HF model ở ``.model``; SentenceTransformer chính là nn.Module
+        _quantize_int8(model.model if isinstance(model, CrossEncoder) else model)
+        return model
+
+    if backend == "onnx":
+        path = _export_path(model_name)
+        if path.exists():
+            return cls(str(path), backend="onnx", device="cpu")
+        model = cls(model_name, cache_folder=str(CACHE_DIR), backend="onnx", device="cpu")
+        try:
+            model.save_pretrained(str(path))
+        except OSError as exc:
+            logger.warning("Failed to persist ONNX export of %s: %s", model_name, exc)
+        return model
+
+    return cls(model_name, cache_folder=str(CACHE_DIR))
+
+
+def _load_with_fallback(cls: Callable[..., Any], model_name: str, backend: str, fallback: bool) -> Any:
+    backend = backend if backend in SUPPORTED_INFERENCE_BACKENDS else "torch"
+    if backend != "torch":
+        try:
+            model = _load(cls, model_name, backend)
+            logger.info("Loaded %s (%s) with %s backend", model_name, cls.__name__, backend)
+            return model
+        except Exception as exc:  # thiếu optimum/onnxruntime, model không export được, ...
+            if not fallback:
+                raise
+            logger.warning("%s backend unavailable for %s, using torch: %s", backend, model_name, exc)
+    return _load(cls, model_name, "torch")
+
+
+def load_embedding_model(model_name: str, backend: str = INFERENCE_BACKEND, fallback: bool = True) -> SentenceTransformer:
+    """``fallback=False``: raise thay vì quay về torch (dùng khi kiểm tra parity)"""
+    return _load_with_fallback(SentenceTransformer, model_name, backend, fallback)
+
+
+def load_cross_encoder(model_name: str, backend: str = INFERENCE_BACKEND, fallback: bool = True) -> CrossEncoder:
+    return _load_with_fallback(CrossEncoder, model_name, backend, fallback)
@@ -0,0 +1,250 @@
+"""
+Module lexicon.py - Lexicon concept / tên quẻ: build một lần, load bằng mmap
+
+Gộp các nguồn keyword → mã quẻ về một artifact đã compile:
+  - JSON_FILE/retrieval_agent.concepts.json   (profile "concepts")
+  - mapping.HEXAGRAM_MAP                      (profile "hexagrams")
+  - require_json/hexagram_keywords.json       (profile "hexagrams", bổ sung alias)
+
+Keyword được chuẩn hóa bằng ``text_utils.normalize_text``; mã quẻ kiểu cũ
+(QUE_TUAN, QUE_XU, ...) quy về mã chuẩn của ``mapping.HEXAGRAM_LOOKUP`` qua số thứ tự quẻ.
+
+Artifact trong LEXICON_DIR:
+  - lexicon.json : version, fingerprint nguồn, bảng mã quẻ, keywords/priority/source mỗi profile
+  - lexicon.bin  : bảng automaton int32 của mọi profile nối liền, đọc bằng mmap
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sys
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import LEXICON_DIR, LEXICON_SOURCE_DIR
+from matcher import KeywordMatcher, NGramIndex
+from text_utils import normalize_text
+
+logger = logging.getLogger(__name__)
+
+LEXICON_VERSION = 1
+
+CONCEPTS_FILE = LEXICON_SOURCE_DIR / "JSON_FILE" / "retrieval_agent.concepts.json"
+HEXAGRAM_KEYWORDS_FILE = LEXICON_SOURCE_DIR / "require_json" / "hexagram_keywords.json"
+HEXAGRAM_LOOKUP_FILE = LEXICON_SOURCE_DIR / "require_json" / "hexagram_lookup.json"
+
+# (keyword đã chuẩn hóa, mã quẻ, priority, nguồn)
+Entry = Tuple[str, str, int, str]
+
+
+def _read_json(path: Path):
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def _code_aliases() -> Dict[str, str]:
+    """Mã quẻ trong require_json (đánh số theo hexagram_lookup.json) → mã chuẩn của mapping"""
+    from mapping import HEXAGRAM_LOOKUP
+
+    canonical = {number: code for number, code in HEXAGRAM_LOOKUP.values()}
+    aliases: Dict[str, str] = {}
+    for item in _read_json(HEXAGRAM_LOOKUP_FILE):
+        # Mã cũ bị trùng số (QUE_TI, QUE_LY) lấy quẻ xuất hiện trước
+        aliases.setdefault(item["code"], canonical.get(item["number"], item["code"]))
+    return aliases
+
+
+def _source_entries() -> Dict[str, List[Entry]]:
+    from mapping import HEXAGRAM_MAP
+
+    aliases = _code_aliases()
+
+    concepts: List[Entry] = []
+    for i, (keyword, code) in enumerate(_read_json(CONCEPTS_FILE).items()):
+        concepts.append((normalize_text(keyword), aliases.get(code, code), i, "concepts"))
+
+    # Tên quẻ: ưu tiên theo thứ tự quẻ trong HEXAGRAM_MAP như detect_hexagram
+    code_rank = {code: rank for rank, code in enumerate(HEXAGRAM_MAP)}
+    hexagrams: List[Entry] = []
+    for code, keywords in HEXAGRAM_MAP.items():
+        for keyword in sorted(keywords, key=len, reverse=True):
+            hexagrams.append((normalize_text(keyword), code, code_rank[code], "hexagram_map"))
+    for old_code, keywords in _read_json(HEXAGRAM_KEYWORDS_FILE).items():
+        code = aliases.get(old_code, old_code)
+        rank = code_rank.get(code, len(code_rank))
+        for keyword in keywords:
+            hexagrams.append((normalize_text(keyword), code, rank, "hexagram_keywords"))
+
+    return {"concepts": concepts, "hexagrams": hexagrams}
+
+
+def source_fingerprint() -> str:
+    """Hash của version + mọi nguồn: artifact lệch fingerprint sẽ được build lại"""
+    from mapping import HEXAGRAM_MAP
+
+    digest = hashlib.sha1(f"lexicon-v{LEXICON_VERSION}".encode())
+    for path in (CONCEPTS_FILE, HEXAGRAM_KEYWORDS_FILE, HEXAGRAM_LOOKUP_FILE):
+        digest.update(Path(path).read_bytes())
+    digest.update(json.dumps(HEXAGRAM_MAP, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Lexicon:
+    """Các matcher đã compile theo profile, kèm nguồn gốc của từng keyword."""
+
+    def __init__(
+        self,
+        matchers: Dict[str, KeywordMatcher],
+        sources: Dict[str, List[str]],
+        fingerprint: str = "",
+        buffer: Optional[mmap.mmap] = None,
+    ) -> None:
+        self.matchers = matchers
+        self.sources = sources
+        self.fingerprint = fingerprint
+        self._buffer = buffer  # giữ mmap sống khi bảng là memoryview trên nó
+        self._fuzzy: Dict[str, NGramIndex] = {}
+
+    @property
+    def profiles(self) -> List[str]:
+        return list(self.matchers)
+
+    def matcher(self, profile: str) -> KeywordMatcher:
+        return self.matchers[profile]
+
+    def fuzzy_index(self, profile: str) -> NGramIndex:
+        index = self._fuzzy.get(profile)
+        if index is None:
+            index = self._fuzzy[profile] = NGramIndex(self.matchers[profile].keywords)
+        return index
+
+    def mapping(self, profile: str) -> Dict[str, str]:
+        """keyword (đã chuẩn hóa) → mã quẻ"""
+        matcher = self.matchers[profile]
+        return dict(zip(matcher.keywords, matcher.values))
+
+    # ------------------------------------------------------------------
+    @classmethod
+    def build(cls) -> "Lexicon":
+        matchers: Dict[str, KeywordMatcher] = {}
+        sources: Dict[str, List[str]] = {}
+        for profile, entries in _source_entries().items():
+            seen = set()
+            unique = []
+            for entry in entries:
+                if entry[0] and entry[0] not in seen:
+                    seen.add(entry[0])
+                    unique.append(entry)
+            matchers[profile] = KeywordMatcher(
+                [(keyword, code) for keyword, code, _, _ in unique],
+                priorities=[priority for _, _, priority, _ in unique],
+            )
+            sources[profile] = [source for _, _, _, source in unique]
+        return cls(matchers, sources, source_fingerprint())
+
+    def save(self, path: Path = LEXICON_DIR) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        code_ids: Dict[str, int] = {}
+        blob = array("i")
+        meta = {
+            "version": LEXICON_VERSION,
+            "fingerprint": self.fingerprint,
+            "byteorder": sys.byteorder,
+            "profiles": {},
+        }
+        for profile, matcher in self.matchers.items():
+            tables = {}
+            for name, table in matcher.tables().items():
+                tables[name] = [len(blob), len(table)]
+                blob.extend(table)
+            meta["profiles"][profile] = {
+                "keywords": matcher.keywords,
+                "code_ids": [code_ids.setdefault(code, len(code_ids)) for code in matcher.values],
+                "priorities": matcher.priorities,
+                "sources": self.sources[profile],
+                "tables": tables,
+            }
+        meta["codes"] = list(code_ids)
+
+        tmp = path / "lexicon.bin.tmp"
+        with open(tmp, "wb") as fh:
+            blob.tofile(fh)
+        os.replace(tmp, path / "lexicon.bin")
+        # lexicon.json ghi sau cùng: có json nghĩa là bin đã đầy đủ
+        tmp_meta = path / "lexicon.json.tmp"
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_meta, path / "lexicon.json")
+
+    @classmethod
+    def load(cls, path: Path = LEXICON_DIR) -> "Lexicon":
+        """Bảng automaton là memoryview int32 trên mmap read-only - không parse, không build lại trie"""
+        path = Path(path)
+        meta = json.loads((path / "lexicon.json").read_text(encoding="utf-8"))
+        if meta.get("version") != LEXICON_VERSION or meta.get("byteorder") != sys.byteorder:
+            raise ValueError(f"Lexicon artifact {path} không tương thích (version/byteorder)")
+
+        with open(path / "lexicon.bin", "rb") as fh:
+            buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        ints = memoryview(buffer).cast("i")
+
+        codes = meta["codes"]
+        matchers: Dict[str, KeywordMatcher] = {}
+        sources: Dict[str, List[str]] = {}
+        for profile, spec in meta["profiles"].items():
+            tables = {name: ints[start:start + length] for name, (start, length) in spec["tables"].items()}
+            matchers[profile] = KeywordMatcher.from_tables(
+                spec["keywords"], [codes[i] for i in spec["code_ids"]], spec["priorities"], tables
+            )
+            sources[profile] = spec["sources"]
+        return cls(matchers, sources, meta.get("fingerprint", ""), buffer)
+
+
+def load_or_build_lexicon(path: Path = LEXICON_DIR) -> Lexicon:
+    """Load artifact nếu khớp fingerprint nguồn; ngược lại build và ghi lại"""
+    path = Path(path)
+    fingerprint = source_fingerprint()
+    if (path / "lexicon.json").exists():
+        try:
+            lexicon = Lexicon.load(path)
+            if lexicon.fingerprint == fingerprint:
+                return lexicon
+            logger.info("Lexicon sources changed, rebuilding %s", path)
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Failed to load lexicon %s: %s", path, exc)
+
+    lexicon = Lexicon.build()
+    try:
+        lexicon.save(path)
+    except OSError as exc:
+        logger.warning("Failed to persist lexicon %s: %s", path, exc)
+    return lexicon
+
+
+# Singleton helpers -------------------------------------------------------------
+
+_lexicon: Optional[Lexicon] = None
+_lexicon_lock = threading.Lock()
+
+
+def get_lexicon() -> Lexicon:
+    """Một lexicon (một mmap) cho mọi detector trong process"""
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                _lexicon = load_or_build_lexicon()
+    return _lexicon
+
+
+if __name__ == "__main__":
+    built = Lexicon.build()
+    built.save(LEXICON_DIR)
+    for name, compiled in built.matchers.items():
+        print(f"- {name}: {len(compiled)} keywords, {compiled.state_count} states")
+    print(f"Đã ghi lexicon vào {LEXICON_DIR}")
@@ -4,9 +4,13 @@ Module cấu hình LLM linh hoạt cho chatbot Kinh Dịch.
 Hỗ trợ Gemini, OpenAI và mô hình cục bộ (Transformers).
 """
 
+import asyncio
 import logging
+import random
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from concurrent.futures import Executor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
 
 from config import (
     LLM_PROVIDER,
@@ -23,7 +27,14 @@ from config import (
     LOCAL_MODEL_TYPE,
     LOCAL_DEVICE,
     LOCAL_MAX_NEW_TOKENS,
+    FAKE_LLM_LATENCY_MS,
+    FAKE_LLM_TOKEN_DELAY_MS,
+    FAKE_LLM_FAILURE_RATE,
+    LLM_CACHE_ENABLED,
+    SESSION_HISTORY_TURNS,
 )
+from response_cache import ResponseCache
+from session_store import SessionStore
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -48,26 +59,86 @@ except ImportError:  # pragma: no cover - optional dependency
     OPENAI_AVAILABLE = False
 
 try:
-    from transformers import pipeline  # type: ignore
+    from transformers import TextIteratorStreamer, pipeline  # type: ignore
     import torch  # type: ignore
 
     HF_AVAILABLE = True
 except ImportError:  # pragma: no cover - optional dependency
-    pipeline = None  # type: ignore
+    pipeline = TextIteratorStreamer = None  # type: ignore
     torch = None  # type: ignore
     HF_AVAILABLE = False
 
 
+def iterate_in_thread(
+    make_iterator: Callable[[], Iterator[str]], executor: Optional[Executor] = None
+) -> AsyncIterator[str]:
+    """Chạy iterator blocking (SDK streaming đồng bộ) trong worker thread, đưa từng phần
+    sang event loop; consumer dừng sớm thì worker dừng ở phần kế tiếp.
+
+    Worker được submit ngay khi gọi, trên ``executor`` (mặc định executor của loop).
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def worker() -> None:
+        try:
+            for item in make_iterator():
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except BaseException as exc:  # chuyển lỗi sang phía async
+            loop.call_soon_threadsafe(queue.put_nowait, exc)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    worker_future = loop.run_in_executor(executor, worker)
+    return _drain_queue(queue, stop, done, worker_future)
+
+
+async def _drain_queue(
+    queue: asyncio.Queue, stop: threading.Event, done: object, worker_future: "asyncio.Future[Any]"
+) -> AsyncIterator[str]:
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+    await worker_future
+
+
 # Backends ----------------------------------------------------------------------
 
 class BaseBackend:
-    """Abstract backend interface."""
+    """Abstract backend interface.
+
+    ``stream`` (đồng bộ) mặc định trả cả câu trả lời một lần; ``astream`` mặc định chạy
+    ``stream`` trong worker thread (trên ``executor`` nếu có). Backend có SDK async thì
+    override ``astream`` và chỉ dùng ``executor`` cho nhánh chạy thread.
+    """
 
     provider_name = "base"
 
     def generate(self, prompt: str) -> str:  # pragma: no cover - interface
         raise NotImplementedError
 
+    def stream(self, prompt: str) -> Iterator[str]:
+        yield self.generate(prompt)
+
+    async def astream(self, prompt: str, executor: Optional[Executor] = None) -> AsyncIterator[str]:
+        async for chunk in iterate_in_thread(lambda: self.stream(prompt), executor):
+            yield chunk
+
+    def settings(self) -> Dict[str, Any]:
+        """Provider/model/tham số generation: một phần key của response cache"""
+        return {"provider": self.provider_name}
+
     def test_connection(self) -> None:
         """Default connectivity test."""
         self.generate("Test connection")
@@ -100,18 +171,46 @@ class GeminiBackend(BaseBackend):
                 HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
             }
 
+        self.generation_config = generation_config
         self.model = genai.GenerativeModel(
             model_name=GEMINI_MODEL,
             generation_config=generation_config,
             safety_settings=safety_settings or None,
         )
 
+    def settings(self) -> Dict[str, Any]:
+        return {"provider": self.provider_name, "model": GEMINI_MODEL, **self.generation_config}
+
     def generate(self, prompt: str) -> str:
         response = self.model.generate_content(prompt)
         if getattr(response, "text", None):
             return response.text.strip()
         raise RuntimeError("Gemini trả về phản hồi rỗng.")
 
+    @staticmethod
+    def _chunk_text(chunk: Any) -> str:
+        try:
+            return chunk.text or ""
+        except ValueError:  # chunk không có text (bị chặn bởi safety, chỉ có metadata)
+            return ""
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.model.generate_content(prompt, stream=True):
+            text = self._chunk_text(chunk)
+            if text:
+                yield text
+
+    async def astream(self, prompt: str, executor: Optional[Executor] = None) -> AsyncIterator[str]:
+        if not hasattr(self.model, "generate_content_async"):
+            async for text in super().astream(prompt, executor):
+                yield text
+            return
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            text = self._chunk_text(chunk)
+            if text:
+                yield text
+
 
 class OpenAIBackend(BaseBackend):
     provider_name = "openai"
@@ -129,6 +228,7 @@ class OpenAIBackend(BaseBackend):
             if OPENAI_API_BASE:
                 kwargs["base_url"] = OPENAI_API_BASE
             self.client = openai.OpenAI(**kwargs)
+            self.async_client = openai.AsyncOpenAI(**kwargs)
             self._client_mode = "client"
         else:
             openai.api_key = OPENAI_API_KEY  # type: ignore[attr-defined]
@@ -162,6 +262,47 @@ class OpenAIBackend(BaseBackend):
             raise RuntimeError("OpenAI trả về phản hồi rỗng.")
         return content.strip()
 
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider_name,
+            "model": self.model,
+            "base_url": OPENAI_API_BASE,
+            "temperature": LLM_TEMPERATURE,
+            "max_tokens": LLM_MAX_OUTPUT_TOKENS,
+            "top_p": LLM_TOP_P,
+        }
+
+    def _request(self, prompt: str) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": LLM_TEMPERATURE,
+            "max_tokens": LLM_MAX_OUTPUT_TOKENS,
+            "top_p": LLM_TOP_P,
+            "stream": True,
+        }
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        if self._client_mode == "client":
+            for chunk in self.client.chat.completions.create(**self._request(prompt)):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        else:
+            for chunk in self.client.ChatCompletion.create(**self._request(prompt)):  # type: ignore[attr-defined]
+                content = chunk["choices"][0].get("delta", {}).get("content")
+                if content:
+                    yield content
+
+    async def astream(self, prompt: str, executor: Optional[Executor] = None) -> AsyncIterator[str]:
+        if self._client_mode != "client":
+            async for text in super().astream(prompt, executor):
+                yield text
+            return
+        response = await self.async_client.chat.completions.create(**self._request(prompt))
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
 
 class LocalHFBackend(BaseBackend):
     provider_name = "local"
@@ -200,30 +341,97 @@ class LocalHFBackend(BaseBackend):
         except ValueError:
             return -1
 
+    def _generation_kwargs(self) -> Dict[str, Any]:
+        return {
+            "max_new_tokens": LOCAL_MAX_NEW_TOKENS,
+            "do_sample": False,
+            "temperature": LLM_TEMPERATURE,
+            "top_p": LLM_TOP_P,
+        }
+
+    def settings(self) -> Dict[str, Any]:
+        return {"provider": self.provider_name, "model": LOCAL_MODEL_PATH, **self._generation_kwargs()}
+
     def generate(self, prompt: str) -> str:
-        outputs = self.generator(
-            prompt,
-            max_new_tokens=LOCAL_MAX_NEW_TOKENS,
-            do_sample=False,
-            temperature=LLM_TEMPERATURE,
-            top_p=LLM_TOP_P,
-        )
+        outputs = self.generator(prompt, **self._generation_kwargs())
         generated_text = outputs[0]["generated_text"]
         if generated_text.startswith(prompt):
             generated_text = generated_text[len(prompt) :]
         return generated_text.strip()
 
+    def stream(self, prompt: str) -> Iterator[str]:
+        """generate() chạy ở thread riêng, TextIteratorStreamer trả text theo từng token"""
+        streamer = TextIteratorStreamer(self.generator.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        worker = threading.Thread(
+            target=self.generator,
+            args=(prompt,),
+            kwargs={**self._generation_kwargs(), "streamer": streamer},
+            daemon=True,
+        )
+        worker.start()
+        for text in streamer:
+            if text:
+                yield text
+        worker.join()
+
+
+class FakeBackendError(ConnectionError):
+    """Lỗi tạm thời giả lập (retryable)."""
+
+
+class FakeBackend(BaseBackend):
+    """Backend cục bộ không cần network: độ trễ, tốc độ token và tỉ lệ lỗi chỉnh qua config."""
+
+    provider_name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: float = FAKE_LLM_LATENCY_MS,
+        token_delay_ms: float = FAKE_LLM_TOKEN_DELAY_MS,
+        failure_rate: float = FAKE_LLM_FAILURE_RATE,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.token_delay_ms = token_delay_ms
+        self.failure_rate = failure_rate
+        self.calls = 0
+
+    def settings(self) -> Dict[str, Any]:
+        return {"provider": self.provider_name}
+
+    def _answer(self, prompt: str) -> List[str]:
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        if random.random() < self.failure_rate:
+            raise FakeBackendError("fake backend: lỗi tạm thời giả lập")
+        question = prompt.strip().splitlines()[-1][:80] if prompt.strip() else ""
+        return f"Trả lời thử cho: {question} [1]".split(" ")
+
+    def generate(self, prompt: str) -> str:
+        return " ".join(self._answer(prompt))
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        for i, word in enumerate(self._answer(prompt)):
+            time.sleep(self.token_delay_ms / 1000)
+            yield word if i == 0 else " " + word
+
 
 # Factory -----------------------------------------------------------------------
 
 def create_backend() -> BaseBackend:
+    """Backend theo LLM_PROVIDER, bọc trong ResilientBackend (giới hạn, retry, circuit breaker)"""
+    from resilience import ResilientBackend  # resilience import BaseBackend từ module này
+
     if LLM_PROVIDER == "gemini":
-        return GeminiBackend()
-    if LLM_PROVIDER == "openai":
-        return OpenAIBackend()
-    if LLM_PROVIDER == "local":
-        return LocalHFBackend()
-    raise ValueError(f"LLM provider '{LLM_PROVIDER}' không được hỗ trợ.")
+        backend: BaseBackend = GeminiBackend()
+    elif LLM_PROVIDER == "openai":
+        backend = OpenAIBackend()
+    elif LLM_PROVIDER == "local":
+        backend = LocalHFBackend()
+    elif LLM_PROVIDER == "fake":
+        backend = FakeBackend()
+    else:
+        raise ValueError(f"LLM provider '{LLM_PROVIDER}' không được hỗ trợ.")
+    return ResilientBackend(backend)
 
 
 # High-level interface ----------------------------------------------------------
@@ -233,7 +441,9 @@ class KinhDichLLM:
 
     def __init__(self) -> None:
         self.backend = create_backend()
-        self.conversation_history: Dict[str, List[Dict[str, Any]]] = {}
+        # Bản rút gọn các lượt gần nhất, giới hạn bộ nhớ + LRU/idle eviction
+        self.conversation_history = SessionStore()
+        self.response_cache: Optional[ResponseCache] = None
         self._test_connection()
 
     def _test_connection(self) -> None:
@@ -247,34 +457,63 @@ class KinhDichLLM:
     def generate(self, prompt: str, session_id: str = "default", use_history: bool = False) -> str:
         try:
             full_prompt = self._inject_history(prompt, session_id) if use_history else prompt
-            response = self.backend.generate(full_prompt)
+            response = self.response_cache.get(full_prompt) if self.response_cache is not None else None
+            if response is None:
+                response = self.backend.generate(full_prompt)
+                if self.response_cache is not None:
+                    self.response_cache.set(full_prompt, response)
             self._store_history(session_id, prompt, response)
             return response
         except Exception as exc:
             logger.error("LLM generation failed: %s", exc)
             return self._get_fallback_response(prompt)
 
+    async def astream(self, prompt: str, session_id: str = "default", use_history: bool = False) -> AsyncIterator[str]:
+        """Như ``generate`` nhưng trả từng phần khi backend sinh ra (không block event loop).
+
+        Lỗi trước phần đầu tiên → trả fallback response; lỗi giữa chừng → dừng ở phần đã có.
+        """
+        full_prompt = self._inject_history(prompt, session_id) if use_history else prompt
+        cached = self.response_cache.get(full_prompt) if self.response_cache is not None else None
+        if cached is not None:
+            self._store_history(session_id, prompt, cached)
+            yield cached
+            return
+        parts: List[str] = []
+        try:
+            async for chunk in self.backend.astream(full_prompt):
+                parts.append(chunk)
+                yield chunk
+        except Exception as exc:
+            logger.error("LLM streaming failed: %s", exc)
+            if not parts:
+                yield self._get_fallback_response(prompt)
+            return
+        response = "".join(parts).strip()
+        if not response:
+            yield self._get_fallback_response(prompt)
+            return
+        if self.response_cache is not None:
+            self.response_cache.set(full_prompt, response)
+        self._store_history(session_id, prompt, response)
+
     def _inject_history(self, prompt: str, session_id: str) -> str:
-        if session_id not in self.conversation_history:
+        recent_history = self.conversation_history.recent(session_id, SESSION_HISTORY_TURNS)
+        if not recent_history:
             return prompt
 
-        recent_history = self.conversation_history[session_id][-3:]
         parts = ["NGỮ CẢNH CUỘC TRÒ CHUYỆN TRƯỚC:"]
-        for item in recent_history:
-            prompt_preview = item["prompt"][:100] + "..." if len(item["prompt"]) > 100 else item["prompt"]
-            response_preview = item["response"][:150] + "..." if len(item["response"]) > 150 else item["response"]
-            parts.append(f"Hỏi: {prompt_preview}")
-            parts.append(f"Đáp: {response_preview}")
+        for turn in recent_history:
+            # Store chỉ giữ bản rút gọn của prompt / câu trả lời
+            parts.append(f"Hỏi: {turn.prompt}")
+            parts.append(f"Đáp: {turn.response}")
 
         parts.append("---")
         parts.append(prompt)
         return "\n".join(parts)
 
     def _store_history(self, session_id: str, prompt: str, response: str) -> None:
-        history = self.conversation_history.setdefault(session_id, [])
-        history.append({"prompt": prompt, "response": response, "timestamp": time.time()})
-        if len(history) > 10:
-            self.conversation_history[session_id] = history[-10:]
+        self.conversation_history.append(session_id, prompt, response)
 
     def _get_fallback_response(self, prompt: str) -> str:
         if "quẻ" in prompt.lower() or "hexagram" in prompt.lower():
@@ -294,7 +533,10 @@ class KinhDichLLMAdvanced(KinhDichLLM):
 
     def __init__(self) -> None:
         super().__init__()
-        self.response_cache: Dict[str, Dict[str, Any]] = {}
+        # Exact theo prompt (+ semantic do ReasoningAgent dùng); LLM_CACHE_BACKEND=sqlite: giữ qua
+        # restart và dùng chung giữa các worker
+        if LLM_CACHE_ENABLED:
+            self.response_cache = ResponseCache(self.backend.settings())
 
     def generate_with_analysis(
         self,
@@ -304,15 +546,7 @@ class KinhDichLLMAdvanced(KinhDichLLM):
     ) -> Dict[str, Any]:
         try:
             response = self.generate(prompt, session_id)
-            analysis = self._analyze_response_quality(response, retrieved_docs)
-            citations = self._extract_citations(response, retrieved_docs)
-            return {
-                "answer": response,
-                "confidence": analysis["confidence"],
-                "reasoning": analysis["reasoning"],
-                "citations": citations,
-                "session_id": session_id,
-            }
+            return self.analyze(response, retrieved_docs, session_id)
         except Exception as exc:
             logger.error("Error in advanced LLM generation: %s", exc)
             return {
@@ -323,6 +557,18 @@ class KinhDichLLMAdvanced(KinhDichLLM):
                 "error": str(exc),
             }
 
+    def analyze(self, response: str, retrieved_docs: List[Dict[str, Any]], session_id: str = "default") -> Dict[str, Any]:
+        """Kết quả như ``generate_with_analysis`` cho câu trả lời đã có (vd. ghép từ stream)"""
+        analysis = self._analyze_response_quality(response, retrieved_docs)
+        citations = self._extract_citations(response, retrieved_docs)
+        return {
+            "answer": response,
+            "confidence": analysis["confidence"],
+            "reasoning": analysis["reasoning"],
+            "citations": citations,
+            "session_id": session_id,
+        }
+
     def _analyze_response_quality(self, response: str, docs: List[Dict[str, Any]]) -> Dict[str, Any]:
         confidence = 0.5
         reasoning_points = []
@@ -374,15 +620,40 @@ class KinhDichLLMAdvanced(KinhDichLLM):
 # Singleton helpers -------------------------------------------------------------
 
 _llm_instance: Optional[KinhDichLLM] = None
+_llm_lock = threading.Lock()
 
 
 def get_llm() -> KinhDichLLM:
+    """Một LLM cho mọi agent trong process (gọi song song qua asyncio.to_thread)"""
     global _llm_instance
     if _llm_instance is None:
-        _llm_instance = KinhDichLLMAdvanced()
+        with _llm_lock:
+            if _llm_instance is None:
+                _llm_instance = KinhDichLLMAdvanced()
     return _llm_instance
 
 
+def backend_stats() -> Optional[Dict[str, Any]]:
+    """Circuit breaker + bộ đếm của lớp resilience (None nếu LLM chưa khởi tạo)"""
+    if _llm_instance is None:
+        return None
+    return getattr(_llm_instance.backend, "stats", None)
+
+
+def session_store_stats() -> Optional[Dict[str, Any]]:
+    """Metrics của conversation-history store (None nếu LLM chưa khởi tạo)"""
+    if _llm_instance is None:
+        return None
+    return _llm_instance.conversation_history.stats
+
+
+def response_cache_stats() -> Optional[Dict[str, Any]]:
+    """Metrics của response cache (None nếu LLM chưa khởi tạo hoặc cache tắt)"""
+    if _llm_instance is None or _llm_instance.response_cache is None:
+        return None
+    return _llm_instance.response_cache.stats
+
+
 def generate(prompt: str, session_id: str = "default", use_history: bool = False) -> str:
     llm = get_llm()
     return llm.generate(prompt, session_id, use_history)
@@ -400,6 +671,18 @@ def generate_advanced(
     return {"answer": response, "confidence": 0.7, "reasoning": "Basic generation", "citations": []}
 
 
+def analyze_response(
+    response: str,
+    retrieved_docs: List[Dict[str, Any]],
+    session_id: str = "default",
+) -> Dict[str, Any]:
+    """Kết quả kiểu ``generate_advanced`` cho câu trả lời đã stream xong"""
+    llm = get_llm()
+    if isinstance(llm, KinhDichLLMAdvanced):
+        return llm.analyze(response, retrieved_docs, session_id)
+    return {"answer": response, "confidence": 0.7, "reasoning": "Basic generation", "citations": []}
+
+
 def test_llm() -> None:
     """Quick manual test for CLI usage."""
     print("Testing Kinh Dịch LLM...")
@@ -1,8 +1,15 @@
 """
 Module mapping cho hệ thống Kinh Dịch - Phát hiện và chuyển đổi quẻ
 """
-from typing import Dict, List, Optional
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional
 import re
+import threading
+import unicodedata
+
+from lexicon import get_lexicon
+from matcher import KeywordMatcher
+from text_utils import fold_diacritics, unify_tone_placement
 
 # ──────────────────────────────────────────────────────────────
 # Hexagram Mapping Data
@@ -168,28 +175,120 @@ HEXAGRAM_LOOKUP = {
 # Detection Functions
 # ──────────────────────────────────────────────────────────────
 
+_PUNCT_RE = re.compile(r'[^\w\s]')
+
+# Profile "hexagrams" của lexicon (HEXAGRAM_MAP + require_json/hexagram_keywords.json):
+# keyword đã chuẩn hóa, priority = thứ tự quẻ trong HEXAGRAM_MAP, compile sẵn thành automaton
+LEXICON_PROFILE = "hexagrams"
+
+
+@dataclass(frozen=True)
+class HexagramMatch:
+    code: str
+    keyword: str
+    start: int  # span trên text đã NFC
+    end: int
+    confidence: float
+
+
+def _prepare_text(text: str) -> str:
+    """Lowercase, bỏ dấu câu, "_" → space, thống nhất dấu thanh - giữ nguyên độ dài để span khớp input"""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = _PUNCT_RE.sub(' ', text).replace('_', ' ')
+    return unify_tone_placement(text)
+
+
+def _is_whole_word(text: str, start: int, end: int) -> bool:
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+def _match_confidence(keyword: str) -> float:
+    if keyword.startswith(("quẻ ", "que ")):
+        return 1.0
+    return 0.8 if " " in keyword else 0.6
+
+
+def detect_hexagrams(text: str) -> List[HexagramMatch]:
+    """
+    Phát hiện mọi quẻ trong văn bản bằng một lượt quét
+
+    Returns:
+        Mỗi quẻ một HexagramMatch (keyword có confidence cao nhất, rồi dài nhất),
+        sắp theo confidence giảm dần rồi thứ tự quẻ trong HEXAGRAM_MAP.
+        Chỉ tính keyword đứng nguyên từ: "khôn" trong "không", "bi" trong "biết" bị bỏ qua
+    """
+    if not text:
+        return []
+
+    clean = _prepare_text(text)
+    best: Dict[str, tuple] = {}
+    for match in get_lexicon().matcher(LEXICON_PROFILE).iter_matches(clean):
+        if not _is_whole_word(clean, match.start, match.end):
+            continue
+        confidence = _match_confidence(match.keyword)
+        current = best.get(match.value)
+        if current is None or (confidence, match.length) > (current[0].confidence, current[0].end - current[0].start):
+            best[match.value] = (
+                HexagramMatch(match.value, match.keyword, match.start, match.end, confidence),
+                match.priority,
+            )
+    ranked = sorted(best.values(), key=lambda item: (-item[0].confidence, item[1], item[0].start))
+    return [found for found, _ in ranked]
+
+
 def detect_hexagram(text: str) -> Optional[str]:
     """
     Phát hiện mã quẻ trong văn bản đầu vào
-    
+
     Args:
         text: Văn bản đầu vào từ người dùng
-        
+
     Returns:
-        Mã quẻ (VD: "QUE_CACH") hoặc None nếu không phát hiện được
+        Mã quẻ (VD: "QUE_CACH") hoặc None nếu không phát hiện được.
+        Giữ thứ tự ưu tiên cũ: quẻ xuất hiện trước trong HEXAGRAM_MAP thắng; chỉ tính
+        keyword đứng nguyên từ
     """
     if not text:
         return None
-        
-    text_lower = text.lower().strip()
-    
-    # Loại bỏ dấu câu và ký tự đặc biệt
-    text_clean = re.sub(r'[^\w\s]', ' ', text_lower)
-    
-    # Tìm kiếm theo độ ưu tiên (từ cụ thể đến tổng quát)
-    for code, keywords in HEXAGRAM_MAP.items():
-        for keyword in sorted(keywords, key=len, reverse=True):
-            if keyword in text_clean:
-                return code
-    
-    return None
+
+    clean = _prepare_text(text)
+    best = None
+    for match in get_lexicon().matcher(LEXICON_PROFILE).iter_matches(clean):
+        if _is_whole_word(clean, match.start, match.end) and (best is None or match.priority < best.priority):
+            best = match
+    return best.value if best else None
+
+
+_folded_matcher: Optional[KeywordMatcher] = None
+_folded_matcher_lock = threading.Lock()
+
+
+def _get_folded_matcher() -> KeywordMatcher:
+    """Keyword quẻ đã bỏ dấu → tập mã quẻ (Khôn/Khốn cùng thành "khon")"""
+    global _folded_matcher
+    if _folded_matcher is None:
+        with _folded_matcher_lock:
+            if _folded_matcher is None:
+                codes: Dict[str, set] = {}
+                for keyword, code in get_lexicon().mapping(LEXICON_PROFILE).items():
+                    codes.setdefault(fold_diacritics(keyword), set()).add(code)
+                _folded_matcher = KeywordMatcher((keyword, frozenset(found)) for keyword, found in codes.items())
+    return _folded_matcher
+
+
+def detect_hexagram_candidates_folded(text: str) -> FrozenSet[str]:
+    """
+    Các quẻ mà văn bản (có thể gõ không dấu) có thể nhắc tới - chỉ tính keyword đứng nguyên từ
+
+    Returns:
+        Tập mã quẻ; nhiều hơn một phần tử khi tên bỏ dấu bị trùng (VD: "khon" → Khôn, Khốn)
+    """
+    if not text:
+        return frozenset()
+
+    clean = fold_diacritics(_prepare_text(text))
+    found: set = set()
+    for match in _get_folded_matcher().iter_matches(clean):
+        if _is_whole_word(clean, match.start, match.end):
+            found |= match.value
+    return frozenset(found)
@@ -0,0 +1,272 @@
+"""
+Module matcher.py - Multi-pattern keyword matching compile một lần
+
+- ``KeywordMatcher``: Aho–Corasick automaton, quét input một lượt và trả về mọi
+  keyword xuất hiện (substring), chọn match tốt nhất theo longest-match rồi priority.
+- ``NGramIndex``: index bigram → keys, lọc ứng viên trước khi chạy fuzzy scorer.
+
+Automaton lưu dạng mảng int phẳng (CSR) để có thể serialize/mmap nguyên khối.
+"""
+from __future__ import annotations
+
+import math
+from array import array
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class KeywordMatch:
+    start: int
+    end: int
+    keyword: str
+    value: Any
+    priority: int
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start
+
+
+class KeywordMatcher:
+    """Aho–Corasick automaton trên Unicode codepoints.
+
+    ``patterns`` là các cặp (keyword, value); priority mặc định theo thứ tự
+    xuất hiện (nhỏ hơn = ưu tiên hơn). Keyword trùng lặp giữ bản đầu tiên.
+    """
+
+    TABLE_NAMES = ("offsets", "chars", "targets", "fail", "out", "dict_link", "pat_len")
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]] = (), priorities: Optional[Sequence[int]] = None) -> None:
+        self.keywords: List[str] = []
+        self.values: List[Any] = []
+        self.priorities: List[int] = []
+
+        seen: Dict[str, int] = {}
+        for i, (keyword, value) in enumerate(patterns):
+            if not keyword or keyword in seen:
+                continue
+            seen[keyword] = len(self.keywords)
+            self.keywords.append(keyword)
+            self.values.append(value)
+            self.priorities.append(priorities[i] if priorities is not None else i)
+        self._compile()
+
+    # ------------------------------------------------------------------
+    def _compile(self) -> None:
+        # 1) Trie bằng dict (chỉ dùng lúc build)
+        goto: List[Dict[int, int]] = [{}]
+        out = [-1]
+        for pid, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                code = ord(ch)
+                nxt = goto[state].get(code)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][code] = nxt
+                    goto.append({})
+                    out.append(-1)
+                state = nxt
+            out[state] = pid
+
+        # 2) Fail links + dictionary suffix links theo BFS
+        fail = [0] * len(goto)
+        dict_link = [-1] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for code, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and code not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(code, 0)
+                link = fail[nxt]
+                dict_link[nxt] = link if out[link] >= 0 else dict_link[link]
+
+        # 3) Đóng băng thành mảng phẳng: edges của state s nằm trong [offsets[s], offsets[s+1])
+        offsets = array("i", [0])
+        chars = array("i")
+        targets = array("i")
+        for edges in goto:
+            for code in sorted(edges):
+                chars.append(code)
+                targets.append(edges[code])
+            offsets.append(len(chars))
+
+        self._set_tables(
+            offsets, chars, targets,
+            array("i", fail), array("i", out), array("i", dict_link),
+            array("i", (len(k) for k in self.keywords)),
+        )
+
+    def _set_tables(self, offsets, chars, targets, fail, out, dict_link, pat_len) -> None:
+        """Gán các bảng (array/memoryview int32) - dùng chung cho build và load từ artifact"""
+        self._offsets = offsets
+        self._chars = chars
+        self._targets = targets
+        self._fail = fail
+        self._out = out
+        self._dict_link = dict_link
+        self._pat_len = pat_len
+        self._runtime = None
+
+    def tables(self) -> Dict[str, Sequence[int]]:
+        """Các bảng int32 của automaton theo ``TABLE_NAMES`` (để serialize)"""
+        return {name: getattr(self, "_" + name) for name in self.TABLE_NAMES}
+
+    @classmethod
+    def from_tables(
+        cls,
+        keywords: Sequence[str],
+        values: Sequence[Any],
+        priorities: Sequence[int],
+        tables: Dict[str, Sequence[int]],
+    ) -> "KeywordMatcher":
+        """Dựng matcher từ bảng đã compile sẵn (vd. memoryview trên file mmap), không build lại trie"""
+        matcher = cls.__new__(cls)
+        matcher.keywords = list(keywords)
+        matcher.values = list(values)
+        matcher.priorities = list(priorities)
+        matcher._set_tables(*(tables[name] for name in cls.TABLE_NAMES))
+        return matcher
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    @property
+    def state_count(self) -> int:
+        return len(self._fail)
+
+    # ------------------------------------------------------------------
+    def _runtime_tables(self) -> Tuple[List[Dict[str, int]], List[int], List[Tuple[int, ...]]]:
+        """Bảng tra cứu cho vòng quét, dựng lười từ mảng phẳng (một lần mỗi matcher):
+        - goto[state]: ký tự → state kế tiếp
+        - fail[state]: fail link (list Python, index nhanh hơn memoryview)
+        - outputs[state]: mọi pattern id kết thúc tại state (đã đi hết dictionary suffix links)
+        """
+        runtime = self._runtime
+        if runtime is None:
+            offsets, chars, targets = self._offsets, self._chars, self._targets
+            goto = [
+                {chr(chars[i]): targets[i] for i in range(offsets[state], offsets[state + 1])}
+                for state in range(len(offsets) - 1)
+            ]
+
+            outputs: List[Tuple[int, ...]] = []
+            for state in range(len(self._fail)):
+                pids = []
+                s = state if self._out[state] >= 0 else self._dict_link[state]
+                while s > 0:
+                    pids.append(self._out[s])
+                    s = self._dict_link[s]
+                outputs.append(tuple(pids))
+            runtime = self._runtime = (goto, list(self._fail), outputs)
+        return runtime
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """(vị trí kết thúc, pattern id) của mọi keyword xuất hiện - vòng quét thô, không tạo object"""
+        goto, fail, outputs = self._runtime_tables()
+        found = []
+        state = 0
+        for i, ch in enumerate(text):
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            state = nxt or 0
+            if outputs[state]:
+                found.extend((i + 1, pid) for pid in outputs[state])
+        return found
+
+    def _match(self, end: int, pid: int) -> KeywordMatch:
+        return KeywordMatch(end - self._pat_len[pid], end, self.keywords[pid], self.values[pid], self.priorities[pid])
+
+    def iter_matches(self, text: str) -> Iterator[KeywordMatch]:
+        """Mọi keyword xuất hiện trong ``text`` (kể cả chồng lấn), theo vị trí kết thúc"""
+        for end, pid in self.spans(text):
+            yield self._match(end, pid)
+
+    def find_all(self, text: str) -> List[KeywordMatch]:
+        return list(self.iter_matches(text))
+
+    def best(self, text: str) -> Optional[KeywordMatch]:
+        """Longest match; cùng độ dài thì priority nhỏ hơn thắng, rồi vị trí sớm hơn"""
+        pat_len, priorities = self._pat_len, self.priorities
+        best_key, best_span = None, None
+        for end, pid in self.spans(text):
+            key = (pat_len[pid], -priorities[pid], pat_len[pid] - end)
+            if best_key is None or key > best_key:
+                best_key, best_span = key, (end, pid)
+        return self._match(*best_span) if best_span else None
+
+    def first(self, text: str) -> Optional[KeywordMatch]:
+        """Match có priority nhỏ nhất (bất kể độ dài), hòa thì vị trí kết thúc sớm hơn"""
+        priorities = self.priorities
+        best_span = None
+        for end, pid in self.spans(text):
+            if best_span is None or priorities[pid] < priorities[best_span[1]]:
+                best_span = (end, pid)
+        return self._match(*best_span) if best_span else None
+
+
+class NGramIndex:
+    """Bigram inverted index: chỉ những key chia sẻ đủ bigram với query mới qua fuzzy scorer.
+
+    ``partial_ratio`` căn chuỗi ngắn hơn (query hoặc key, dài m) vào chuỗi dài hơn, nên với
+    ngưỡng ``threshold`` chuỗi ngắn chịu tối đa 2m·(100 - threshold)/100 thao tác indel,
+    mỗi thao tác làm mất tối đa 2 bigram của nó. Chuỗi quá ngắn để bound có nghĩa (có thể
+    đạt ngưỡng mà không chung bigram nào) luôn được chấm điểm.
+    """
+
+    def __init__(self, keys: Sequence[str]) -> None:
+        self.keys = list(keys)
+        self._postings: Dict[str, List[int]] = {}
+        self._gram_counts: List[int] = []
+        self._loose_keys: Dict[float, List[int]] = {}  # threshold → key không lọc được bằng bigram
+        for key_id, key in enumerate(self.keys):
+            grams = self._grams(key)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(key_id)
+
+    @staticmethod
+    def _grams(text: str) -> set:
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    @staticmethod
+    def _needed(length: int, gram_count: int, threshold: float) -> int:
+        """Số bigram chung tối thiểu khi chuỗi ngắn hơn dài ``length`` (có ``gram_count`` bigram)"""
+        max_indels = math.floor(2 * length * (100 - threshold) / 100)
+        return gram_count - 2 * max_indels
+
+    def candidates(self, text: str, threshold: float = 80) -> List[str]:
+        """Keys có thể đạt ``threshold``, giữ nguyên thứ tự gốc của keys"""
+        text_grams = self._grams(text)
+        if self._needed(len(text), len(text_grams), threshold) <= 0:
+            # Query ngắn: có thể khớp một key bất kỳ dài hơn nó mà không chung bigram nào
+            return list(self.keys)
+        shared: Counter = Counter()
+        for gram in text_grams:
+            for key_id in self._postings.get(gram, ()):
+                shared[key_id] += 1
+
+        loose = self._loose_keys.get(threshold)
+        if loose is None:
+            loose = self._loose_keys[threshold] = [
+                key_id for key_id, key in enumerate(self.keys)
+                if self._needed(len(key), self._gram_counts[key_id], threshold) <= 0
+            ]
+
+        result = []
+        for key_id in sorted(set(shared).union(loose)):
+            # Budget theo chuỗi ngắn hơn: query ngắn được căn vào bên trong key dài
+            if len(text) <= len(self.keys[key_id]):
+                needed = self._needed(len(text), len(text_grams), threshold)
+            else:
+                needed = self._needed(len(self.keys[key_id]), self._gram_counts[key_id], threshold)
+            if shared[key_id] >= needed:
+                result.append(self.keys[key_id])
+        return result
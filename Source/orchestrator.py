@@ -1,7 +1,8 @@
 import asyncio
+import threading
 import time
 import logging
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional
 from tqdm.asyncio import tqdm
 
 from base_agent import ProcessingState
@@ -9,6 +10,7 @@ from dispatcher_agent import DispatcherAgent
 from linguistics_agent import LinguisticsAgent
 from retrieval_agent import RetrievalAgent
 from reasoning_agent import ReasoningAgent
+from llm import backend_stats, response_cache_stats, session_store_stats
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +18,11 @@ class MultiAgentOrchestrator:
     """Orchestrates multi-agent workflow cho Kinh Dịch chatbot"""
     
     def __init__(self):
+        # Lifecycle state: created → warming → ready/degraded → stopped
+        self.status = "created"
+        self.started_at = time.time()
+        self.warmup_errors: Dict[str, str] = {}
+
         # Initialize agents
         self.agents = {
             "dispatcher": DispatcherAgent(),
@@ -32,6 +39,43 @@ class MultiAgentOrchestrator:
             "reasoning"
         ]
     
+    async def warm_up(self) -> None:
+        """Preload models/connections của tất cả agents (gọi một lần lúc startup)"""
+        self.status = "warming"
+        self.warmup_errors = {}
+        for name, agent in self.agents.items():
+            try:
+                await agent.warm_up()
+            except Exception as e:
+                logger.error(f"Warm-up {name} failed: {e}")
+                self.warmup_errors[name] = str(e)
+        self.status = "degraded" if self.warmup_errors else "ready"
+        logger.info(f"Orchestrator warm-up finished: {self.status}")
+
+    def shutdown(self) -> None:
+        """Giải phóng tài nguyên (Mongo connection pool, ...) của các agents"""
+        for name, agent in self.agents.items():
+            try:
+                agent.close()
+            except Exception as e:
+                logger.warning(f"Shutdown {name} failed: {e}")
+        self.status = "stopped"
+
+    def health(self) -> Dict[str, Any]:
+        """Health/readiness state cho monitoring"""
+        return {
+            "status": self.status,
+            "ready": self.status in ("ready", "degraded"),
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "warmup_errors": dict(self.warmup_errors),
+            "agents": self._get_agent_stats(),
+            "caches": self.agents["retrieval"].cache_stats(),
+            "reranker": self.agents["reasoning"].reranker.stats if self.agents["reasoning"].reranker else None,
+            "llm_backend": backend_stats(),
+            "llm_cache": response_cache_stats(),
+            "sessions": session_store_stats(),
+        }
+
     async def process_query(self, query: str, user_name: str = None, hexagram_info: Optional[Dict] = None) -> Dict[str, Any]:
         """Process query through multi-agent pipeline"""
         
@@ -54,38 +98,70 @@ class MultiAgentOrchestrator:
                 if agent_name == "retrieval" and not state.retrieved_docs:
                     break
             
-            # Calculate total processing time
-            total_time = time.time() - start_time
-            state.processing_time["total"] = total_time
+            return self._build_result(state, time.time() - start_time)
             
-            # Build final result
-            result = {
-                "answer": state.final_response,
-                "query": state.query,
-                "query_type": state.query_type,
-                "entities": state.entities,
-                "confidence": state.confidence,
-                "sources": self._format_sources(state.reranked_docs or []),
-                "reasoning_chain": state.reasoning_chain,
-                "performance": {
-                    "total_time_ms": round(total_time * 1000, 2),
-                    "agent_times": {
-                        name: round(time_ms * 1000, 2) 
-                        for name, time_ms in state.processing_time.items()
-                    }
-                },
-                "agent_stats": self._get_agent_stats(),
-                "success": len(state.final_response) > 0
-            }
+        except Exception as e:
+            return self._create_error_response(query, str(e))
+    
+    async def stream_query(
+        self, query: str, user_name: str = None, hexagram_info: Optional[Dict] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Như ``process_query`` nhưng trả câu trả lời theo từng phần:
+        ``{"type": "token", "text": ...}`` khi LLM sinh ra, cuối cùng ``{"type": "result", "result": ...}``
+        (cùng format ``process_query``, answer đã xử lý citation)."""
+        
+        state = ProcessingState(query=query, hexagram_info=hexagram_info or {})
+        start_time = time.time()
+        
+        try:
+            # Các agent trước reasoning chạy như process_query
+            for agent_name in self.workflow[:-1]:
+                state = await self.agents[agent_name].execute_with_monitoring(state)
+                if agent_name == "retrieval" and not state.retrieved_docs:
+                    break
+            
+            first_token_time = None
+            if state.retrieved_docs:
+                async for chunk in self.agents[self.workflow[-1]].stream_with_monitoring(state):
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                    yield {"type": "token", "text": chunk}
             
-            return result
+            result = self._build_result(state, time.time() - start_time)
+            if first_token_time is not None:
+                result["performance"]["time_to_first_token_ms"] = round(first_token_time * 1000, 2)
+            yield {"type": "result", "result": result}
             
         except Exception as e:
-            return self._create_error_response(query, str(e))
+            yield {"type": "result", "result": self._create_error_response(query, str(e))}
+    
+    def _build_result(self, state: ProcessingState, total_time: float) -> Dict[str, Any]:
+        """Final result từ state sau workflow"""
+        
+        state.processing_time["total"] = total_time
+        return {
+            "answer": state.final_response,
+            "query": state.query,
+            "query_type": state.query_type,
+            "entities": state.entities,
+            "confidence": state.confidence,
+            "sources": self._format_sources(state.reranked_docs or [], state.rerank_scores),
+            "reasoning_chain": state.reasoning_chain,
+            "performance": {
+                "total_time_ms": round(total_time * 1000, 2),
+                "agent_times": {
+                    name: round(time_ms * 1000, 2) 
+                    for name, time_ms in state.processing_time.items()
+                }
+            },
+            "agent_stats": self._get_agent_stats(),
+            "success": len(state.final_response) > 0
+        }
     
-    def _format_sources(self, docs: List[Dict]) -> List[Dict]:
-        """Format sources cho UI display"""
+    def _format_sources(self, docs: List[Dict], scores: Optional[List[float]] = None) -> List[Dict]:
+        """Format sources cho UI display (``scores`` song song với ``docs``)"""
         
+        scores = scores or []
         sources = []
         for i, doc in enumerate(docs[:10], 1):
             source = {
@@ -93,7 +169,7 @@ class MultiAgentOrchestrator:
                 "chunk_id": doc.get("_id", "unknown"),
                 "hexagram": doc.get("hexagram", ""),
                 "content_type": doc.get("content_type", ""),
-                "relevance_score": doc.get("rerank_score", doc.get("similarity_score", 0)),
+                "relevance_score": scores[i - 1] if i <= len(scores) else doc.get("similarity_score", 0),
                 "preview": (doc.get("text", "")[:150] + "...") if len(doc.get("text", "")) > 150 else doc.get("text", "")
             }
             sources.append(source)
@@ -122,8 +198,51 @@ class MultiAgentOrchestrator:
             "reasoning_chain": [f"Error: {error}"]
         }
 
+# Process-wide orchestrator ----------------------------------------------------
+
+_orchestrator: Optional[MultiAgentOrchestrator] = None
+_orchestrator_lock = threading.Lock()
+
+def get_orchestrator() -> MultiAgentOrchestrator:
+    """Long-lived orchestrator dùng chung cho toàn process (agents chỉ khởi tạo một lần)"""
+    global _orchestrator
+    if _orchestrator is None:
+        with _orchestrator_lock:
+            if _orchestrator is None:
+                _orchestrator = MultiAgentOrchestrator()
+    return _orchestrator
+
+def startup() -> MultiAgentOrchestrator:
+    """Khởi tạo và warm-up orchestrator trước khi server nhận request"""
+    orchestrator = get_orchestrator()
+    if orchestrator.status == "created":
+        asyncio.run(orchestrator.warm_up())
+    return orchestrator
+
+def shutdown() -> None:
+    """Shutdown hook: đóng tài nguyên và bỏ singleton"""
+    global _orchestrator
+    with _orchestrator_lock:
+        if _orchestrator is not None:
+            _orchestrator.shutdown()
+            _orchestrator = None
+
+def health() -> Dict[str, Any]:
+    """Health/readiness của orchestrator (không khởi tạo nếu chưa startup)"""
+    if _orchestrator is None:
+        return {"status": "not_started", "ready": False}
+    return _orchestrator.health()
+
 # Compatibility function
 async def answer_with_agents(query: str, user_name: str = None, hexagram_info: Optional[Dict] = None) -> Dict[str, Any]:
     """Main interface cho multi-agent system"""
-    orchestrator = MultiAgentOrchestrator()
+    orchestrator = get_orchestrator()
     return await orchestrator.process_query(query, user_name, hexagram_info)
+
+async def stream_with_agents(
+    query: str, user_name: str = None, hexagram_info: Optional[Dict] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Streaming interface: token events rồi một result event (xem ``stream_query``)"""
+    orchestrator = get_orchestrator()
+    async for event in orchestrator.stream_query(query, user_name, hexagram_info):
+        yield event
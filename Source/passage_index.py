@@ -0,0 +1,263 @@
+"""
+Module passage_index.py - Chọn sentence window liên quan nhất của mỗi chunk trong token budget
+
+Chunk được tách thành các window (nhóm câu liên tiếp ≤ PASSAGE_WINDOW_TOKENS) và embed
+một lần lúc ingest. Khi rerank / dựng prompt, các window được chấm cosine với vector
+query rồi giữ những window tốt nhất vừa budget, theo đúng thứ tự trong chunk - thay cho
+cắt cứng ``text[:512]`` / ``text[:400]`` (hay đứt giữa từ và giữ phần mở đầu ít liên quan).
+
+Token ở đây là ước lượng (từ / dấu câu theo regex), đủ để giữ độ dài input ổn định.
+
+Artifact (PASSAGE_INDEX_DIR):
+  - windows.npz : embeddings [n_windows, dim] đã normalize, start/end (char offset),
+                  tokens mỗi window, chunk_offsets (window của chunk i nằm trong
+                  [chunk_offsets[i], chunk_offsets[i+1]))
+  - meta.json   : model, window_tokens, fingerprint text corpus, chunk_ids
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from records import ChunkRecord
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_RE = re.compile(r"[^.!?…;\n]+[.!?…;]*")
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_GAP = " … "
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Cắt ở ranh giới token (không đứt giữa từ), thêm "…" nếu bị cắt"""
+    for i, match in enumerate(_TOKEN_RE.finditer(text)):
+        if i == budget:
+            return text[:match.start()].rstrip() + "…"
+    return text
+
+
+def window_spans(text: str, window_tokens: int) -> List[Tuple[int, int, int]]:
+    """(start, end, tokens) của các window: gom câu liên tiếp đến khi vượt ``window_tokens``;
+    câu dài hơn window đứng riêng một window"""
+    windows: List[Tuple[int, int, int]] = []
+    start = end = tokens = 0
+    for match in _SENTENCE_RE.finditer(text):
+        sentence = match.group()
+        if not sentence.strip():
+            continue
+        s = match.start() + len(sentence) - len(sentence.lstrip())
+        e = match.end() - (len(sentence) - len(sentence.rstrip()))
+        n = estimate_tokens(sentence)
+        if tokens and tokens + n > window_tokens:
+            windows.append((start, end, tokens))
+            tokens = 0
+        if not tokens:
+            start = s
+        end = e
+        tokens += n
+    if tokens:
+        windows.append((start, end, tokens))
+    return windows
+
+
+def corpus_fingerprint(records: Sequence[ChunkRecord]) -> str:
+    digest = hashlib.sha1()
+    for record in records:
+        digest.update(str(record._id).encode("utf-8"))
+        digest.update(record.text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PassageIndex:
+    """Window embeddings theo chunk (CSR) + chọn window theo budget."""
+
+    def __init__(
+        self,
+        chunk_ids: List[str],
+        chunk_offsets: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        tokens: np.ndarray,
+        vectors: np.ndarray,
+        model_name: str = "",
+        window_tokens: int = 0,
+        fingerprint: str = "",
+    ) -> None:
+        self.chunk_ids = chunk_ids
+        self.row_of: Dict[str, int] = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+        self.chunk_offsets = chunk_offsets
+        self.starts = starts
+        self.ends = ends
+        self.tokens = tokens
+        self.vectors = vectors
+        self.model_name = model_name
+        self.window_tokens = window_tokens
+        self.fingerprint = fingerprint
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def build(
+        cls,
+        records: Sequence[ChunkRecord],
+        embed: Callable[[List[str]], np.ndarray],
+        model_name: str = "",
+        window_tokens: int = 60,
+    ) -> "PassageIndex":
+        """``embed``: list text window → ma trận [n, dim] (cùng cách encode với query)"""
+        offsets = [0]
+        spans: List[Tuple[int, int, int]] = []
+        texts: List[str] = []
+        for record in records:
+            for start, end, n in window_spans(record.text, window_tokens):
+                spans.append((start, end, n))
+                texts.append(record.text[start:end])
+            offsets.append(len(spans))
+        vectors = np.asarray(embed(texts), dtype=np.float32) if texts else np.zeros((0, 0), np.float32)
+        if len(vectors):
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        arr = np.asarray(spans, dtype=np.int32).reshape(-1, 3)
+        return cls(
+            [record._id for record in records],
+            np.asarray(offsets, dtype=np.int32),
+            arr[:, 0], arr[:, 1], arr[:, 2],
+            np.ascontiguousarray(vectors),
+            model_name, window_tokens, corpus_fingerprint(records),
+        )
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        tmp = path / "windows.tmp.npz"
+        np.savez(
+            tmp,
+            chunk_offsets=self.chunk_offsets, starts=self.starts, ends=self.ends,
+            tokens=self.tokens, vectors=self.vectors,
+        )
+        os.replace(tmp, path / "windows.npz")
+        meta = {
+            "model": self.model_name,
+            "window_tokens": self.window_tokens,
+            "fingerprint": self.fingerprint,
+            "chunk_ids": self.chunk_ids,
+        }
+        tmp_meta = path / "meta.tmp.json"
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_meta, path / "meta.json")
+
+    @classmethod
+    def load(cls, path: Path) -> "PassageIndex":
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        with np.load(path / "windows.npz") as arrays:
+            return cls(
+                meta["chunk_ids"],
+                arrays["chunk_offsets"], arrays["starts"], arrays["ends"], arrays["tokens"], arrays["vectors"],
+                meta.get("model", ""), meta.get("window_tokens", 0), meta.get("fingerprint", ""),
+            )
+
+    # ------------------------------------------------------------------
+    def select(self, record: ChunkRecord, query_vector: Optional[np.ndarray], budget: int) -> str:
+        """Các window có cosine cao nhất vừa ``budget`` token, nối theo thứ tự trong chunk.
+
+        Chunk đã vừa budget → giữ nguyên; không có vector query / window → cắt theo token.
+        """
+        text = record.text
+        if estimate_tokens(text) <= budget:
+            return text
+        row = self.row_of.get(record._id)
+        if row is None or query_vector is None or not len(self.vectors):
+            return truncate_tokens(text, budget)
+        first, last = int(self.chunk_offsets[row]), int(self.chunk_offsets[row + 1])
+        if first == last:
+            return truncate_tokens(text, budget)
+
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.vectors[first:last] @ query
+        chosen: List[int] = []
+        used = 0
+        for i in np.argsort(-scores, kind="stable"):
+            n = int(self.tokens[first + i])
+            if used + n <= budget:
+                chosen.append(first + int(i))
+                used += n
+        if not chosen:
+            best = first + int(np.argmax(scores))
+            return truncate_tokens(text[self.starts[best]:self.ends[best]], budget)
+
+        chosen.sort()
+        parts = [text[self.starts[chosen[0]]:self.ends[chosen[0]]]]
+        for prev, cur in zip(chosen, chosen[1:]):
+            # Window kề nhau nối bằng khoảng trắng, bị ngắt quãng thì đánh dấu "…"
+            parts.append(" " if cur == prev + 1 else _GAP)
+            parts.append(text[self.starts[cur]:self.ends[cur]])
+        return "".join(parts)
+
+
+def load_or_build_passage_index(
+    path: Path, records: Sequence[ChunkRecord], model_name: str, window_tokens: int,
+) -> PassageIndex:
+    """Load artifact nếu khớp model / window / text corpus; ngược lại embed window và ghi lại"""
+    path = Path(path)
+    fingerprint = corpus_fingerprint(records)
+    if (path / "meta.json").exists():
+        try:
+            index = PassageIndex.load(path)
+            if (index.model_name, index.window_tokens, index.fingerprint) == (model_name, window_tokens, fingerprint):
+                logger.info("Loaded passage index: %d windows from %s", len(index), path)
+                return index
+            logger.info("Passage index at %s is stale, rebuilding", path)
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Failed to load passage index %s: %s", path, exc)
+
+    from underthesea import word_tokenize
+
+    from embedder import get_embedder
+
+    embedder = get_embedder(model_name)
+    index = PassageIndex.build(
+        records,
+        lambda texts: embedder.encode([word_tokenize(text, format="text") for text in texts]),
+        model_name, window_tokens,
+    )
+    try:
+        index.save(path)
+    except OSError as exc:
+        logger.warning("Failed to persist passage index %s: %s", path, exc)
+    logger.info("Built passage index: %d windows for %d chunks", len(index), len(records))
+    return index
+
+
+# Singleton helpers -------------------------------------------------------------
+
+_passage_index: Optional[PassageIndex] = None
+_passage_index_lock = threading.Lock()
+
+
+def get_passage_index() -> PassageIndex:
+    """Một passage index cho mọi agent trong process (window của corpus trong CHUNKS_DATA_DIR)"""
+    global _passage_index
+    if _passage_index is None:
+        with _passage_index_lock:
+            if _passage_index is None:
+                from config import EMBED_MODEL, PASSAGE_INDEX_DIR, PASSAGE_WINDOW_TOKENS
+                from corpus_store import get_corpus_store
+
+                _passage_index = load_or_build_passage_index(
+                    PASSAGE_INDEX_DIR, get_corpus_store().docs, EMBED_MODEL, PASSAGE_WINDOW_TOKENS
+                )
+    return _passage_index
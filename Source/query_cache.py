@@ -0,0 +1,176 @@
+"""
+Module query_cache.py - Cache kết quả retrieval theo query đã chuẩn hóa (+ tier semantic tùy chọn)
+
+- Tier 1 (exact): key = query sau NFC, lowercase, thống nhất vị trí dấu thanh, bỏ dấu câu,
+  bỏ stop words - vẫn giữ dấu tiếng Việt (Khôn ≠ Khốn, Tốn ≠ Tổn, "có" ≠ "Cổ").
+  Query gõ không dấu ("que cach la gi") được tra thêm theo key bỏ dấu, nhưng chỉ nhận
+  entry khi quẻ của entry là quẻ duy nhất query đó có thể nhắc tới ("que khon" thì không).
+- Tier 2 (semantic): so cosine embedding của query với các query đã cache; vượt ngưỡng
+  thì dùng lại kết quả của query gần nhất.
+Tier exact nằm trên ``cache_backend`` (LRU + TTL trong process, hoặc SQLite dùng chung giữa
+các worker); vector của tier semantic luôn ở trong process. Kích thước/TTL/ngưỡng lấy từ config.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import AbstractSet, Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from cache_backend import CacheBackend, make_cache_backend
+from config import (
+    QUERY_CACHE_MAXSIZE, QUERY_CACHE_TTL,
+    QUERY_CACHE_SEMANTIC_MAXSIZE,
+    STOP_WORDS,
+)
+from text_utils import fold_diacritics, normalize_text
+
+_WORD_RE = re.compile(r"\w+")
+_STOP_WORDS = frozenset(normalize_text(word) for word in STOP_WORDS)
+_FOLDED_STOP_WORDS = frozenset(fold_diacritics(word) for word in _STOP_WORDS)
+_FOLDED_PREFIX = "folded:"
+
+
+def normalize_query_key(query: str, stop_words: Iterable[str] = _STOP_WORDS) -> str:
+    """Key cache: các từ (giữ dấu) không phải stop word, giữ thứ tự"""
+    stop = stop_words if isinstance(stop_words, (set, frozenset)) else frozenset(stop_words)
+    words = _WORD_RE.findall(normalize_text(query))
+    kept = [word for word in words if word not in stop]
+    # Query chỉ gồm stop words: giữ nguyên để không gộp mọi query như vậy về key rỗng
+    return " ".join(kept or words)
+
+
+def folded_query_key(query: str) -> str:
+    """Key phụ cho query gõ không dấu: như ``normalize_query_key`` nhưng bỏ dấu trước"""
+    return normalize_query_key(fold_diacritics(query), _FOLDED_STOP_WORDS)
+
+
+class QueryCache:
+    """Exact tier theo key chuẩn hóa + semantic tier theo embedding (nếu bật)."""
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = QUERY_CACHE_MAXSIZE,
+        ttl: float = QUERY_CACHE_TTL,
+        semantic_threshold: Optional[float] = None,
+        semantic_maxsize: int = QUERY_CACHE_SEMANTIC_MAXSIZE,
+        backend: Optional[CacheBackend] = None,
+        detect: Optional[Callable[[str], Optional[str]]] = None,
+        detect_folded: Optional[Callable[[str], AbstractSet[str]]] = None,
+    ) -> None:
+        self.name = name
+        self.semantic_threshold = semantic_threshold
+        # Tra theo key bỏ dấu chỉ khi có cả hai: quẻ của query có dấu / các quẻ query không dấu có thể là
+        self.detect = detect
+        self.detect_folded = detect_folded
+        self._entries: CacheBackend = backend or make_cache_backend(f"query:{name}", maxsize, ttl)
+        self._semantic_maxsize = semantic_maxsize
+        self._vector_keys: List[str] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        self._semantic_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold is not None
+
+    # ------------------------------------------------------------------
+    def get(self, query: str) -> Optional[Any]:
+        """Tier exact; miss thì caller có thể thử tiếp ``get_similar`` với embedding của query"""
+        key = normalize_query_key(query)
+        value = self._entries.get(key)
+        if value is None:
+            value = self._get_folded(query, key)
+        with self._lock:
+            self._lookups += 1
+            if value is not None:
+                self._hits += 1
+        return value
+
+    def get_similar(self, embedding: np.ndarray) -> Optional[Any]:
+        """Tier semantic: entry có cosine cao nhất ≥ ngưỡng (và còn sống trong tier exact)"""
+        if not self.semantic_enabled:
+            return None
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            if self._vectors is None or not len(self._vector_keys):
+                return None
+            scores = self._vectors @ query
+            ranked = [self._vector_keys[row] for row in np.argsort(-scores) if scores[row] >= self.semantic_threshold]
+        for key in ranked:
+            value = self._entries.get(key)
+            if value is not None:
+                with self._lock:
+                    self._semantic_hits += 1
+                return value
+        return None
+
+    def set(self, query: str, value: Any, embedding: Optional[np.ndarray] = None) -> None:
+        key = normalize_query_key(query)
+        self._entries.set(key, value)
+        if self.detect is not None and self.detect_folded is not None:
+            code = self.detect(query)
+            if code is not None:
+                self._entries.set(_FOLDED_PREFIX + folded_query_key(query), (code, key))
+        if embedding is None or not self.semantic_enabled:
+            return
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            if len(self._vector_keys) >= self._semantic_maxsize:
+                self._prune_vectors()
+            if key in self._vector_keys:
+                self._vectors[self._vector_keys.index(key)] = vector
+                return
+            self._vector_keys.append(key)
+            self._vectors = vector[None, :] if self._vectors is None else np.vstack([self._vectors, vector])
+            if len(self._vector_keys) > self._semantic_maxsize:
+                self._vector_keys = self._vector_keys[-self._semantic_maxsize:]
+                self._vectors = self._vectors[-self._semantic_maxsize:]
+
+    def _get_folded(self, query: str, key: str) -> Optional[Any]:
+        """Query gõ không dấu: entry cùng key bỏ dấu, nếu quẻ của entry là quẻ duy nhất query khớp"""
+        if self.detect_folded is None or fold_diacritics(key) != key:
+            return None
+        entry = self._entries.get(_FOLDED_PREFIX + folded_query_key(query))
+        if entry is None:
+            return None
+        code, original = entry
+        if self.detect_folded(query) != {code}:
+            return None
+        return self._entries.get(original)
+
+    def _prune_vectors(self) -> None:
+        """Bỏ vector của entry đã bị evict/hết hạn ở tier exact (chỉ khi bảng vector đầy)"""
+        if self._vectors is None:
+            return
+        alive = [row for row, key in enumerate(self._vector_keys) if key in self._entries]
+        if len(alive) != len(self._vector_keys):
+            self._vector_keys = [self._vector_keys[row] for row in alive]
+            self._vectors = self._vectors[alive] if alive else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._vector_keys = []
+            self._vectors = None
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        hits = self._hits + self._semantic_hits
+        return {
+            "size": len(self._entries),
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "semantic_hits": self._semantic_hits,
+            "misses": self._lookups - hits,
+            "hit_rate": round(hits / self._lookups, 4) if self._lookups else 0.0,
+        }
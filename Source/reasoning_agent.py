@@ -1,90 +1,242 @@
+import asyncio
 import re
 import logging
-from typing import List, Dict, Any
-from sentence_transformers import CrossEncoder
+import time
+from typing import List, Dict, Any, AsyncIterator, Optional, Sequence, Tuple
 import numpy as np
+from underthesea import word_tokenize
 
 from base_agent import BaseAgent, AgentType, ProcessingState
-from llm import generate_advanced
+from records import ChunkRecord
+from embedder import get_embedder
+from rerank_service import RerankService, get_rerank_service
+from passage_index import PassageIndex, get_passage_index, truncate_tokens
+from vector_index import LocalVectorIndex, get_local_index
+from llm import KinhDichLLM, analyze_response, generate_advanced, get_llm
 from config import *
 
 logger = logging.getLogger(__name__)
 
+PROMPT_MAX_DOCS = 8  # số chunk đưa vào context của prompt
+# Score rerank = 0.7 · cross-encoder + 0.3 · score bước 1; thiếu cross-encoder thì phần đó là 0
+CROSS_ENCODER_WEIGHT = 0.7
+STAGE_ONE_WEIGHT = 0.3
+
 class ReasoningAgent(BaseAgent):
     """Tích hợp reranking và response generation"""
     
     def __init__(self):
         super().__init__("ReasoningAgent", AgentType.REASONING)
         
-        # Initialize models
+        # Initialize models: cross-encoder dùng chung (batch giữa các request + cache score)
         try:
-            self.cross_encoder = CrossEncoder(CE_MODEL, cache_folder=CACHE_DIR)
-        except:
-            self.cross_encoder = None
+            self.reranker: Optional[RerankService] = get_rerank_service(CE_MODEL)
+        except Exception:
+            self.reranker = None
             logger.warning("Cross-encoder not available, skipping reranking")
+        self.embedder = get_embedder(EMBED_MODEL)
+        # Bước lọc cosine cần embedding của chunk: chỉ có khi dùng local vector index
+        self.vector_index: Optional[LocalVectorIndex] = None
+        if VECTOR_BACKEND == "local":
+            self.vector_index = get_local_index()
+        # Sentence windows đã embed: chỉ đưa phần liên quan của chunk vào cross-encoder / prompt
+        self.passage_index: Optional[PassageIndex] = None
+        if PASSAGE_SELECTION:
+            try:
+                self.passage_index = get_passage_index()
+            except Exception as e:
+                logger.warning(f"Passage index not available, truncating by tokens: {e}")
     
+    async def warm_up(self) -> None:
+        """Khởi tạo LLM singleton (kèm test connection) trước request đầu tiên"""
+        await asyncio.to_thread(get_llm)
+
     async def process(self, state: ProcessingState) -> ProcessingState:
         """Execute reranking + response generation"""
         
+        if not await self._prepare(state):
+            return state
+        
+        # Step 2: Build response với citations
+        response_data = await self._generate_response(state)
+        self._finish(state, response_data)
+        return state
+    
+    async def stream(self, state: ProcessingState) -> AsyncIterator[str]:
+        """Như ``process`` nhưng trả từng phần câu trả lời của LLM ngay khi có.
+        Khi stream xong, state có câu trả lời đã xử lý citation + confidence như ``process``."""
+        
+        if not await self._prepare(state):
+            yield state.final_response
+            return
+        
+        prompt = self._build_enhanced_prompt(state)
+        parts: List[str] = []
+        try:
+            llm = await asyncio.to_thread(get_llm)  # lần đầu: khởi tạo + test connection (blocking)
+            cached = self._cached_answer(llm, state)
+            if cached is not None:
+                parts.append(cached)
+                yield cached
+            else:
+                async for chunk in llm.astream(prompt):
+                    parts.append(chunk)
+                    yield chunk
+                self._remember_answer(llm, prompt, state)
+            llm_result = analyze_response("".join(parts).strip(), state.reranked_docs)
+            response_data = self._response_data(state, llm_result)
+        except Exception as e:
+            logger.error(f"Response streaming failed: {e}")
+            response_data = self._error_response()
+            if not parts:
+                yield response_data["answer"]
+        self._finish(state, response_data)
+    
+    async def _prepare(self, state: ProcessingState) -> bool:
+        """Step 1: reranking; False nếu không có document nào để trả lời"""
+        
         if not state.retrieved_docs:
             state.final_response = "Xin lỗi, tôi không tìm thấy thông tin phù hợp."
             state.confidence = 0.1
-            return state
+            return False
+        
+        # Embedding query dùng chung cho lọc cosine và chọn passage (encode tối đa một lần)
+        if state.query_embedding is None and (self.vector_index is not None or self.passage_index is not None):
+            state.query_embedding = await self._encode_query(state.query)
         
         # Step 1: Reranking
-        reranked_docs = await self._rerank_documents(state.query, state.retrieved_docs)
+        reranked_docs, rerank_scores = await self._rerank_documents(
+            state.query, state.retrieved_docs, state.query_embedding, state.retrieval_scores
+        )
         state.reranked_docs = reranked_docs
-        
-        # Step 2: Build response với citations
-        response_data = await self._generate_response(state)
+        state.rerank_scores = rerank_scores
+        return True
+    
+    def _finish(self, state: ProcessingState, response_data: Dict[str, Any]) -> None:
         state.final_response = response_data["answer"]
         state.confidence = response_data["confidence"]
         
         state.reasoning_chain.extend([
-            f"Reranked {len(state.retrieved_docs)} -> {len(reranked_docs)} documents",
+            f"Reranked {len(state.retrieved_docs)} -> {len(state.reranked_docs)} documents",
             f"Generated response with confidence: {state.confidence:.2%}"
         ])
-        
-        return state
     
-    async def _rerank_documents(self, query: str, docs: List[Dict]) -> List[Dict]:
-        """Rerank documents using cross-encoder"""
+    async def _rerank_documents(
+        self,
+        query: str,
+        docs: List[ChunkRecord],
+        query_embedding: Optional[np.ndarray] = None,
+        retrieval_scores: Optional[List[float]] = None,
+    ) -> Tuple[List[ChunkRecord], List[float]]:
+        """Cascade rerank:
+        1. score bước 1: cosine giữa embedding query và embedding chunk (local index) - gần như
+           miễn phí; không có local index (Atlas) thì dùng score retrieval (chia cho max)
+        2. chỉ RERANK_PREFILTER_TOP_N ứng viên đầu qua cross-encoder (không có score bước 1 thì
+           cả pool); bỏ bước này nếu không kịp RERANK_BUDGET_MS (ước lượng theo latency gần đây)
+
+        Mọi nhánh trả về cùng thang 0.7 · cross-encoder + 0.3 · score bước 1 (cross-encoder
+        không chạy thì tính là 0). Records có thể dùng chung với cache nên không bị sửa:
+        trả về thứ tự mới + mảng score song song.
+        """
+        started = time.perf_counter()
+        vector_scores = await self._prefilter_scores(query, docs, query_embedding)
+        if vector_scores is None:
+            vector_scores = self._retrieval_prefilter_scores(docs, retrieval_scores)
+        if vector_scores is not None:
+            order = [int(i) for i in np.argsort(-vector_scores, kind="stable")]
+            candidates = order[:max(RERANK_PREFILTER_TOP_N, 1)]
+        else:
+            # Không có score nào để lọc: giữ thứ tự retrieval, đưa cả pool qua cross-encoder
+            vector_scores = np.zeros(len(docs), dtype=np.float32)
+            order = candidates = list(range(len(docs)))
+        stage_one = order[:TOP_K_RERANK]
+        stage_one_result = (
+            [docs[i] for i in stage_one],
+            [STAGE_ONE_WEIGHT * float(vector_scores[i]) for i in stage_one],
+        )
+        
+        if not self.reranker or len(docs) <= 1:
+            return stage_one_result
         
-        if not self.cross_encoder or len(docs) <= 1:
-            return docs[:TOP_K_RERANK]
+        pool = [docs[i] for i in candidates]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        estimate_ms = self.reranker.estimate_ms(query, pool)
+        if elapsed_ms + estimate_ms > RERANK_BUDGET_MS:
+            logger.info(
+                "Skipping cross-encoder: %.0fms elapsed + ~%.0fms estimated > %.0fms budget",
+                elapsed_ms, estimate_ms, RERANK_BUDGET_MS,
+            )
+            return stage_one_result
         
         try:
-            # Prepare query-document pairs
-            pairs = []
-            for doc in docs:
-                doc_text = doc.get("text", "")[:512]  # Truncate for efficiency
-                pairs.append([query, doc_text])
+            # Get cross-encoder scores (cặp đã cache không chạy lại model)
+            passages = [self._select_passage(doc, query_embedding, RERANK_PASSAGE_TOKENS) for doc in pool]
+            cross_scores = await self.reranker.ascore(query, pool, passages)
             
-            # Get cross-encoder scores
-            cross_scores = self.cross_encoder.predict(pairs)
-            
-            # Combine với vector similarity scores
+            # Combine với score bước 1 (cosine hoặc score retrieval đã chuẩn hóa)
             final_scores = []
-            for i, doc in enumerate(docs):
-                vector_score = doc.get("similarity_score", 0.0)
+            for i, doc_index in enumerate(candidates):
+                vector_score = float(vector_scores[doc_index])
                 cross_score = cross_scores[i]
                 
                 # Weighted combination
-                combined_score = 0.7 * cross_score + 0.3 * vector_score
-                final_scores.append(combined_score)
-                
-                # Add score to document
-                doc["rerank_score"] = combined_score
+                combined_score = CROSS_ENCODER_WEIGHT * cross_score + STAGE_ONE_WEIGHT * vector_score
+                final_scores.append(float(combined_score))
             
             # Sort by combined score
-            sorted_indices = np.argsort(final_scores)[::-1]
-            reranked_docs = [docs[i] for i in sorted_indices[:TOP_K_RERANK]]
+            sorted_indices = np.argsort(final_scores)[::-1][:TOP_K_RERANK]
+            reranked_docs = [pool[i] for i in sorted_indices]
             
-            return reranked_docs
+            return reranked_docs, [final_scores[i] for i in sorted_indices]
             
         except Exception as e:
             logger.error(f"Reranking failed: {e}")
-            return docs[:TOP_K_RERANK]
+            return stage_one_result
+    
+    async def _prefilter_scores(
+        self, query: str, docs: List[ChunkRecord], query_embedding: Optional[np.ndarray]
+    ) -> Optional[np.ndarray]:
+        """Cosine [0, 1] của từng doc với query; None nếu không có embedding chunk nào"""
+        if self.vector_index is None or not docs:
+            return None
+        try:
+            if query_embedding is None:
+                query_embedding = await self._encode_query(query)
+            if query_embedding is None:
+                return None
+            scores = self.vector_index.similarities(query_embedding, [doc.get("_id") for doc in docs])
+        except Exception as e:
+            logger.warning(f"Cosine prefilter failed: {e}")
+            return None
+        if np.isnan(scores).all():
+            return None
+        # Doc không có trong index: score 0 (thấp nhất của thang [0, 1])
+        return np.nan_to_num(scores, nan=0.0)
+    
+    @staticmethod
+    def _retrieval_prefilter_scores(
+        docs: List[ChunkRecord], retrieval_scores: Optional[List[float]]
+    ) -> Optional[np.ndarray]:
+        """Score retrieval đưa về [0, 1] (chia cho max); None nếu thiếu hoặc toàn 0 (hexagram, random)"""
+        if not retrieval_scores or len(retrieval_scores) != len(docs):
+            return None
+        scores = np.clip(np.asarray(retrieval_scores, dtype=np.float32), 0.0, None)
+        top = float(scores.max())
+        return scores / top if top > 0 else None
+    
+    async def _encode_query(self, query: str) -> Optional[np.ndarray]:
+        """Retrieval không encode query (concept/hexagram path, cache hit): encode như semantic search"""
+        try:
+            return await self.embedder.aencode(word_tokenize(query, format="text"))
+        except Exception as e:
+            logger.warning(f"Query encoding failed: {e}")
+            return None
+    
+    def _select_passage(self, doc: ChunkRecord, query_embedding: Optional[np.ndarray], budget: int) -> str:
+        """Các sentence window gần query nhất trong ``budget`` token; không có index thì cắt theo token"""
+        if self.passage_index is not None:
+            return self.passage_index.select(doc, query_embedding, budget)
+        return truncate_tokens(doc.get("text", ""), budget)
     
     async def _generate_response(self, state: ProcessingState) -> Dict[str, Any]:
         """Generate response with citations và XAI"""
@@ -92,42 +244,72 @@ class ReasoningAgent(BaseAgent):
         # Build enhanced prompt
         prompt = self._build_enhanced_prompt(state)
         
-        # Generate using LLM
+        # Generate using LLM (SDK blocking → worker thread, event loop vẫn phục vụ request khác)
         try:
-            llm_result = generate_advanced(prompt, state.reranked_docs)
-            
-            # Process citations
-            processed_answer = self._process_citations(
-                llm_result["answer"], 
-                state.reranked_docs
-            )
-            
-            # Calculate confidence
-            confidence = self._calculate_confidence(state.reranked_docs, llm_result)
-            
-            return {
-                "answer": processed_answer,
-                "confidence": confidence,
-                "success": True
-            }
+            llm = await asyncio.to_thread(get_llm)
+            cached = self._cached_answer(llm, state)
+            if cached is not None:
+                llm_result = analyze_response(cached, state.reranked_docs)
+            else:
+                llm_result = await asyncio.to_thread(generate_advanced, prompt, state.reranked_docs)
+                self._remember_answer(llm, prompt, state)
+            return self._response_data(state, llm_result)
             
         except Exception as e:
             logger.error(f"Response generation failed: {e}")
-            return {
-                "answer": "Xin lỗi, đã có lỗi xảy ra trong quá trình tạo phản hồi.",
-                "confidence": 0.1,
-                "success": False
-            }
+            return self._error_response()
+    
+    @staticmethod
+    def _semantic_cache_key(state: ProcessingState) -> Tuple[List[str], str]:
+        """Chunk trong prompt (theo thứ tự [n]) + phần prompt không đến từ câu hỏi (loại query, quẻ đã gieo)"""
+        info = state.hexagram_info or {}
+        context = "|".join([state.query_type, str(info.get("name", "")), str(info.get("changing_lines", ""))])
+        return [doc.get("_id") for doc in state.reranked_docs[:PROMPT_MAX_DOCS]], context
+    
+    def _cached_answer(self, llm: KinhDichLLM, state: ProcessingState) -> Optional[str]:
+        """Tier semantic của response cache: câu hỏi gần giống trên cùng tài liệu + quẻ"""
+        if llm.response_cache is None or state.query_embedding is None:
+            return None
+        chunk_ids, context = self._semantic_cache_key(state)
+        return llm.response_cache.get_similar(state.query_embedding, chunk_ids, context)
+    
+    def _remember_answer(self, llm: KinhDichLLM, prompt: str, state: ProcessingState) -> None:
+        if llm.response_cache is None or state.query_embedding is None:
+            return
+        chunk_ids, context = self._semantic_cache_key(state)
+        llm.response_cache.remember_similar(prompt, state.query_embedding, chunk_ids, context)
+    
+    def _response_data(self, state: ProcessingState, llm_result: Dict[str, Any]) -> Dict[str, Any]:
+        # Process citations
+        processed_answer = self._process_citations(
+            llm_result["answer"], 
+            state.reranked_docs
+        )
+        
+        # Calculate confidence
+        confidence = self._calculate_confidence(state.reranked_docs, llm_result, state.rerank_scores)
+        
+        return {
+            "answer": processed_answer,
+            "confidence": confidence,
+            "success": True
+        }
+    
+    @staticmethod
+    def _error_response() -> Dict[str, Any]:
+        return {
+            "answer": "Xin lỗi, đã có lỗi xảy ra trong quá trình tạo phản hồi.",
+            "confidence": 0.1,
+            "success": False
+        }
     
     def _build_enhanced_prompt(self, state: ProcessingState) -> str:
         """Build prompt với hexagram context + specialized templates"""
         
         # Build context từ documents (giữ từ phiên bản mới)
         context_parts = []
-        for i, doc in enumerate(state.reranked_docs[:8], 1):
-            text = doc.get("text", "")
-            if len(text) > 400:
-                text = text[:400] + "..."
+        for i, doc in enumerate(state.reranked_docs[:PROMPT_MAX_DOCS], 1):
+            text = self._select_passage(doc, state.query_embedding, PROMPT_PASSAGE_TOKENS)
             
             hexagram = doc.get("hexagram", "")
             content_type = doc.get("content_type", "")
@@ -244,14 +426,16 @@ TRẢ LỜI:"""
         
         return processed_answer
     
-    def _calculate_confidence(self, docs: List[Dict], llm_result: Dict) -> float:
+    def _calculate_confidence(
+        self, docs: List[ChunkRecord], llm_result: Dict, scores: Optional[Sequence[float]] = None
+    ) -> float:
         """Calculate overall confidence score"""
         
         if not docs:
             return 0.1
         
-        # Document relevance confidence
-        doc_scores = [doc.get("rerank_score", doc.get("similarity_score", 0)) for doc in docs]
+        # Document relevance confidence (rerank scores song song với docs)
+        doc_scores = list(scores) if scores else [doc.get("similarity_score", 0) for doc in docs]
         doc_confidence = sum(doc_scores) / len(doc_scores) if doc_scores else 0
         
         # LLM confidence
@@ -0,0 +1,123 @@
+"""
+Module records.py - Kết quả retrieval dạng record bất biến + mảng score đi kèm
+
+- ``ChunkRecord``: một chunk (cùng field với projection DOC_FIELDS), ``__slots__``, không
+  sửa được sau khi tạo → có thể nằm chung trong cache / corpus RAM cho mọi request mà
+  không phải copy. Đọc theo kiểu dict (``get``, ``[]``) như documents Mongo trước đây.
+- ``RetrievalResult``: struct-of-arrays (records, scores) của một strategy; score thuộc
+  về kết quả, không ghi vào record. Rerank/RRF tạo mảng score mới thay vì sửa document.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+_MISSING = object()
+
+
+class ChunkRecord:
+    """Chunk chỉ đọc: ``_id``, ``text``, ``hexagram``, ``content_type`` và notes gốc."""
+
+    __slots__ = ("_id", "text", "hexagram", "content_type", "notes")
+    FIELDS = ("_id", "text", "hexagram", "content_type")
+
+    def __init__(
+        self,
+        _id: str,
+        text: str = "",
+        hexagram: Optional[str] = None,
+        content_type: Optional[str] = None,
+        notes: Any = None,
+    ) -> None:
+        set_ = object.__setattr__
+        set_(self, "_id", _id)
+        set_(self, "text", text or "")
+        set_(self, "hexagram", hexagram)
+        set_(self, "content_type", content_type)
+        set_(self, "notes", notes)
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "ChunkRecord":
+        """Từ document Mongo / compact_document (bỏ qua score và các field khác)"""
+        notes = (doc.get("original_chunk") or {}).get("notes")
+        return cls(doc.get("_id"), doc.get("text"), doc.get("hexagram"), doc.get("content_type"), notes)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return type(self), (self._id, self.text, self.hexagram, self.content_type, self.notes)
+
+    # Đọc kiểu dict -------------------------------------------------------
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if key == "original_chunk":
+            return {"notes": self.notes} if self.notes else default
+        return default
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.FIELDS or (key == "original_chunk" and bool(self.notes))
+
+    def keys(self) -> List[str]:
+        return list(self.FIELDS) + (["original_chunk"] if self.notes else [])
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Bản dict (mutable) - cùng dạng với compact_document"""
+        return {key: self[key] for key in self.keys()}
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ChunkRecord):
+            return NotImplemented
+        return self.__reduce__()[1] == other.__reduce__()[1]
+
+    def __hash__(self) -> int:
+        return hash(self._id)
+
+    def __repr__(self) -> str:
+        return f"ChunkRecord(_id={self._id!r}, hexagram={self.hexagram!r}, content_type={self.content_type!r})"
+
+
+@dataclass(frozen=True)
+class RetrievalResult:
+    """Records của một lần truy xuất kèm score cùng index (cache được nguyên khối)."""
+
+    records: Tuple[ChunkRecord, ...] = ()
+    scores: Tuple[float, ...] = ()
+
+    def __post_init__(self) -> None:
+        if len(self.records) != len(self.scores):
+            raise ValueError(f"records ({len(self.records)}) và scores ({len(self.scores)}) không cùng số lượng")
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[ChunkRecord, float]]) -> "RetrievalResult":
+        pairs = list(pairs)
+        return cls(tuple(record for record, _ in pairs), tuple(float(score) for _, score in pairs))
+
+    @classmethod
+    def from_records(cls, records: Sequence[ChunkRecord], score: float = 0.0) -> "RetrievalResult":
+        """Strategy không có score (hexagram, random): mọi record cùng ``score``"""
+        return cls(tuple(records), (float(score),) * len(records))
+
+    @classmethod
+    def from_documents(cls, docs: Iterable[Dict[str, Any]], score_field: str = "score") -> "RetrievalResult":
+        """Từ documents Mongo (score nằm trong document theo projection ``$meta``)"""
+        return cls.from_pairs((ChunkRecord.from_document(doc), doc.get(score_field) or 0.0) for doc in docs)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[Tuple[ChunkRecord, float]]:
+        return zip(self.records, self.scores)
+
+    def top(self, k: int) -> "RetrievalResult":
+        return RetrievalResult(self.records[:k], self.scores[:k])
@@ -0,0 +1,196 @@
+"""
+Module rerank_service.py - Cross-encoder dùng chung: micro-batching + cache score theo cặp
+
+Score của cặp (query đã chuẩn hóa, chunk_id) được cache (``cache_backend``, namespace
+"rerank:<model>:<backend>"): câu hỏi phổ biến trên cùng các chunk gần như không phải chạy lại model.
+Các cặp chưa có score của nhiều request đồng thời được gom thành một batch qua
+``MicroBatcher`` (RERANK_BATCH_SIZE, chờ tối đa RERANK_MAX_LATENCY_MS); cặp đang được
+tính bởi request khác thì chờ kết quả đó thay vì đưa vào batch lần nữa.
+Latency mỗi cặp được theo dõi bằng EWMA để caller ước lượng trước thời gian rerank.
+Text của cặp là passage caller chọn sẵn (sentence window theo query) hoặc đầu chunk
+trong RERANK_PASSAGE_TOKENS.
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+from batching import MicroBatcher
+from cache_backend import make_cache_backend
+from config import (
+    CE_MODEL, INFERENCE_BACKEND,
+    RERANK_BATCH_SIZE, RERANK_MAX_LATENCY_MS, RERANK_CACHE_MAXSIZE, RERANK_CACHE_TTL, RERANK_PASSAGE_TOKENS,
+    PASSAGE_SELECTION, PASSAGE_WINDOW_TOKENS,
+)
+from inference_backend import load_cross_encoder
+from passage_index import truncate_tokens
+from records import ChunkRecord
+from text_utils import normalize_text
+
+_EWMA_ALPHA = 0.2
+
+
+class RerankService:
+    """Thread-safe wrapper quanh CrossEncoder với micro-batching và cache score."""
+
+    def __init__(self, model_name: str = CE_MODEL) -> None:
+        self.model_name = model_name
+        self.model: CrossEncoder = load_cross_encoder(model_name)  # theo INFERENCE_BACKEND
+        self._batcher = MicroBatcher(
+            self._predict_batch,
+            max_batch_size=RERANK_BATCH_SIZE,
+            max_wait_ms=RERANK_MAX_LATENCY_MS,
+            name=f"reranker:{model_name}",
+        )
+        # Score của int8/onnx lệch nhẹ so với fp32: mỗi backend một namespace; cách chọn passage
+        # đổi input của model nên cũng nằm trong namespace (không dùng lại score của input cũ).
+        # "qtext": key theo query giữ nguyên stop words, tách khỏi score cũ key theo query đã bỏ stop words
+        passages = f"passage-{int(PASSAGE_SELECTION)}-{RERANK_PASSAGE_TOKENS}-{PASSAGE_WINDOW_TOKENS}"
+        self._scores = make_cache_backend(
+            f"rerank:{model_name}:{INFERENCE_BACKEND}:{passages}:qtext", RERANK_CACHE_MAXSIZE, RERANK_CACHE_TTL
+        )
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._lookups = 0
+        self._hits = 0
+        self.pair_latency_ms: Optional[float] = None  # EWMA thời gian model / cặp
+
+    def _predict_batch(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        started = time.perf_counter()
+        scores = self.model.predict([list(pair) for pair in pairs], batch_size=RERANK_BATCH_SIZE)
+        per_pair = (time.perf_counter() - started) * 1000 / max(len(pairs), 1)
+        previous = self.pair_latency_ms
+        self.pair_latency_ms = per_pair if previous is None else previous + _EWMA_ALPHA * (per_pair - previous)
+        return [float(score) for score in np.asarray(scores, dtype=np.float32).ravel()]
+
+    def estimate_ms(self, query: str, records: Sequence[ChunkRecord]) -> float:
+        """Ước lượng thời gian ``score``: số cặp chưa cache × latency/cặp (0 khi chưa có số đo)"""
+        if self.pair_latency_ms is None or not records:
+            return 0.0
+        query_key = self._query_key(query)
+        missing = sum(self._scores.get(self._key(query_key, record)) is None for record in records)
+        return missing * self.pair_latency_ms
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        """Chỉ NFC + lowercase + gộp khoảng trắng: cross-encoder thấy cả stop words ("không nên" ≠ "nên")"""
+        return normalize_text(query)
+
+    @staticmethod
+    def _key(query_key: str, record: ChunkRecord) -> str:
+        return f"{query_key}\x1f{record.get('_id')}"
+
+    @staticmethod
+    def _passage(record: ChunkRecord) -> str:
+        """Passage mặc định khi caller không chọn sẵn: đầu chunk, cắt ở ranh giới token"""
+        return truncate_tokens(record.get("text") or "", RERANK_PASSAGE_TOKENS)
+
+    def _lookup(self, query: str, records: Sequence[ChunkRecord]) -> Tuple[List[Optional[float]], List[str], List[int]]:
+        """Score đã cache theo thứ tự records; trả thêm key + vị trí các cặp còn thiếu"""
+        query_key = self._query_key(query)
+        keys = [self._key(query_key, record) for record in records]
+        scores: List[Optional[float]] = [self._scores.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        with self._lock:
+            self._lookups += len(records)
+            self._hits += len(records) - len(missing)
+        return scores, keys, missing
+
+    def _submit(
+        self, query: str, records: Sequence[ChunkRecord], passages: Optional[Sequence[str]],
+        keys: List[str], missing: List[int],
+    ) -> List[Tuple[int, Future]]:
+        """Mỗi cặp còn thiếu → Future score: cặp đang được tính thì dùng lại Future đó,
+        các cặp còn lại đưa vào batcher một lần"""
+        pending: List[Tuple[int, Future]] = []
+        owned: List[Tuple[int, Future]] = []
+        with self._lock:
+            for i in missing:
+                future = self._inflight.get(keys[i])
+                # Entry đã xong / bị hủy (chưa kịp dọn) coi như thiếu: tính lại
+                if future is None or future.done():
+                    future = self._inflight[keys[i]] = Future()
+                    owned.append((i, future))
+                pending.append((i, future))
+        if owned:
+            batch = self._batcher.submit([
+                (query, passages[i] if passages is not None else self._passage(records[i])) for i, _ in owned
+            ])
+            batch.add_done_callback(lambda done: self._resolve(done, [(keys[i], f) for i, f in owned]))
+        return pending
+
+    def _resolve(self, batch: Future, owned: List[Tuple[str, Future]]) -> None:
+        error = batch.exception()
+        for offset, (key, future) in enumerate(owned):
+            try:
+                if error is None:
+                    score = batch.result()[offset]
+                    self._scores.set(key, score)
+                    if not future.done():
+                        future.set_result(score)
+                elif not future.done():
+                    future.set_exception(error)
+            finally:
+                with self._lock:
+                    if self._inflight.get(key) is future:
+                        del self._inflight[key]
+
+    def score(
+        self, query: str, records: Sequence[ChunkRecord], passages: Optional[Sequence[str]] = None
+    ) -> List[float]:
+        """Score cross-encoder cho từng record (cùng thứ tự), chỉ chạy model cho cặp chưa cache.
+
+        ``passages`` (song song với records): phần text đưa vào model, thường do passage
+        selection chọn theo query; mặc định là đầu chunk trong RERANK_PASSAGE_TOKENS.
+        """
+        scores, keys, missing = self._lookup(query, records)
+        for i, future in self._submit(query, records, passages, keys, missing):
+            scores[i] = future.result()
+        return scores  # type: ignore[return-value]
+
+    async def ascore(
+        self, query: str, records: Sequence[ChunkRecord], passages: Optional[Sequence[str]] = None
+    ) -> List[float]:
+        """Bản async: chờ batch mà không block event loop"""
+        scores, keys, missing = self._lookup(query, records)
+        for i, future in self._submit(query, records, passages, keys, missing):
+            # Future dùng chung với request khác: caller bị hủy không được hủy theo nó
+            scores[i] = await asyncio.shield(asyncio.wrap_future(future))
+        return scores  # type: ignore[return-value]
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        return {
+            **self._batcher.stats,
+            "pair_lookups": self._lookups,
+            "pair_hits": self._hits,
+            "pair_hit_rate": round(self._hits / self._lookups, 4) if self._lookups else 0.0,
+            "pair_latency_ms": round(self.pair_latency_ms, 3) if self.pair_latency_ms is not None else None,
+        }
+
+    def close(self) -> None:
+        self._batcher.close()
+
+
+# Singleton helpers -------------------------------------------------------------
+
+_services: Dict[str, RerankService] = {}
+_services_lock = threading.Lock()
+
+
+def get_rerank_service(model_name: str = CE_MODEL) -> RerankService:
+    """Một instance (một bản weights, một hàng đợi batch) cho mỗi model trong process"""
+    service = _services.get(model_name)
+    if service is None:
+        with _services_lock:
+            service = _services.get(model_name)
+            if service is None:
+                service = RerankService(model_name)
+                _services[model_name] = service
+    return service
@@ -0,0 +1,362 @@
+"""
+Module resilience.py - Lớp bảo vệ quanh backend LLM (theo provider)
+
+- Semaphore: tối đa LLM_MAX_CONCURRENCY request đang chạy; slot chỉ trả lại khi lời gọi
+  thật sự kết thúc (kể cả khi caller đã timeout).
+- Token bucket: LLM_RATE_LIMIT_RPS request/giây, burst LLM_RATE_LIMIT_BURST (0 = tắt).
+- Retry lỗi tạm thời (timeout, mất kết nối, 429, 5xx) với exponential backoff + full jitter.
+- Timeout mỗi request (LLM_REQUEST_TIMEOUT); với stream là thời gian chờ tối đa giữa hai phần.
+  Stream đi qua ``astream`` của backend; nhánh chạy thread (SDK đồng bộ) dùng worker của
+  provider và slot chỉ trả lại khi worker đó xong, nhánh async native trả slot khi stream đóng.
+- Circuit breaker: LLM_BREAKER_FAILURES lỗi tạm thời liên tiếp → từ chối ngay trong
+  LLM_BREAKER_RESET_S giây, sau đó cho một request thử (half-open).
+
+Thử không cần network: ``LLM_PROVIDER=fake`` (``llm.FakeBackend``, chỉnh độ trễ / tỉ lệ lỗi).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterator, Callable, Dict, Optional, TypeVar
+
+from config import (
+    LLM_MAX_CONCURRENCY, LLM_QUEUE_TIMEOUT, LLM_REQUEST_TIMEOUT,
+    LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST,
+    LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY,
+    LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S,
+)
+from llm import BaseBackend
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# Tên exception tạm thời của các SDK (openai, google-api-core, httpx) - tránh import từng SDK
+_RETRYABLE_NAMES = (
+    "RateLimit", "Timeout", "APIConnection", "ServiceUnavailable", "InternalServerError",
+    "ResourceExhausted", "DeadlineExceeded", "TooManyRequests", "ConnectError",
+)
+
+
+class BackendUnavailableError(RuntimeError):
+    """Không gọi được backend: circuit đang mở hoặc hết thời gian chờ slot."""
+
+
+class LLMTimeoutError(TimeoutError):
+    """Backend không trả lời trong LLM_REQUEST_TIMEOUT."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if isinstance(status, int) and status in _RETRYABLE_STATUS:
+        return True
+    return any(name in type(exc).__name__ for name in _RETRYABLE_NAMES)
+
+
+class TokenBucket:
+    """Rate limit: ``rate`` token/giây, tối đa ``capacity`` token tích lũy."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Lấy một token (có thể nợ trước); trả số giây phải chờ trước khi dùng"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class CircuitBreaker:
+    """closed → open sau ``threshold`` lỗi liên tiếp → half-open sau ``reset_timeout`` giây."""
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        """Raise BackendUnavailableError khi phải fail fast"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_started = None
+            # Chỉ một request thử; request thử bị bỏ dở (caller dừng stream) thì cho thử lại
+            if self.state == "half_open" and (
+                self._trial_started is None or now - self._trial_started >= self.reset_timeout
+            ):
+                self._trial_started = now
+                return
+            raise BackendUnavailableError("LLM circuit breaker đang mở")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.threshold:
+                if self.state != "open":
+                    logger.warning("LLM circuit breaker opened after %d failures", self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_started = None
+
+
+class ProviderLimits:
+    """Semaphore + token bucket + breaker + worker threads dùng chung cho một provider."""
+
+    def __init__(self, provider: str) -> None:
+        self.provider = provider
+        self.semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+        self.bucket = TokenBucket(LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST)
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S)
+        self.executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix=f"llm-{provider}")
+        self._lock = threading.Lock()
+        # Coroutine chờ slot xếp hàng FIFO trên lock của loop; chỉ coroutine đầu hàng giữ một
+        # thread chờ semaphore (không poll, không chiếm nhiều thread của executor mặc định)
+        self._gates: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "timeouts": 0, "rejected": 0, "in_flight": 0}
+
+    def count(self, name: str, delta: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += delta
+
+    def _reject(self) -> None:
+        self.count("rejected")
+        raise BackendUnavailableError(f"Quá {LLM_QUEUE_TIMEOUT}s chờ slot gọi {self.provider}")
+
+    def acquire(self) -> None:
+        if not self.semaphore.acquire(timeout=LLM_QUEUE_TIMEOUT):
+            self._reject()
+        self.count("in_flight")
+        time.sleep(self.bucket.reserve())
+
+    def _gate(self, loop: asyncio.AbstractEventLoop) -> asyncio.Lock:
+        with self._lock:
+            gate = self._gates.get(loop)
+            if gate is None:
+                gate = self._gates[loop] = asyncio.Lock()
+            return gate
+
+    async def aacquire(self) -> None:
+        """Như ``acquire`` nhưng không block event loop; coroutine chờ được phục vụ theo thứ tự"""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + LLM_QUEUE_TIMEOUT
+        gate = self._gate(loop)
+        try:
+            await asyncio.wait_for(gate.acquire(), LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._reject()
+        try:
+            if not self.semaphore.acquire(blocking=False):
+                remaining = max(0.0, deadline - time.monotonic())
+                waiter = loop.run_in_executor(None, self.semaphore.acquire, True, remaining)
+                try:
+                    acquired = await asyncio.shield(waiter)
+                except asyncio.CancelledError:
+                    # Thread vẫn đang chờ: slot lấy được sau khi caller bị hủy thì trả lại ngay
+                    waiter.add_done_callback(self._release_abandoned)
+                    raise
+                if not acquired:
+                    self._reject()
+        finally:
+            gate.release()
+        self.count("in_flight")
+        await asyncio.sleep(self.bucket.reserve())
+
+    def _release_abandoned(self, waiter: "asyncio.Future[bool]") -> None:
+        if not waiter.cancelled() and waiter.exception() is None and waiter.result():
+            self.semaphore.release()
+
+    def release(self, *_: Any) -> None:
+        self.count("in_flight", -1)
+        self.semaphore.release()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"circuit": self.breaker.state, **self.counters}
+
+
+class _StreamSlot(Executor):
+    """Slot của một lần stream; cũng là executor cho nhánh chạy thread của ``inner.astream``.
+
+    Worker đã submit thì slot trả lại khi worker cuối cùng xong; không có worker (SDK async
+    native, hoặc stream chưa bắt đầu) thì trả ngay khi ``close``.
+    """
+
+    def __init__(self, limits: "ProviderLimits") -> None:
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        future = self.limits.executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._worker_done)
+        return future
+
+    def _worker_done(self, _: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            release = self._closed and self._pending == 0
+        if release:
+            self.limits.release()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            release = self._pending == 0
+        if release:
+            self.limits.release()
+
+
+_LIMITS: Dict[str, ProviderLimits] = {}
+_limits_lock = threading.Lock()
+
+
+def get_provider_limits(provider: str) -> ProviderLimits:
+    with _limits_lock:
+        limits = _LIMITS.get(provider)
+        if limits is None:
+            limits = _LIMITS[provider] = ProviderLimits(provider)
+        return limits
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter: ngẫu nhiên trong [0, min(max, base · 2^attempt)]"""
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class ResilientBackend(BaseBackend):
+    """Bọc một backend: cùng interface, thêm giới hạn / retry / timeout / circuit breaker."""
+
+    def __init__(self, inner: BaseBackend) -> None:
+        self.inner = inner
+        self.provider_name = inner.provider_name
+        self.limits = get_provider_limits(inner.provider_name)
+
+    def settings(self) -> Dict[str, Any]:
+        return self.inner.settings()
+
+    def _fail(self, exc: BaseException) -> bool:
+        """Ghi nhận lỗi; True nếu nên thử lại"""
+        self.limits.count("failures")
+        if isinstance(exc, LLMTimeoutError):
+            self.limits.count("timeouts")
+        if not is_retryable(exc):
+            # Lỗi của chính request (prompt, auth, ...): provider vẫn trả lời được
+            self.limits.breaker.record_success()
+            return False
+        self.limits.breaker.record_failure()
+        return True
+
+    def _call(self, fn: Callable[[], T]) -> T:
+        """Một lần gọi có slot + timeout; slot trả lại khi worker thật sự xong"""
+        self.limits.breaker.allow()
+        self.limits.acquire()
+        try:
+            future = self.limits.executor.submit(fn)
+        except BaseException:
+            self.limits.release()
+            raise
+        future.add_done_callback(self.limits.release)
+        try:
+            return future.result(timeout=LLM_REQUEST_TIMEOUT)
+        except FutureTimeoutError:
+            raise LLMTimeoutError(f"{self.provider_name} không trả lời sau {LLM_REQUEST_TIMEOUT}s") from None
+
+    def generate(self, prompt: str) -> str:
+        self.limits.count("requests")
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                response = self._call(lambda: self.inner.generate(prompt))
+                self.limits.breaker.record_success()
+                return response
+            except BackendUnavailableError:
+                raise
+            except Exception as exc:
+                if not self._fail(exc) or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                self.limits.count("retries")
+                logger.warning("%s failed (%s), retry %d in %.2fs", self.provider_name, exc, attempt + 1, delay)
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def astream(self, prompt: str, executor: Optional[Executor] = None) -> AsyncIterator[str]:
+        """Retry chỉ khi chưa trả phần nào; timeout áp cho từng lần chờ phần kế tiếp"""
+        self.limits.count("requests")
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            self.limits.breaker.allow()
+            await self.limits.aacquire()
+            started = False
+            # Worker thread (nếu backend cần) chạy qua slot: slot trả lại khi worker thật sự
+            # xong (như ``_call``), không phải khi caller thôi chờ
+            slot = _StreamSlot(self.limits)
+            stream = self.inner.astream(prompt, slot)
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), LLM_REQUEST_TIMEOUT)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise LLMTimeoutError(
+                            f"{self.provider_name} không trả lời sau {LLM_REQUEST_TIMEOUT}s"
+                        ) from None
+                    started = True
+                    yield chunk
+                self.limits.breaker.record_success()
+                return
+            except BackendUnavailableError:
+                raise
+            except Exception as exc:
+                if not self._fail(exc) or started or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                self.limits.count("retries")
+                logger.warning("%s stream failed (%s), retry %d in %.2fs", self.provider_name, exc, attempt + 1, delay)
+            finally:
+                try:
+                    await stream.aclose()
+                finally:
+                    slot.close()
+            await asyncio.sleep(delay)
+
+    def test_connection(self) -> None:
+        self.inner.test_connection()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return self.limits.stats
@@ -0,0 +1,140 @@
+"""
+Module response_cache.py - Cache câu trả lời LLM (exact + semantic tùy chọn)
+
+- Tier exact: key = sha256(provider, model, tham số generation, prompt cuối cùng) → câu trả lời.
+  Prompt giống hệt (vd. các câu hỏi mẫu trong gr.Examples) không gọi LLM lần nữa.
+- Tier semantic: nhóm theo (cấu hình LLM, danh sách chunk_id theo đúng thứ tự trong prompt,
+  context như quẻ đã gieo) - thứ tự quyết định số trích dẫn [n] trong câu trả lời;
+  trong nhóm so cosine embedding query, vượt ngưỡng thì dùng lại câu trả lời. Chỉ câu trả lời
+  đã có ở tier exact (LLM trả lời thật, không phải fallback) mới được đưa vào tier semantic.
+Cả hai tier nằm trên ``cache_backend`` (LLM_CACHE_BACKEND, mặc định sqlite để giữ qua restart).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from cache_backend import CacheBackend, make_cache_backend
+from config import (
+    LLM_CACHE_BACKEND, LLM_CACHE_MAXSIZE, LLM_CACHE_TTL,
+    LLM_CACHE_SEMANTIC, LLM_CACHE_SEMANTIC_THRESHOLD, LLM_CACHE_SEMANTIC_PER_CONTEXT,
+)
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _unit(vector: Any) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class ResponseCache:
+    """Câu trả lời LLM theo hash prompt + (tùy chọn) theo embedding query trên cùng context."""
+
+    def __init__(
+        self,
+        settings: Dict[str, Any],
+        maxsize: int = LLM_CACHE_MAXSIZE,
+        ttl: float = LLM_CACHE_TTL,
+        semantic_threshold: Optional[float] = LLM_CACHE_SEMANTIC_THRESHOLD if LLM_CACHE_SEMANTIC else None,
+        per_context: int = LLM_CACHE_SEMANTIC_PER_CONTEXT,
+        backend: str = LLM_CACHE_BACKEND,
+    ) -> None:
+        # Đổi provider/model/tham số → key khác, không cần xóa cache
+        self.settings_key = _digest(json.dumps(settings, sort_keys=True, default=str))
+        self.semantic_threshold = semantic_threshold
+        self.per_context = per_context
+        self._entries: CacheBackend = make_cache_backend("llm:response", maxsize, ttl, backend)
+        self._groups: CacheBackend = make_cache_backend("llm:semantic", maxsize, ttl, backend)
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        self._semantic_lookups = 0
+        self._semantic_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold is not None
+
+    # Exact tier ------------------------------------------------------------------
+    def key(self, prompt: str) -> str:
+        return _digest(self.settings_key, prompt)
+
+    def get(self, prompt: str) -> Optional[str]:
+        value = self._entries.get(self.key(prompt))
+        with self._lock:
+            self._lookups += 1
+            if value is not None:
+                self._hits += 1
+        return value
+
+    def set(self, prompt: str, response: str) -> None:
+        if response:
+            self._entries.set(self.key(prompt), response)
+
+    # Semantic tier ---------------------------------------------------------------
+    def context_key(self, chunk_ids: Iterable[str], context: str = "") -> str:
+        # Giữ thứ tự: [n] trong câu trả lời trỏ tới vị trí chunk trong prompt
+        return _digest(self.settings_key, context, *(str(chunk_id) for chunk_id in chunk_ids))
+
+    def get_similar(self, embedding: Any, chunk_ids: Iterable[str], context: str = "") -> Optional[str]:
+        """Câu trả lời của query gần nhất (cosine ≥ ngưỡng) trên cùng danh sách chunk + context"""
+        if not self.semantic_enabled or embedding is None:
+            return None
+        group: List[Tuple[np.ndarray, str]] = self._groups.get(self.context_key(chunk_ids, context)) or []
+        best: Optional[str] = None
+        if group:
+            scores = np.stack([vector for vector, _ in group]) @ _unit(embedding)
+            row = int(np.argmax(scores))
+            if scores[row] >= self.semantic_threshold:
+                best = group[row][1]
+        with self._lock:
+            self._semantic_lookups += 1
+            if best is not None:
+                self._semantic_hits += 1
+        return best
+
+    def remember_similar(self, prompt: str, embedding: Any, chunk_ids: Iterable[str], context: str = "") -> None:
+        """Đưa câu trả lời đã cache của ``prompt`` vào tier semantic (không có thì bỏ qua)"""
+        if not self.semantic_enabled or embedding is None:
+            return
+        response = self._entries.get(self.key(prompt))
+        if response is None:
+            return
+        key = self.context_key(chunk_ids, context)
+        vector = _unit(embedding)
+        group = [
+            (old, answer) for old, answer in (self._groups.get(key) or [])
+            if float(old @ vector) < self.semantic_threshold  # query gần như trùng: thay bằng bản mới
+        ]
+        group.append((vector, response))
+        self._groups.set(key, group[-self.per_context:])
+
+    # ------------------------------------------------------------------
+    def clear(self) -> None:
+        self._entries.clear()
+        self._groups.clear()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        # Semantic hit không đi tới tier exact; miss ở tier exact = một lần gọi LLM
+        requests = self._lookups + self._semantic_hits
+        hits = self._hits + self._semantic_hits
+        return {
+            "size": len(self._entries),
+            "lookups": self._lookups,
+            "hits": self._hits,
+            "semantic_lookups": self._semantic_lookups,
+            "semantic_hits": self._semantic_hits,
+            "misses": self._lookups - self._hits,
+            "hit_rate": round(hits / requests, 4) if requests else 0.0,
+        }
@@ -0,0 +1,161 @@
+"""
+Module session_store.py - Lịch sử hội thoại theo session, có giới hạn bộ nhớ
+
+- Mỗi lượt chỉ giữ bản rút gọn (prompt ≤ SESSION_PROMPT_PREVIEW_CHARS, câu trả lời
+  ≤ SESSION_RESPONSE_PREVIEW_CHARS) - đúng phần được chèn lại vào prompt, không giữ prompt đầy đủ.
+- Mỗi session tối đa SESSION_MAX_TURNS lượt; toàn store tối đa SESSION_STORE_MAX_MB (ước lượng)
+  và SESSION_MAX_SESSIONS session: vượt thì bỏ session dùng lâu nhất (LRU).
+- Session không hoạt động quá SESSION_IDLE_TTL giây bị dọn định kỳ.
+- SESSION_STORE_PERSIST: ghi thêm vào SQLite (``cache_backend``), session bị đẩy khỏi RAM
+  hoặc từ lần chạy trước được nạp lại khi dùng tới.
+"""
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from cache_backend import SQLiteBackend
+from config import (
+    SESSION_MAX_TURNS, SESSION_MAX_SESSIONS, SESSION_STORE_MAX_MB, SESSION_IDLE_TTL,
+    SESSION_PROMPT_PREVIEW_CHARS, SESSION_RESPONSE_PREVIEW_CHARS, SESSION_STORE_PERSIST,
+)
+
+_TURN_OVERHEAD = 120  # byte ước lượng cho tuple + float của mỗi lượt
+_SWEEP_INTERVAL = 60.0  # giây giữa hai lượt dọn session idle
+
+
+class Turn(NamedTuple):
+    prompt: str
+    response: str
+    timestamp: float
+
+
+def preview(text: str, limit: int) -> str:
+    return text[:limit] + "..." if len(text) > limit else text
+
+
+def _turn_size(turn: Turn) -> int:
+    return sys.getsizeof(turn.prompt) + sys.getsizeof(turn.response) + _TURN_OVERHEAD
+
+
+class SessionStore:
+    """session_id → các lượt gần nhất (bản rút gọn), LRU + idle TTL + giới hạn byte."""
+
+    def __init__(
+        self,
+        max_bytes: int = int(SESSION_STORE_MAX_MB * 1024 * 1024),
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        max_turns: int = SESSION_MAX_TURNS,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        persist: bool = SESSION_STORE_PERSIST,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        # Thứ tự = LRU (đầu là session dùng lâu nhất); value: (các lượt, byte, lần dùng cuối)
+        self._sessions: "OrderedDict[str, Tuple[Tuple[Turn, ...], int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+        self._disk: Optional[SQLiteBackend] = (
+            SQLiteBackend("llm:sessions", max_sessions, idle_ttl) if persist else None
+        )
+        self._evicted = 0
+        self._expired = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # ------------------------------------------------------------------
+    def recent(self, session_id: str, n: int) -> List[Turn]:
+        """``n`` lượt gần nhất của session (rỗng nếu chưa có / đã hết hạn)"""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and now - entry[2] > self.idle_ttl:
+                self._drop(session_id)
+                self._expired += 1
+                entry = None
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                self._sessions[session_id] = (entry[0], entry[1], now)
+                return list(entry[0][-n:])
+        turns = self._load(session_id)
+        if turns:
+            with self._lock:
+                if session_id not in self._sessions:
+                    self._put(session_id, turns, now)
+        return list(turns[-n:])
+
+    def append(self, session_id: str, prompt: str, response: str) -> None:
+        now = time.time()
+        turn = Turn(
+            preview(prompt, SESSION_PROMPT_PREVIEW_CHARS),
+            preview(response, SESSION_RESPONSE_PREVIEW_CHARS),
+            now,
+        )
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        previous = entry[0] if entry is not None else self._load(session_id)
+        turns = (previous + (turn,))[-self.max_turns:]
+        with self._lock:
+            self._put(session_id, turns, now)
+            if now - self._last_sweep > _SWEEP_INTERVAL:
+                self._sweep(now)
+        if self._disk is not None:
+            self._disk.set(session_id, turns)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    # ------------------------------------------------------------------
+    def _load(self, session_id: str) -> Tuple[Turn, ...]:
+        if self._disk is None:
+            return ()
+        turns = self._disk.get(session_id)
+        return tuple(Turn(*turn) for turn in turns) if turns else ()
+
+    def _put(self, session_id: str, turns: Tuple[Turn, ...], now: float) -> None:
+        """Ghi session (giữ lock) rồi đẩy session LRU ra đến khi dưới giới hạn"""
+        self._drop(session_id)
+        size = sum(_turn_size(turn) for turn in turns)
+        self._sessions[session_id] = (turns, size, now)
+        self._bytes += size
+        while len(self._sessions) > 1 and (self._bytes > self.max_bytes or len(self._sessions) > self.max_sessions):
+            oldest = next(iter(self._sessions))
+            self._drop(oldest)
+            self._evicted += 1
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _sweep(self, now: float) -> None:
+        """Dọn session idle từ đầu LRU (giữ lock); dừng ở session đầu tiên còn hoạt động"""
+        self._last_sweep = now
+        while self._sessions:
+            oldest, (_, _, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            self._drop(oldest)
+            self._expired += 1
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evicted": self._evicted,
+            "expired": self._expired,
+            "persistent": self._disk is not None,
+        }
@@ -107,6 +107,23 @@ def check_mongodb_connection():
         print(f"MongoDB connection failed: {e}")
         return False
 
+def check_indexes():
+    """Tạo (nếu thiếu) và kiểm tra definition của các index MongoDB"""
+    try:
+        from pymongo import MongoClient
+        from config import MONGO_URI, DB_NAME, COLLECTION
+        from index_provisioning import provision_indexes, format_report
+
+        client = MongoClient(MONGO_URI)
+        reports = provision_indexes(client[DB_NAME][COLLECTION])
+        print("Index provisioning:")
+        print(format_report(reports))
+        return all(r.status in ("ok", "created", "skipped") for r in reports)
+
+    except Exception as e:
+        print(f"Index provisioning failed: {e}")
+        return False
+
 def setup_vector_index_instructions():
     """Hướng dẫn thiết lập Vector Search Index"""
     print("""
@@ -140,7 +157,8 @@ def main():
     checks = [
         ("Config", check_config),
         ("Data", check_data),
-        ("MongoDB", check_mongodb_connection)
+        ("MongoDB", check_mongodb_connection),
+        ("Indexes", check_indexes)
     ]
     
     all_passed = True
@@ -0,0 +1,39 @@
+"""
+Module text_utils.py - Chuẩn hóa văn bản tiếng Việt dùng chung cho lexicon, matcher và cache
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+
+# Dấu thanh (dạng tổ hợp NFD): huyền, sắc, hỏi, ngã, nặng
+_TONE_MARKS = "\u0300\u0301\u0309\u0303\u0323"
+
+# Kiểu bỏ dấu cũ → kiểu mới ở vần mở: "hòa" → "hoà", "khỏe" → "khoẻ", "thủy" → "thuỷ"
+_TONE_PLACEMENT = {
+    unicodedata.normalize("NFC", glide + tone) + vowel: glide + unicodedata.normalize("NFC", vowel + tone)
+    for tone in _TONE_MARKS
+    for glide, vowel in (("o", "a"), ("o", "e"), ("u", "y"))
+}
+_TONE_PLACEMENT_RE = re.compile("(" + "|".join(_TONE_PLACEMENT) + r")(?!\w)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def unify_tone_placement(text: str) -> str:
+    """Đưa dấu thanh ở vần mở oa/oe/uy về một kiểu (giữ nguyên độ dài chuỗi)"""
+    return _TONE_PLACEMENT_RE.sub(lambda m: _TONE_PLACEMENT[m.group(1)], text)
+
+
+def normalize_text(text: str) -> str:
+    """NFC, lowercase, "_" (output word_tokenize) → space, thống nhất vị trí dấu thanh, gộp khoảng trắng"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).lower().replace("_", " ")
+    text = unify_tone_placement(text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ toàn bộ dấu tiếng Việt: "quẻ cách" → "que cach", "đ" → "d" """
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
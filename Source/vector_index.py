@@ -0,0 +1,307 @@
+"""
+Module vector_index.py - Vector index in-process thay thế Atlas $vectorSearch
+
+Exact search (brute force) trên ma trận float32 đã normalize: corpus chỉ vài
+nghìn chunks nên một phép nhân matrix-vector đã dưới 1ms và không cần network.
+
+Artifact trên disk (do data_loader ghi ra, index load bằng mmap read-only):
+  - embeddings.npy : ma trận liên tục [count, dim] float32/float16, đã normalize
+  - ids.json       : bảng id/offset - phần tử thứ i là chunk_id của hàng i
+  - meta.json      : model, count, dimension, dtype, fingerprint text corpus
+Nội dung chunk không nằm trong artifact: lúc load, record lấy từ corpus (CHUNKS_DATA_DIR)
+theo id; corpus đổi (fingerprint lệch / thiếu id) thì artifact được build lại.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from passage_index import corpus_fingerprint
+from records import ChunkRecord, RetrievalResult
+
+logger = logging.getLogger(__name__)
+
+# Field metadata hỗ trợ filter khi search
+FILTER_FIELDS = ("hexagram", "content_type")
+
+# Field giữ lại cho mỗi document (cùng tập với projection của RetrievalAgent)
+STORED_FIELDS = ("_id", "text", "hexagram", "content_type")
+
+# Artifact float16: upcast từng khối hàng khi tính (numpy không có BLAS cho float16),
+# không copy cả ma trận mỗi query
+_SCORE_BLOCK_ROWS = 4096
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _cosine_scores(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """``matrix @ query`` ra float32; ma trận không phải float32 được tính theo khối"""
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), _SCORE_BLOCK_ROWS):
+        block = matrix[start:start + _SCORE_BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query
+    return scores
+
+
+def _atomic_write(path: Path, write) -> None:
+    """Ghi ra file tạm rồi os.replace để worker khác đang mmap không đọc file dở"""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as fh:
+        write(fh)
+    os.replace(tmp, path)
+
+
+def write_embedding_artifact(
+    path: Path,
+    vectors: np.ndarray,
+    records: Sequence[ChunkRecord],
+    model_name: str,
+    dtype: str = "float32",
+) -> None:
+    """Ghi artifact (embeddings.npy + ids.json + meta.json) cho ``LocalVectorIndex.load``"""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    matrix = np.ascontiguousarray(_normalize_rows(vectors).astype(dtype)) if len(records) else \
+        np.zeros((0, 0), dtype=dtype)
+    ids = [record._id for record in records]
+    meta = {
+        "model": model_name,
+        "count": len(records),
+        "dimension": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "dtype": str(matrix.dtype),
+        "fingerprint": corpus_fingerprint(records),
+    }
+    _atomic_write(path / "embeddings.npy", lambda fh: np.save(fh, matrix))
+    _atomic_write(path / "ids.json", lambda fh: fh.write(json.dumps(ids, ensure_ascii=False).encode("utf-8")))
+    # meta.json ghi cuối: có meta nghĩa là artifact đã đầy đủ
+    _atomic_write(path / "meta.json", lambda fh: fh.write(json.dumps(meta).encode("utf-8")))
+
+
+def compact_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Chỉ giữ các field downstream đọc (STORED_FIELDS + original_chunk.notes)"""
+    compact = {field: doc.get(field) for field in STORED_FIELDS}
+    notes = (doc.get("original_chunk") or {}).get("notes")
+    if notes:
+        compact["original_chunk"] = {"notes": notes}
+    return compact
+
+
+class LocalVectorIndex:
+    """Exact cosine top-k với filter theo hexagram / content_type."""
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        records: Sequence[ChunkRecord],
+        model_name: str = "",
+        normalized: bool = False,
+    ) -> None:
+        if len(vectors) != len(records):
+            raise ValueError(f"vectors ({len(vectors)}) và records ({len(records)}) không cùng số lượng")
+        self.model_name = model_name
+        if not len(records):
+            self.vectors = np.zeros((0, 0), np.float32)
+        elif normalized:
+            # Giữ nguyên (vd. np.memmap read-only) - không copy
+            self.vectors = vectors
+        else:
+            self.vectors = np.ascontiguousarray(_normalize_rows(vectors))
+        # Record bất biến theo hàng: kết quả search trỏ thẳng vào đây, dùng chung giữa các request
+        self.records: Tuple[ChunkRecord, ...] = tuple(records)
+        self.ids = [record._id for record in self.records]
+        self.row_of: Dict[str, int] = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+        # Mỗi filter field → (vocab value→code, mảng code int32 theo hàng)
+        self._filter_vocab: Dict[str, Dict[Any, int]] = {}
+        self._filter_codes: Dict[str, np.ndarray] = {}
+        for field in FILTER_FIELDS:
+            vocab: Dict[Any, int] = {}
+            codes = np.fromiter(
+                (vocab.setdefault(record.get(field), len(vocab)) for record in self.records),
+                dtype=np.int32, count=len(self.records)
+            )
+            self._filter_vocab[field] = vocab
+            self._filter_codes[field] = codes
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def dimension(self) -> int:
+        return int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0
+
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_documents(cls, docs: Iterable[Dict[str, Any]], model_name: str = "") -> "LocalVectorIndex":
+        """Build từ documents có field ``embedding`` (output của data_loader / Mongo)"""
+        docs_with_emb = [doc for doc in docs if doc.get("embedding") is not None]
+        if not docs_with_emb:
+            return cls(np.zeros((0, 0), np.float32), [], model_name)
+        vectors = np.asarray([doc["embedding"] for doc in docs_with_emb], dtype=np.float32)
+        records = [ChunkRecord.from_document(doc) for doc in docs_with_emb]
+        return cls(vectors, records, model_name)
+
+    def save(self, path: Path, dtype: str = "float32") -> None:
+        write_embedding_artifact(path, self.vectors, self.records, self.model_name, dtype)
+
+    @classmethod
+    def load(cls, path: Path, corpus: Iterable[ChunkRecord], mmap: bool = True) -> "LocalVectorIndex":
+        """Load artifact, lấy record của từng hàng trong ``corpus`` theo bảng id.
+
+        ``mmap=True`` map embeddings.npy read-only (page cache dùng chung giữa các process).
+        ValueError nếu artifact không khớp corpus (thiếu id, text đã đổi).
+        """
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        ids = json.loads((path / "ids.json").read_text(encoding="utf-8"))
+        vectors = np.load(path / "embeddings.npy", mmap_mode="r" if mmap else None)
+        if not len(vectors) == len(ids) == meta.get("count", len(vectors)):
+            raise ValueError(
+                f"Artifact {path} không nhất quán: {len(vectors)} rows, {len(ids)} ids, meta {meta.get('count')}"
+            )
+        by_id = {record._id: record for record in corpus}
+        missing = [doc_id for doc_id in ids if doc_id not in by_id]
+        if missing:
+            raise ValueError(f"Artifact {path}: {len(missing)} id không có trong corpus (vd. {missing[0]!r})")
+        records = [by_id[doc_id] for doc_id in ids]
+        if meta.get("fingerprint") != corpus_fingerprint(records):
+            raise ValueError(f"Artifact {path}: text corpus đã thay đổi")
+        return cls(vectors, records, meta.get("model", ""), normalized=True)
+
+    # ------------------------------------------------------------------
+    def _candidate_rows(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Chỉ số hàng thỏa filter; None nghĩa là toàn bộ corpus"""
+        if not filters:
+            return None
+        mask = np.ones(len(self.records), dtype=bool)
+        for field, wanted in filters.items():
+            if field not in self._filter_vocab:
+                raise KeyError(f"Filter field '{field}' không được hỗ trợ: {FILTER_FIELDS}")
+            values = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            vocab = self._filter_vocab[field]
+            codes = [vocab[v] for v in values if v in vocab]
+            mask &= np.isin(self._filter_codes[field], codes)
+        return np.flatnonzero(mask)
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        min_score: Optional[float] = None,
+    ) -> List[Tuple[int, float]]:
+        """Top-k (row, score) theo cosine, score quy về thang [0, 1] như Atlas: (1 + cos) / 2"""
+        if not len(self.records) or k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        rows = self._candidate_rows(filters)
+        matrix = self.vectors if rows is None else self.vectors[rows]
+        if not len(matrix):
+            return []
+        scores = (1.0 + _cosine_scores(matrix, query)) / 2.0
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if min_score is not None:
+            top = top[scores[top] >= min_score]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def documents(
+        self,
+        query_vector: np.ndarray,
+        k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        min_score: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Như ``search`` nhưng trả về documents (bản copy nông) kèm ``score``"""
+        return [
+            {**self.records[row].to_dict(), "score": score}
+            for row, score in self.search(query_vector, k, filters, min_score)
+        ]
+
+    def similarities(self, query_vector: np.ndarray, doc_ids: List[str]) -> np.ndarray:
+        """Score cosine (thang [0, 1] như ``search``) của query với các document theo id;
+        id không có trong index → NaN. Chỉ đọc đúng các hàng cần, không quét cả ma trận."""
+        scores = np.full(len(doc_ids), np.nan, dtype=np.float32)
+        rows = np.fromiter((self.row_of.get(doc_id, -1) for doc_id in doc_ids), dtype=np.int64, count=len(doc_ids))
+        known = rows >= 0
+        if not known.any():
+            return scores
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores[known] = (1.0 + _cosine_scores(self.vectors[rows[known]], query)) / 2.0
+        return scores
+
+    def retrieve(
+        self,
+        query_vector: np.ndarray,
+        k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        min_score: Optional[float] = None,
+    ) -> RetrievalResult:
+        """Như ``search`` nhưng trả về records bất biến + mảng score (không copy document)"""
+        return RetrievalResult.from_pairs(
+            (self.records[row], score) for row, score in self.search(query_vector, k, filters, min_score)
+        )
+
+
+def load_or_build_local_index(path: Path, model_name: str, dtype: str = "float32") -> LocalVectorIndex:
+    """Load artifact đã persist; nếu chưa có (khác model, lệch corpus) thì build offline từ CHUNKS_DATA_DIR"""
+    path = Path(path)
+    if (path / "meta.json").exists():
+        from corpus_store import get_corpus_store
+
+        try:
+            index = LocalVectorIndex.load(path, get_corpus_store().docs)
+            if index.model_name == model_name and len(index):
+                logger.info("Loaded local vector index: %d docs from %s", len(index), path)
+                return index
+            logger.info("Local vector index at %s built with another model, rebuilding", path)
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Failed to load local vector index %s: %s", path, exc)
+
+    from data_loader import KinhDichDataLoader
+
+    docs = KinhDichDataLoader().build_documents()
+    index = LocalVectorIndex.from_documents(docs, model_name)
+    try:
+        index.save(path, dtype)
+    except OSError as exc:
+        logger.warning("Failed to persist local vector index %s: %s", path, exc)
+    logger.info("Built local vector index: %d docs", len(index))
+    return index
+
+
+# Singleton helpers -------------------------------------------------------------
+
+_local_index: Optional[LocalVectorIndex] = None
+_local_index_lock = threading.Lock()
+
+
+def get_local_index() -> LocalVectorIndex:
+    """Một index (một memmap) cho mọi agent trong process"""
+    global _local_index
+    if _local_index is None:
+        with _local_index_lock:
+            if _local_index is None:
+                from config import EMBED_MODEL, EMBEDDING_ARTIFACT_DTYPE, LOCAL_INDEX_DIR
+
+                _local_index = load_or_build_local_index(LOCAL_INDEX_DIR, EMBED_MODEL, EMBEDDING_ARTIFACT_DTYPE)
+    return _local_index